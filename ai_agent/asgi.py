@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_agent.settings')
+# Under ASGI the A2A endpoint uses the async view and the SDK's async client.
+os.environ.setdefault('A2A_ASYNC', 'True')
 
 application = get_asgi_application()
+
+from ai_app.startup import A2A_PRELOAD, preload  # noqa: E402
+
+# Under `gunicorn --preload` this runs once in the master and the forked
+# workers share what it loads; otherwise each worker does it as it boots,
+# before its first request.
+if A2A_PRELOAD:
+    preload()
@@ -77,6 +77,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ai_agent.wsgi.application'
 
+# Serve /ai/work with the async view (set by asgi.py, run under uvicorn workers).
+A2A_ASYNC = config("A2A_ASYNC", default=False, cast=bool)
+# Otherwise serve it with the plain Django view; False goes through DRF.
+A2A_FAST_PATH = config("A2A_FAST_PATH", default=True, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -85,6 +90,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets the workers read (conversation memory, stored answers)
+        # while one of them writes; IMMEDIATE takes the write lock up front
+        # instead of failing to upgrade a read lock under contention.
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -135,15 +148,34 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_FORMAT = config("LOG_FORMAT", default="json")  # json | text
+LOG_MAX_BYTES = config("LOG_MAX_BYTES", default=50 * 1024 * 1024, cast=int)
+LOG_BACKUP_COUNT = config("LOG_BACKUP_COUNT", default=5, cast=int)
+LOG_ROTATE_SECONDS = config("LOG_ROTATE_SECONDS", default=86400, cast=int)
+LOG_SAMPLE_EVERY = config("LOG_SAMPLE_EVERY", default=1, cast=int)
+LOG_QUEUE_SIZE = config("LOG_QUEUE_SIZE", default=10000, cast=int)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "handlers": {
         "file": {
-            "level": "INFO",
-            "class": "logging.FileHandler",
+            "level": LOG_LEVEL,
+            "class": "ai_app.log.QueueLogHandler",
             "filename": os.path.join(LOG_DIR, "ai_agent.log"),
-            "formatter": "verbose",
+            "max_bytes": LOG_MAX_BYTES,
+            "backup_count": LOG_BACKUP_COUNT,
+            "rotate_seconds": LOG_ROTATE_SECONDS,
+            "queue_size": LOG_QUEUE_SIZE,
+            "formatter": "json" if LOG_FORMAT == "json" else "verbose",
+            "filters": ["sample"],
+        },
+    },
+    "filters": {
+        "sample": {
+            "()": "ai_app.log.SamplingFilter",
+            "every": LOG_SAMPLE_EVERY,
         },
     },
     "formatters": {
@@ -151,9 +183,12 @@ LOGGING = {
             "format": "[{levelname}] {asctime} {name}: {message}",
             "style": "{",
         },
+        "json": {
+            "()": "ai_app.log.JsonFormatter",
+        },
     },
     "root": {
         "handlers": ["file"],
-        "level": "INFO",
+        "level": LOG_LEVEL,
     },
-}
\ No newline at end of file
+}
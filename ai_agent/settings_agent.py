@@ -0,0 +1,48 @@
+"""
+Lean settings for the agent service: DJANGO_SETTINGS_MODULE=ai_agent.settings_agent
+
+/ai/work is a stateless JSON-RPC endpoint. It has no use for the admin,
+users, sessions, flash messages or CSRF cookies, so this profile leaves
+those apps and their middleware out. That saves every worker the imports
+and memory, and every request the middleware. Everything else, including
+the A2A_*, GEMINI_* and LOG_* settings, comes from settings.py.
+
+Use settings.py when you need the admin (e.g. to browse stored
+conversations).
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'ai_app',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+            ],
+        },
+    },
+]
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Without these DRF (A2A_FAST_PATH=False) would load django.contrib.auth to
+# give every request an AnonymousUser.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+}
@@ -14,13 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path("ai/", include("ai_app.urls"))
     
     
 ]
+
+# The lean settings profile (settings_agent.py) leaves the admin out.
+if apps.is_installed("django.contrib.admin"):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_agent.settings')
 
 application = get_wsgi_application()
+
+from ai_app.startup import A2A_PRELOAD, preload  # noqa: E402
+
+# Under `gunicorn --preload` this runs once in the master and the forked
+# workers share what it loads; otherwise each worker does it as it boots,
+# before its first request.
+if A2A_PRELOAD:
+    preload()
@@ -0,0 +1,295 @@
+"""A2A message validation and task building, independent of the HTTP layer."""
+import hashlib
+import logging
+import uuid
+from datetime import datetime
+
+from decouple import config
+
+from .inputs import message_text
+from .postprocess import answer_parts, segment_part, CodeChecks, Splitter, A2A_SPLIT_CODE, CODE
+from .jsonrpc import JsonRpcError, INVALID_REQUEST, dumps, result_payload
+
+logger = logging.getLogger("ai")
+
+# Leave the `original_query` artifact and the `history` echo out of finished
+# tasks: both repeat text the client already has, and they make up most of
+# the response for short answers.
+A2A_COMPACT_RESULTS = config("A2A_COMPACT_RESULTS", default=False, cast=bool)
+
+MESSAGE_METHODS = ("message/send", "message/stream")
+
+
+def parse_message_send(params):
+    """Validate `message/send` params and return (message_data, user_text).
+
+    `user_text` is built from all the message's parts (see inputs.py).
+    """
+    message_data = params.get("message", {})
+
+    if not isinstance(message_data, dict):
+        logger.error("Malformed message parameter in A2A request.")
+        raise JsonRpcError(INVALID_REQUEST, "Invalid Request: 'params.message' is not an object.")
+
+    message_parts = message_data.get("parts", [])
+
+    if not isinstance(message_parts, list) or len(message_parts) == 0:
+        logger.error("Malformed message parts in A2A request.")
+        raise JsonRpcError(INVALID_REQUEST, "Invalid Request: 'params.message.parts' is missing, not a list, or empty.")
+
+    # Every part counts: text, files (inline or by URI) and data, in order.
+    user_text = message_text(message_parts)
+
+    if not user_text:
+        logger.warning("User message text is empty in A2A request.")
+        raise JsonRpcError(INVALID_REQUEST, "Invalid Request: 'params.message.parts' has no text.")
+
+    return message_data, user_text
+
+
+def resolve_context_id(message_data):
+    """contextId of the task answering a message: its contextId (or taskId) when continuing one.
+
+    A message that starts none gets its messageId, as before. Only an id
+    the client sent keys the conversation memory (see conversation_id).
+    """
+    return (
+        message_data.get("contextId")
+        or message_data.get("taskId")
+        or message_data.get("messageId")
+        or str(uuid.uuid4())
+    )
+
+
+def user_message(message_data, user_text):
+    return {
+        "kind": "message",
+        "role": "user",
+        "parts": [{"kind": "text", "text": user_text}],
+        "messageId": message_data.get("messageId")
+    }
+
+
+def conversation_id(message_data, owner):
+    """Key of the conversation memory for a message: the contextId (or taskId) the client sent, of `owner`.
+
+    `owner` is the tenant asking (tenants.tenant_of()), so a contextId sent
+    by someone else names another conversation. None for a message that
+    does not continue a conversation, which is answered on its own (and may
+    come from the response cache) even though its result carries a contextId
+    from resolve_context_id(). A client that wants its first message
+    remembered sends a contextId of its own.
+    """
+    context_id = message_data.get("contextId") or message_data.get("taskId")
+    if not context_id:
+        return None
+    return hashlib.sha256(f"{owner}\n{context_id}".encode()).hexdigest()
+
+
+def build_task_result(message_data, user_text, ai_agent_response, metadata=None, context_id=None, task_id=None, parts=None):
+    """Build the completed A2A task returned for a `message/send` call.
+
+    `metadata` (e.g. the response cache status) goes into the task's
+    `metadata` field. With A2A_COMPACT_RESULTS the `original_query`
+    artifact and the `history` are left out. `parts` are the answer's
+    parts when already built (see postprocess.answer_parts_async); the
+    message and the `agent_response` artifact share them.
+    """
+
+    # Create response parts with proper A2A structure
+    parts_response = answer_parts(ai_agent_response) if parts is None else parts
+
+    # Generate proper IDs
+    response_message_id = str(uuid.uuid4())
+    task_id = task_id or str(uuid.uuid4())
+    context_id = context_id or resolve_context_id(message_data)
+
+    # Build the response message in A2A format
+    response_message = {
+        "kind": "message",
+        "role": "agent",
+        "parts": parts_response,
+        "messageId": response_message_id,
+        "taskId": task_id
+    }
+
+    # Build artifacts
+    artifacts = [
+        {
+            "artifactId": str(uuid.uuid4()),
+            "name": "agent_response",
+            "parts": parts_response
+        }
+    ]
+
+    # Build the task result
+    result = {
+        "id": task_id,
+        "contextId": context_id,
+        "kind": "task",
+        "status": {
+            "state": "completed",
+            "timestamp": datetime.utcnow().isoformat(),
+            "message": response_message
+        },
+        "artifacts": artifacts,
+    }
+
+    if not A2A_COMPACT_RESULTS:
+        artifacts.append({
+            "artifactId": str(uuid.uuid4()),
+            "name": "original_query",
+            "parts": [{"kind": "text", "text": user_text}]
+        })
+        result["history"] = [
+            user_message(message_data, user_text),
+            response_message
+        ]
+    if metadata:
+        result["metadata"] = metadata
+    return result
+
+
+def sse_event(payload):
+    """Encode one JSON-RPC payload as a server-sent event."""
+    return b"data: " + dumps(payload) + b"\n\n"
+
+
+class TaskStream:
+    """Builds the A2A events sent over SSE for one `message/stream` call.
+
+    Events are JSON-RPC responses whose result is a task, a `status-update`
+    or an `artifact-update`, in the order a client expects: submitted task,
+    working status, one artifact chunk per Gemini chunk, final status.
+
+    With A2A_SPLIT_CODE every prose run and code block of the answer is an
+    artifact of its own, streamed as the Splitter finds it (see
+    postprocess.py), and the final message carries the split parts.
+    """
+
+    def __init__(self, request_id, message_data, user_text, conversation=None):
+        self.request_id = request_id
+        self.message_data = message_data
+        self.user_text = user_text
+        # The conversation memory key, from conversation_id().
+        self.conversation = conversation
+        self.task_id = str(uuid.uuid4())
+        self.context_id = resolve_context_id(message_data)
+        self.artifact_id = str(uuid.uuid4())
+        self.chunks = []
+        self.splitter = Splitter() if A2A_SPLIT_CODE else None
+        self.checks = CodeChecks() if A2A_SPLIT_CODE else None
+        # Per segment: its artifact id, and its part once the segment is complete.
+        self._artifact_ids = {}
+        self._parts = {}
+
+    def _event(self, result):
+        return sse_event(result_payload(self.request_id, result))
+
+    def _status(self, state, final, message=None, metadata=None):
+        status = {"state": state, "timestamp": datetime.utcnow().isoformat()}
+        if message is not None:
+            status["message"] = message
+        event = {
+            "kind": "status-update",
+            "taskId": self.task_id,
+            "contextId": self.context_id,
+            "status": status,
+            "final": final,
+        }
+        if metadata:
+            event["metadata"] = metadata
+        return self._event(event)
+
+    def start(self):
+        return self._event({
+            "id": self.task_id,
+            "contextId": self.context_id,
+            "kind": "task",
+            "status": {"state": "submitted", "timestamp": datetime.utcnow().isoformat()},
+            "history": [user_message(self.message_data, self.user_text)],
+        }) + self._status("working", False)
+
+    def chunk(self, text):
+        """Events for one Gemini chunk; may be empty while the splitter holds a line back."""
+        if self.splitter is not None:
+            return b"".join(self._piece_event(piece) for piece in self.splitter.feed(text))
+        append = bool(self.chunks)
+        self.chunks.append(text)
+        return self._event({
+            "kind": "artifact-update",
+            "taskId": self.task_id,
+            "contextId": self.context_id,
+            "artifact": {
+                "artifactId": self.artifact_id,
+                "name": "agent_response",
+                "parts": [{"kind": "text", "text": text}],
+            },
+            "append": append,
+            "lastChunk": False,
+        })
+
+    def _piece_event(self, piece):
+        artifact_id = self._artifact_ids.get(piece.segment)
+        append = artifact_id is not None
+        if not append:
+            artifact_id = self._artifact_ids[piece.segment] = str(uuid.uuid4())
+        artifact = {
+            "artifactId": artifact_id,
+            "name": "code" if piece.kind == CODE else "agent_response",
+            "parts": [{"kind": "text", "text": piece.text}],
+        }
+        if piece.kind == CODE:
+            artifact["metadata"] = {"type": CODE, "language": piece.language}
+        if piece.last:
+            # Starts the syntax check now, while the rest of the answer streams.
+            self._parts[piece.segment] = segment_part(self.splitter.segments[piece.segment], self.checks)
+        return self._event({
+            "kind": "artifact-update",
+            "taskId": self.task_id,
+            "contextId": self.context_id,
+            "artifact": artifact,
+            "append": append,
+            "lastChunk": piece.last,
+        })
+
+    def _finish(self):
+        if self.splitter is None:
+            return b""
+        return b"".join(self._piece_event(piece) for piece in self.splitter.close())
+
+    def _answer_message(self):
+        if self.splitter is None:
+            parts = [{"kind": "text", "text": "".join(self.chunks)}]
+        else:
+            parts = [self._parts[index] for index in sorted(self._parts)] or [{"kind": "text", "text": ""}]
+        return {
+            "kind": "message",
+            "role": "agent",
+            "parts": parts,
+            "messageId": str(uuid.uuid4()),
+            "taskId": self.task_id,
+        }
+
+    def complete(self, metadata=None):
+        """The last artifact events, then the final status; waits up to A2A_CHECK_WAIT for syntax checks."""
+        tail = self._finish()
+        if self.checks is not None:
+            self.checks.collect()
+        return tail + self._status("completed", True, self._answer_message(), metadata)
+
+    async def complete_async(self, metadata=None):
+        tail = self._finish()
+        if self.checks is not None:
+            await self.checks.collect_async()
+        return tail + self._status("completed", True, self._answer_message(), metadata)
+
+    def fail(self, error_message):
+        message = {
+            "kind": "message",
+            "role": "agent",
+            "parts": [{"kind": "text", "text": error_message}],
+            "messageId": str(uuid.uuid4()),
+            "taskId": self.task_id,
+        }
+        return self._status("failed", True, message)
@@ -1,3 +1,26 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import TenantUsage
+
+
+@admin.register(TenantUsage)
+class TenantUsageAdmin(admin.ModelAdmin):
+    """Per-tenant consumption and latency, one row per tenant and hour (see tenants.py)."""
+    list_display = (
+        "tenant", "period", "requests", "rejected", "errors", "prompt_tokens", "cached_tokens",
+        "output_tokens", "avg_latency_ms", "max_latency_ms",
+    )
+    search_fields = ("tenant",)
+    date_hierarchy = "period"
+    ordering = ("-period", "tenant")
+
+    @admin.display(description="avg latency (ms)")
+    def avg_latency_ms(self, usage):
+        return round(usage.total_latency_ms / usage.requests, 1) if usage.requests else None
+
+    # Written by the workers only.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
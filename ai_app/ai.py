@@ -1,28 +1,32 @@
-from google import genai
-from decouple import config
+from asgiref.sync import sync_to_async
+from .answers import build_answer_store, REUSED
+from .batch import run_batch, run_batch_async
+from .breaker import build_breaker, CircuitOpen, BREAKER_SERVE_STORED
+from .cache import build_response_cache, cache_key, BYPASS, EMBEDDING_MODEL
+from .clients import api_key, get_client
+from .context_cache import build_context_cache
+from .deadline import check_deadline, timeout_ms, DeadlineExceeded
+from .inputs import get_chunk_executor, map_prompt, needs_chunking, question_of, reduce_prompt, split_chunks, A2A_CHUNK_CONCURRENCY
+from .governor import add_usage, estimate_request_tokens, usage_record, used_tokens, UsageStats
+from .log import SAMPLED
+from .memory import build_conversation_memory
+from .metrics import observe, timer
+from .router import build_model_router, should_fall_back, GEMINI_MODEL
+from .singleflight import build_single_flight
+from .tenants import charge
+import asyncio
+import inspect
 import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 
 logger = logging.getLogger("ai")
 
-api_key = config("GEMINI_API_KEY", default=None)
+MODEL = GEMINI_MODEL
 
-class Ai_Agent:
-    def __init__(self):
-        
-        if not api_key:
-            raise ValueError ("Gemini API key not found in environment variables.")
-        try:
-             self.client = genai.Client(api_key=api_key)
-        except Exception as e:
-            logger.critical("Gemini API key not found in environment variables.")
-            raise ValueError(f"Failed to configure Google Generative AI: {e}") from e
-       
-    
-    
-    def gemini_response(self, user_text, *args, **kwargs):
-        logger.debug(f"Sending request to Gemini API: '{user_text[:50]}...'")
-        try:
-            system_prompt = """
+SYSTEM_PROMPT = """
              You are an expert programming assistant integrated into Telex IM, powered by Google Gemini.
                 Your primary goal is to help developers by providing clear, concise, and accurate explanations or code examples.
                 - Answer questions about programming languages (especially Python, Django, JavaScript), frameworks, concepts, algorithms, etc.
@@ -43,17 +47,655 @@ class Ai_Agent:
                 This iterates over each element (`item`) in `my_list
                 
             """
-            user_text = user_text
-            gemini_response =  self.client.models.generate_content(model="gemini-2.5-flash", contents = f"{system_prompt} and here your question = {user_text}"
-                
-            )
-            
-            
-            
-            response = gemini_response.candidates[0].content.parts[0].text
-            logger.info(f"Received response from Gemini API: '{response[:50]}...'")
-            return response
+
+# Sent as the SDK's `system_instruction` (or from a context cache) rather
+# than pasted in front of every question; indentation costs tokens too.
+SYSTEM_INSTRUCTION = inspect.cleandoc(SYSTEM_PROMPT)
+
+
+def build_contents(user_text, history=None):
+    """Gemini `contents` for a question, after any earlier turns of the conversation."""
+    if not history:
+        return user_text
+    return [*history, {"role": "user", "parts": [{"text": user_text}]}]
+
+
+class Turn:
+    """One user message and the prompt sent for it.
+
+    The prompt is the message itself, or for a message too long to send
+    whole, its condensed form (see Ai_Agent._condense), built only when
+    Gemini is actually called. Caches and single-flight key on the message,
+    which is stable, not on the condensed prompt, which is not.
+    """
+
+    __slots__ = ("text", "prompt")
+
+    def __init__(self, text):
+        self.text = text
+        self.prompt = None if needs_chunking(text) else text
+
+    def remembered(self):
+        """What the conversation keeps of this turn: the prompt, or the question if it was never condensed."""
+        return self.prompt or question_of(self.text)
+
+
+class Ai_Agent:
+    def __init__(self):
         
+        if not api_key:
+            raise ValueError ("Gemini API key not found in environment variables.")
+        try:
+             self.client = get_client()
         except Exception as e:
-            logger.error(f"Error connecting to Gemini API: {e}", exc_info=True)
-            return (f'there was an error connecting to gemini via api, please make sure api is valid error:{e}')
\ No newline at end of file
+            logger.critical("Gemini API key not found in environment variables.")
+            raise ValueError(f"Failed to configure Google Generative AI: {e}") from e
+        self.router = build_model_router()
+        self.governor = self.router.governor(MODEL)
+        self.usage = UsageStats()
+        self.context_cache = build_context_cache(self.client, MODEL, SYSTEM_INSTRUCTION)
+        from google.genai import types
+
+        self._config = types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+        self.cache = build_response_cache(embed=self.embed)
+        self.flights = build_single_flight()
+        self.memory = build_conversation_memory(summarize=self.summarize)
+        self.answers = build_answer_store()
+        self.breaker = build_breaker()
+       
+    
+    
+    def embed(self, text):
+        """Embedding vector for `text`, used by the semantic response cache."""
+        result = self.client.models.embed_content(model=EMBEDDING_MODEL, contents=text)
+        return result.embeddings[0].values
+
+    def _complete(self, prompt):
+        """Plain completion without the assistant persona: the SDK's response."""
+        with self._guard() as outcome:
+            return self.governor.call(
+                self._upstream(lambda: self.client.models.generate_content(model=MODEL, contents=prompt, config=self._with_deadline(None)), outcome),
+                estimate_request_tokens(prompt),
+            )
+
+    async def _complete_async(self, prompt):
+        with self._guard() as outcome:
+            return await self.governor.call_async(
+                self._upstream_async(lambda: self.client.aio.models.generate_content(model=MODEL, contents=prompt, config=self._with_deadline(None)), outcome),
+                estimate_request_tokens(prompt),
+            )
+
+    def summarize(self, prompt):
+        """Plain completion without the assistant persona, used to compact conversation memory."""
+        response = self._complete(prompt)
+        self._record_usage(response, None)
+        return response.text
+
+    async def summarize_async(self, prompt):
+        response = await self._complete_async(prompt)
+        self._record_usage(response, None)
+        return response.text
+
+    @staticmethod
+    def _map_prompts(user_text):
+        """The question and one notes prompt per chunk, with the tenant charged for them up front.
+
+        The tenant's admission only covered one call about `user_text`; the
+        map calls are charged before any of them runs, so a message its
+        quota cannot pay for is refused (QuotaExceeded) instead of half done.
+        """
+        question = question_of(user_text)
+        chunks = split_chunks(user_text)
+        logger.info("Condensing %s characters in %s chunks.", len(user_text), len(chunks))
+        prompts = [map_prompt(question, chunk, index, len(chunks)) for index, chunk in enumerate(chunks, 1)]
+        charge(sum(estimate_request_tokens(prompt) for prompt in prompts))
+        return question, prompts
+
+    def _condense(self, user_text, meta):
+        """Map-reduce a message too long to send whole: notes on every chunk, in parallel.
+
+        Returns the prompt that replaces `user_text`: the user's question
+        followed by the notes, in chunk order. The map calls' usage is added
+        to `meta`, so the tenant is settled for all of them.
+        """
+        question, prompts = self._map_prompts(user_text)
+        with timer("condense"):
+            responses = run_batch(self._complete, prompts, A2A_CHUNK_CONCURRENCY, get_chunk_executor())
+        for response in responses:
+            self._record_usage(response, meta)
+        meta["chunks"] = len(prompts)
+        return reduce_prompt(question, [response.text for response in responses])
+
+    async def _condense_async(self, user_text, meta):
+        question, prompts = self._map_prompts(user_text)
+        with timer("condense"):
+            responses = await run_batch_async(self._complete_async, prompts, A2A_CHUNK_CONCURRENCY)
+        for response in responses:
+            self._record_usage(response, meta)
+        meta["chunks"] = len(prompts)
+        return reduce_prompt(question, [response.text for response in responses])
+
+    def _prompt(self, turn, meta):
+        """The prompt to send for `turn`, condensing the message on first use."""
+        if turn.prompt is None:
+            turn.prompt = self._condense(turn.text, meta)
+        return turn.prompt
+
+    async def _prompt_async(self, turn, meta):
+        if turn.prompt is None:
+            turn.prompt = await self._condense_async(turn.text, meta)
+        return turn.prompt
+
+    def _generate_config(self, model=MODEL):
+        # The context cache belongs to one model; the others get the instruction inline.
+        if self.context_cache is None or model != self.context_cache.model:
+            return self._config
+        return self.context_cache.generate_config()
+
+    async def _generate_config_async(self, model=MODEL):
+        if self.context_cache is None or model != self.context_cache.model:
+            return self._config
+        if self.context_cache.needs_refresh():
+            return await asyncio.to_thread(self.context_cache.generate_config)
+        return self.context_cache.generate_config()
+
+    @staticmethod
+    def _with_deadline(generate_config):
+        """`generate_config` with the time left before the request deadline as its HTTP timeout."""
+        timeout = timeout_ms()
+        if timeout is None:
+            return generate_config
+        from google.genai import types
+
+        http_options = types.HttpOptions(timeout=timeout)
+        if generate_config is None:
+            return types.GenerateContentConfig(http_options=http_options)
+        return generate_config.model_copy(update={"http_options": http_options})
+
+    @contextmanager
+    def _guard(self):
+        """The circuit breaker around a Gemini call, yielding a dict for the time Gemini took.
+
+        "seconds" starts at 0 and is set by _upstream() (a stream sets its
+        time to first chunk): waits in the governor queue and between
+        retries are this worker's load, not Gemini's slowness.
+        """
+        if self.breaker is None:
+            yield {}
+            return
+        with self.breaker.guard() as outcome:
+            outcome["seconds"] = 0.0
+            yield outcome
+
+    @staticmethod
+    def _upstream(fn, *outcomes):
+        """`fn` (one generate_content call) putting how long it took in every dict of `outcomes`."""
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                seconds = time.perf_counter() - started
+                for outcome in outcomes:
+                    outcome["seconds"] = seconds
+        return timed
+
+    @staticmethod
+    def _upstream_async(coro_fn, *outcomes):
+        async def timed():
+            started = time.perf_counter()
+            try:
+                return await coro_fn()
+            finally:
+                seconds = time.perf_counter() - started
+                for outcome in outcomes:
+                    outcome["seconds"] = seconds
+        return timed
+
+    def _stored_answer(self, user_text, meta, error):
+        """While the circuit is open: a stored answer to a similar question, from any model; else `error`."""
+        if not BREAKER_SERVE_STORED or self.answers is None:
+            raise error
+        past = self.answers.similar(None, user_text)
+        if past is None:
+            raise error
+        meta["cache"] = REUSED
+        meta["degraded"] = True
+        return past
+
+    async def _stored_answer_async(self, user_text, meta, error):
+        if not BREAKER_SERVE_STORED or self.answers is None:
+            raise error
+        past = await sync_to_async(self.answers.similar)(None, user_text)
+        if past is None:
+            raise error
+        meta["cache"] = REUSED
+        meta["degraded"] = True
+        return past
+
+    def _record_usage(self, response, meta):
+        record = usage_record(response)
+        if record is None:
+            return
+        self.usage.add(record)
+        if meta is not None:
+            # Summed: a condensed message's map calls come before the answer's.
+            meta["usage"] = add_usage(meta.get("usage"), record)
+        logger.info(
+            "Gemini tokens: prompt=%s cached=%s output=%s total=%s",
+            record["prompt_tokens"], record["cached_tokens"], record["output_tokens"], record["total_tokens"],
+            extra=SAMPLED,
+        )
+
+    def gemini_response(self, user_text, *args, meta=None, context_id=None, tier=None, **kwargs):
+        """Answer `user_text`, from the response cache when possible.
+
+        With a `context_id` the earlier turns of that conversation are sent
+        along and the new turn is remembered. Concurrent calls for the same
+        normalized prompt share one upstream request. The model is picked by
+        the router (see router.py), honouring the `tier` the client asked
+        for. If `meta` is a dict it receives details about how the answer was
+        produced (model, cache status, whether it was coalesced, token
+        usage), for the A2A result metadata.
+
+        Text longer than A2A_CHUNK_THRESHOLD is condensed (see _condense)
+        before it is sent, and only then: the cache and single-flight key on
+        the text itself, so the same long message is answered from the cache
+        or joins the call in flight without being condensed again. The
+        conversation keeps the condensed prompt (see Turn).
+
+        Failures are raised, never returned as the answer: CapacityExceeded
+        when the governor has no Gemini capacity left, DeadlineExceeded when
+        the request's deadline passed (deadline.py), CircuitOpen while the
+        circuit breaker keeps calls away from a failing Gemini (breaker.py;
+        a stored answer is returned instead when there is one), the SDK's
+        error otherwise.
+        """
+        meta = {} if meta is None else meta
+        history = self.memory.contents(context_id) if self.memory is not None and context_id else []
+        turn = Turn(user_text)
+        try:
+            response = self._answer(turn, history, meta, tier)
+        except CircuitOpen as e:
+            response = self._stored_answer(user_text, meta, e)
+        except DeadlineExceeded as e:
+            logger.warning("%s", e)
+            raise
+        except Exception as e:
+            logger.error("Error connecting to Gemini API: %s", e, exc_info=True)
+            raise
+
+        if self.memory is not None and context_id:
+            self.memory.record(context_id, turn.remembered(), response)
+        return response
+
+    def _answer(self, turn, history, meta, tier=None):
+        user_text = turn.text
+        model = self.router.choose(user_text, tier, follow_up=bool(history))
+        if history:
+            # Follow-ups depend on the conversation, so they are neither cached nor coalesced.
+            meta["cache"] = BYPASS
+            return self._generate(turn, history=history, meta=meta, model=model)
+
+        vector = None
+        if self.cache is not None:
+            cached, meta["cache"], vector = self.cache.lookup(model, user_text)
+            if cached is not None:
+                logger.info("Serving cached answer (%s) for: '%s...'", meta['cache'], user_text[:50], extra=SAMPLED)
+                return cached
+
+        past = self._past_answer(model, user_text, meta)
+        if past is not None:
+            return past
+
+        if self.flights is None:
+            return self._generate(turn, vector, meta=meta, model=model)
+        response, shared = self.flights.do(
+            cache_key(model, user_text),
+            lambda: self._generate(turn, vector, meta=meta, model=model),
+            recheck=lambda: self._peek_cache(user_text, model),
+        )
+        if shared:
+            meta["coalesced"] = True
+        return response
+
+    def _generate(self, turn, vector=None, history=None, meta=None, model=MODEL):
+        # Stores into the cache before returning, i.e. while a cross-worker
+        # flight lock is still held, so the next worker's recheck sees it.
+        prompt = self._prompt(turn, meta)
+        logger.debug("Sending request to Gemini API: '%s...'", prompt[:50])
+        contents = build_contents(prompt, history)
+        tokens = estimate_request_tokens(contents)
+
+        def call(candidate, retries, timing):
+            generate_config = self._generate_config(candidate)
+            return self.router.governor(candidate).call(
+                self._upstream(lambda: self.client.models.generate_content(model=candidate, contents=contents, config=self._with_deadline(generate_config)), outcome, timing),
+                tokens, retries,
+            )
+
+        started = time.perf_counter()
+        with self._guard() as outcome:
+            gemini_response, used_model = self.router.run(model, call)
+        self._record_model(used_model, model, meta)
+        self._record_usage(gemini_response, meta)
+        response = gemini_response.candidates[0].content.parts[0].text
+        logger.info("Received response from Gemini API: '%s...'", response[:50], extra=SAMPLED)
+        self._store_answer(prompt, response, used_model, gemini_response, time.perf_counter() - started, history)
+        if self.cache is not None and not history:
+            self.cache.store(model, turn.text, response, vector)
+        return response
+
+    @staticmethod
+    def _record_model(used_model, model, meta):
+        if meta is None:
+            return
+        meta["model"] = used_model
+        if used_model != model:
+            meta["fallback"] = True
+
+    def _peek_cache(self, user_text, model=MODEL):
+        # Another worker may have answered while we waited for the flight lock.
+        return self.cache.peek(model, user_text) if self.cache is not None else None
+
+    def _past_answer(self, model, user_text, meta):
+        if self.answers is None or not self.answers.reuse:
+            return None
+        past = self.answers.similar(model, user_text)
+        if past is not None:
+            meta["cache"] = REUSED
+        return past
+
+    async def _past_answer_async(self, model, user_text, meta):
+        if self.answers is None or not self.answers.reuse:
+            return None
+        past = await sync_to_async(self.answers.similar)(model, user_text)
+        if past is not None:
+            meta["cache"] = REUSED
+        return past
+
+    def _store_answer(self, user_text, response, model, gemini_response, seconds, history=None):
+        # Only queues the row; the answer store writes it in the background.
+        if self.answers is not None:
+            self.answers.record(user_text, response, model, usage_record(gemini_response), seconds, bool(history))
+
+    async def gemini_response_async(self, user_text, *args, meta=None, context_id=None, tier=None, **kwargs):
+        """Same as gemini_response but awaits the SDK's async client (`client.aio`)."""
+        meta = {} if meta is None else meta
+        history = await self._history_async(context_id)
+        turn = Turn(user_text)
+        try:
+            response = await self._answer_async(turn, history, meta, tier)
+        except CircuitOpen as e:
+            response = await self._stored_answer_async(user_text, meta, e)
+        except DeadlineExceeded as e:
+            logger.warning("%s", e)
+            raise
+        except Exception as e:
+            logger.error("Error connecting to Gemini API: %s", e, exc_info=True)
+            raise
+
+        await self._remember_async(context_id, turn.remembered(), response)
+        return response
+
+    async def _answer_async(self, turn, history, meta, tier=None):
+        user_text = turn.text
+        model = self.router.choose(user_text, tier, follow_up=bool(history))
+        if history:
+            meta["cache"] = BYPASS
+            return await self._generate_async(turn, history=history, meta=meta, model=model)
+
+        vector = None
+        if self.cache is not None:
+            cached, meta["cache"], vector = await self._run_cache(self.cache.lookup, model, user_text)
+            if cached is not None:
+                logger.info("Serving cached answer (%s) for: '%s...'", meta['cache'], user_text[:50], extra=SAMPLED)
+                return cached
+
+        past = await self._past_answer_async(model, user_text, meta)
+        if past is not None:
+            return past
+
+        if self.flights is None:
+            return await self._generate_async(turn, vector, meta=meta, model=model)
+        response, shared = await self.flights.do_async(
+            cache_key(model, user_text),
+            lambda: self._generate_async(turn, vector, meta=meta, model=model),
+            recheck=lambda: self._peek_cache(user_text, model),
+        )
+        if shared:
+            meta["coalesced"] = True
+        return response
+
+    async def _generate_async(self, turn, vector=None, history=None, meta=None, model=MODEL):
+        prompt = await self._prompt_async(turn, meta)
+        logger.debug("Sending async request to Gemini API: '%s...'", prompt[:50])
+        contents = build_contents(prompt, history)
+        tokens = estimate_request_tokens(contents)
+
+        async def call(candidate, retries, timing):
+            generate_config = await self._generate_config_async(candidate)
+            return await self.router.governor(candidate).call_async(
+                self._upstream_async(lambda: self.client.aio.models.generate_content(model=candidate, contents=contents, config=self._with_deadline(generate_config)), outcome, timing),
+                tokens, retries,
+            )
+
+        started = time.perf_counter()
+        with self._guard() as outcome:
+            gemini_response, used_model = await self.router.run_async(model, call)
+        self._record_model(used_model, model, meta)
+        self._record_usage(gemini_response, meta)
+        response = gemini_response.candidates[0].content.parts[0].text
+        logger.info("Received response from Gemini API: '%s...'", response[:50], extra=SAMPLED)
+        self._store_answer(prompt, response, used_model, gemini_response, time.perf_counter() - started, history)
+        if self.cache is not None and not history:
+            await self._run_cache(self.cache.store, model, turn.text, response, vector)
+        return response
+
+    async def _run_cache(self, func, *args):
+        # Disk, cache-server and embedding lookups block, keep them off the event loop.
+        if self.cache.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _history_async(self, context_id):
+        if self.memory is None or not context_id:
+            return []
+        if self.memory.store.blocking:
+            return await sync_to_async(self.memory.contents)(context_id)
+        return self.memory.contents(context_id)
+
+    async def _remember_async(self, context_id, user_text, response):
+        if self.memory is None or not context_id:
+            return
+        if self.memory.store.blocking:
+            await sync_to_async(self.memory.record)(context_id, user_text, response)
+        else:
+            self.memory.record(context_id, user_text, response)
+
+    def gemini_stream(self, user_text, *args, meta=None, context_id=None, tier=None, **kwargs):
+        """Yield the answer text chunk by chunk as Gemini generates it.
+
+        Unlike gemini_response, errors are raised so the caller can turn them
+        into an error event on a stream that has already started. A cached
+        answer is yielded as a single chunk. A model that fails before its
+        first chunk is replaced by the next fallback model. The request
+        deadline is checked as chunks arrive. While the circuit breaker is
+        open a stored answer is yielded instead, when there is one.
+        """
+        meta = {} if meta is None else meta
+        history = self.memory.contents(context_id) if self.memory is not None and context_id else []
+        turn = Turn(user_text)
+        model = self.router.choose(user_text, tier, follow_up=bool(history))
+        vector = None
+        if history:
+            meta["cache"] = BYPASS
+        else:
+            cached = None
+            if self.cache is not None:
+                cached, meta["cache"], vector = self.cache.lookup(model, user_text)
+            if cached is None:
+                cached = self._past_answer(model, user_text, meta)
+            if cached is not None:
+                yield cached
+                if self.memory is not None and context_id:
+                    self.memory.record(context_id, turn.remembered(), cached)
+                return
+        prompt = self._prompt(turn, meta)
+        logger.debug("Sending streaming request to Gemini API: '%s...'", prompt[:50])
+        chunks = []
+        contents = build_contents(prompt, history)
+        tokens = estimate_request_tokens(contents)
+        last_chunk = None
+        candidates = self.router.candidates(model)
+        try:
+            with self._guard() as outcome:
+                for index, candidate in enumerate(candidates):
+                    generate_config = self._generate_config(candidate)
+                    started = None
+                    try:
+                        with self.router.governor(candidate).slot(tokens) as usage:
+                            started = time.perf_counter()
+                            for chunk in self.client.models.generate_content_stream(model=candidate, contents=contents, config=self._with_deadline(generate_config)):
+                                check_deadline()
+                                usage["tokens"] = used_tokens(chunk) or usage.get("tokens")
+                                if chunk.usage_metadata is not None:
+                                    last_chunk = chunk
+                                text = chunk.text
+                                if not text:
+                                    continue
+                                if not chunks:
+                                    ttft = outcome["seconds"] = time.perf_counter() - started
+                                    observe("upstream_ttft", ttft)
+                                    logger.info("First Gemini token after %.0f ms", ttft * 1000, extra=SAMPLED)
+                                chunks.append(text)
+                                yield text
+                    except Exception as e:
+                        if not chunks and started is not None:
+                            # Failed before its first chunk: judged by how long Gemini took to fail.
+                            outcome["seconds"] = time.perf_counter() - started
+                        if chunks or index == len(candidates) - 1 or not should_fall_back(e):
+                            raise
+                        self.router.record_failure(candidate, e)
+                        continue
+                    elapsed = time.perf_counter() - started
+                    observe("upstream_total", elapsed)
+                    self.router.record_success(candidate, elapsed, candidate != model)
+                    self._record_model(candidate, model, meta)
+                    break
+        except CircuitOpen as e:
+            stored = self._stored_answer(user_text, meta, e)
+            yield stored
+            if self.memory is not None and context_id:
+                self.memory.record(context_id, turn.remembered(), stored)
+            return
+        if last_chunk is not None:
+            self._record_usage(last_chunk, meta)
+        if not chunks:
+            return
+        response = "".join(chunks)
+        self._store_answer(prompt, response, candidate, last_chunk, elapsed, history)
+        if self.cache is not None and not history:
+            self.cache.store(model, user_text, response, vector)
+        if self.memory is not None and context_id:
+            self.memory.record(context_id, turn.remembered(), response)
+
+    async def gemini_stream_async(self, user_text, *args, meta=None, context_id=None, tier=None, **kwargs):
+        """Async version of gemini_stream using `client.aio`."""
+        meta = {} if meta is None else meta
+        history = await self._history_async(context_id)
+        turn = Turn(user_text)
+        model = self.router.choose(user_text, tier, follow_up=bool(history))
+        vector = None
+        if history:
+            meta["cache"] = BYPASS
+        else:
+            cached = None
+            if self.cache is not None:
+                cached, meta["cache"], vector = await self._run_cache(self.cache.lookup, model, user_text)
+            if cached is None:
+                cached = await self._past_answer_async(model, user_text, meta)
+            if cached is not None:
+                yield cached
+                await self._remember_async(context_id, turn.remembered(), cached)
+                return
+        prompt = await self._prompt_async(turn, meta)
+        logger.debug("Sending async streaming request to Gemini API: '%s...'", prompt[:50])
+        chunks = []
+        contents = build_contents(prompt, history)
+        tokens = estimate_request_tokens(contents)
+        last_chunk = None
+        candidates = self.router.candidates(model)
+        try:
+            with self._guard() as outcome:
+                for index, candidate in enumerate(candidates):
+                    generate_config = await self._generate_config_async(candidate)
+                    started = None
+                    try:
+                        async with self.router.governor(candidate).slot_async(tokens) as usage:
+                            started = time.perf_counter()
+                            async for chunk in await self.client.aio.models.generate_content_stream(model=candidate, contents=contents, config=self._with_deadline(generate_config)):
+                                check_deadline()
+                                usage["tokens"] = used_tokens(chunk) or usage.get("tokens")
+                                if chunk.usage_metadata is not None:
+                                    last_chunk = chunk
+                                text = chunk.text
+                                if not text:
+                                    continue
+                                if not chunks:
+                                    ttft = outcome["seconds"] = time.perf_counter() - started
+                                    observe("upstream_ttft", ttft)
+                                    logger.info("First Gemini token after %.0f ms", ttft * 1000, extra=SAMPLED)
+                                chunks.append(text)
+                                yield text
+                    except Exception as e:
+                        if not chunks and started is not None:
+                            # Failed before its first chunk: judged by how long Gemini took to fail.
+                            outcome["seconds"] = time.perf_counter() - started
+                        if chunks or index == len(candidates) - 1 or not should_fall_back(e):
+                            raise
+                        self.router.record_failure(candidate, e)
+                        continue
+                    elapsed = time.perf_counter() - started
+                    observe("upstream_total", elapsed)
+                    self.router.record_success(candidate, elapsed, candidate != model)
+                    self._record_model(candidate, model, meta)
+                    break
+        except CircuitOpen as e:
+            stored = await self._stored_answer_async(user_text, meta, e)
+            yield stored
+            await self._remember_async(context_id, turn.remembered(), stored)
+            return
+        if last_chunk is not None:
+            self._record_usage(last_chunk, meta)
+        if not chunks:
+            return
+        response = "".join(chunks)
+        self._store_answer(prompt, response, candidate, last_chunk, elapsed, history)
+        if self.cache is not None and not history:
+            await self._run_cache(self.cache.store, model, user_text, response, vector)
+        await self._remember_async(context_id, turn.remembered(), response)
+
+
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def get_agent():
+    """Return the shared Ai_Agent, built lazily on first use."""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = Ai_Agent()
+    return _agent
+
+
+def _reset_agent():
+    global _agent, _agent_lock
+    _agent = None
+    _agent_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_agent)
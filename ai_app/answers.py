@@ -0,0 +1,222 @@
+"""Persistent store of the answers Gemini gave, searchable with SQLite FTS5.
+
+With ANSWER_STORE on, every answer Gemini generates (not the ones served
+from the response cache) is kept as an Answer row. The row holds the
+question, the answer, the model, the token counts and the latency. That
+is enough to run analytics with SQL instead of grepping logs, or with
+``python manage.py answers``.
+
+Writes stay off the request path. record() puts the row on a bounded
+queue and returns. When the queue is full the row is dropped and counted.
+One writer thread per worker inserts the rows with bulk_create, every
+ANSWER_FLUSH_INTERVAL seconds or every ANSWER_BATCH_SIZE rows. The
+database runs in WAL mode (see settings.py), so those writes do not
+block readers in other workers.
+
+similar() finds a past answer to (nearly) the same question. The FTS5
+index shortlists the ANSWER_CANDIDATES best bm25 matches on the question
+text for the same model. Of those, the one whose words overlap the new
+question's most is returned, if the overlap (Jaccard) is at least
+ANSWER_REUSE_THRESHOLD. With ANSWER_REUSE on, the agent checks it after
+a response cache miss and before calling Gemini.
+
+Needs ``python manage.py migrate``. Search needs SQLite; other databases
+only store.
+"""
+import atexit
+import logging
+import queue
+import re
+import threading
+import time
+
+from decouple import config
+
+from .cache import normalize
+
+logger = logging.getLogger("ai")
+
+ANSWER_STORE = config("ANSWER_STORE", default=False, cast=bool)
+ANSWER_QUEUE_SIZE = config("ANSWER_QUEUE_SIZE", default=1000, cast=int)
+ANSWER_BATCH_SIZE = config("ANSWER_BATCH_SIZE", default=50, cast=int)
+ANSWER_FLUSH_INTERVAL = config("ANSWER_FLUSH_INTERVAL", default=1.0, cast=float)
+ANSWER_REUSE = config("ANSWER_REUSE", default=False, cast=bool)
+ANSWER_REUSE_THRESHOLD = config("ANSWER_REUSE_THRESHOLD", default=0.9, cast=float)
+ANSWER_CANDIDATES = config("ANSWER_CANDIDATES", default=5, cast=int)
+
+REUSED = "reused"
+# Long questions only need their first words to find candidates.
+MAX_QUERY_TERMS = 32
+
+_word = re.compile(r"\w+")
+
+
+def terms(text):
+    """Distinct lower-cased words of `text`, as the search and the overlap see them."""
+    return set(_word.findall(normalize(text)))
+
+
+def overlap(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def search(text, model=None, limit=ANSWER_CANDIDATES, follow_ups=True):
+    """Past (question, answer) pairs whose question shares words with `text`, best bm25 first.
+
+    `follow_ups=False` leaves out answers given inside a conversation,
+    which only make sense after the turns before them.
+    """
+    from django.db import connection
+
+    words = sorted(terms(text))[:MAX_QUERY_TERMS]
+    if not words or connection.vendor != "sqlite":
+        return []
+    match = "question : (" + " OR ".join(f'"{word}"' for word in words) + ")"
+    sql = (
+        "SELECT a.question, a.answer FROM ai_app_answer_fts JOIN ai_app_answer a ON a.id = ai_app_answer_fts.rowid "
+        "WHERE ai_app_answer_fts MATCH %s"
+    )
+    params = [match]
+    if model is not None:
+        sql += " AND a.model = %s"
+        params.append(model)
+    if not follow_ups:
+        sql += " AND a.follow_up = 0"
+    sql += " ORDER BY bm25(ai_app_answer_fts) LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+class AnswerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lookups = 0
+        self.reused = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "written": self.written,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "lookups": self.lookups,
+                "reused": self.reused,
+            }
+
+
+class AnswerStore:
+    def __init__(self, queue_size, batch_size, flush_interval, reuse, threshold, candidates):
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.reuse = reuse
+        self.threshold = threshold
+        self.candidates = candidates
+        self.stats = AnswerStats()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._run, name="answer-store", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def record(self, question, answer, model, usage=None, seconds=0.0, follow_up=False):
+        """Queue one answer for writing; never blocks."""
+        from django.utils import timezone
+
+        row = dict(
+            question=question, answer=answer, model=model, follow_up=follow_up,
+            latency_ms=round(seconds * 1000, 1), created_at=timezone.now(), **(usage or {}),
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.stats.incr("dropped")
+            return
+        self.stats.incr("recorded")
+
+    def _run(self):
+        while True:
+            row = self._queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        from .models import Answer
+
+        try:
+            Answer.objects.bulk_create([Answer(**row) for row in batch])
+        except Exception as e:
+            self.stats.incr("errors")
+            logger.warning("Could not store %s answers (did you run migrate?): %s", len(batch), e)
+            return
+        self.stats.incr("written", len(batch))
+
+    def close(self, timeout=5.0):
+        """Write what is still queued, waiting at most `timeout` seconds."""
+        if not self._writer.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Answer store queue still full at exit, dropping %s answers.", self.queue_depth)
+            return
+        self._writer.join(timeout)
+
+    def similar(self, model, question):
+        """A past answer from `model` to nearly the same question asked on its own, or None."""
+        self.stats.incr("lookups")
+        try:
+            rows = search(question, model, self.candidates, follow_ups=False)
+        except Exception as e:
+            logger.warning("Answer store lookup failed: %s", e)
+            return None
+        wanted = terms(question)
+        best, best_score = None, 0.0
+        for past_question, answer in rows:
+            score = overlap(wanted, terms(past_question))
+            if score > best_score:
+                best, best_score = answer, score
+        if best is None or best_score < self.threshold:
+            return None
+        self.stats.incr("reused")
+        logger.info("Reusing a stored answer (overlap %.2f) for: '%s...'", best_score, question[:50])
+        return best
+
+
+def build_answer_store():
+    if not ANSWER_STORE:
+        return None
+    return AnswerStore(
+        ANSWER_QUEUE_SIZE, ANSWER_BATCH_SIZE, ANSWER_FLUSH_INTERVAL,
+        ANSWER_REUSE, ANSWER_REUSE_THRESHOLD, ANSWER_CANDIDATES,
+    )
@@ -0,0 +1,143 @@
+"""Responses built once and served from memory: the agent card and the doc/blog pages.
+
+Each is an Asset: the body bytes, encoded once, gzipped (and brotli'd when
+the optional `brotli` package is installed) once, with a strong ETag
+(a content hash) and a Last-Modified date: the template's mtime for the
+pages, and the time it was built for the card, whose content also comes
+from settings (BASE_URL, PUSH_NOTIFICATIONS_ENABLED) that only change
+with a restart. Serving one is a header check
+and a pick between precomputed bodies. A client that sends the ETag back
+(If-None-Match) or the date (If-Modified-Since) gets a 304 with no body.
+
+Assets are built on first use, or by preload() at start-up (see
+startup.py). Under `gunicorn --preload` that happens in the master, so
+the workers share them.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from decouple import config
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+
+from .jsonrpc import dumps
+
+try:
+    import brotli  # optional: smaller than gzip for text, browsers accept it over HTTPS
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("ai")
+
+AGENT_CARD_MAX_AGE = config("AGENT_CARD_MAX_AGE", default=300, cast=int)
+PAGE_MAX_AGE = config("PAGE_MAX_AGE", default=3600, cast=int)
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+PAGES = ("blog.html", "doc.html")
+# Not worth compressing below this; the headers would outweigh the saving.
+MIN_COMPRESS_BYTES = 512
+
+
+def _accepts(request, coding):
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class Asset:
+    def __init__(self, body, content_type, max_age, last_modified):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = f"public, max-age={max_age}"
+        self.last_modified = http_date(last_modified)
+        self._last_modified = int(last_modified)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # Every encoding is its own representation, so it gets its own
+        # strong ETag; any of them in If-None-Match means "unchanged".
+        self.encodings = {None: (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.encodings["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+            if brotli is not None:
+                self.encodings["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.encodings.values()}
+
+    def not_modified(self, request):
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-None-Match wins over If-Modified-Since when both are sent.
+            return "*" in if_none_match or any(
+                etag.removeprefix("W/") in self.etags for etag in parse_etags(if_none_match)
+            )
+        since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+        return since is not None and self._last_modified <= since
+
+    def response(self, request):
+        coding = next((name for name in ("br", "gzip") if name in self.encodings and _accepts(request, name)), None)
+        body, etag = self.encodings[coding]
+        if self.not_modified(request):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(b"" if request.method == "HEAD" else body, content_type=self.content_type)
+            if coding is not None:
+                response["Content-Encoding"] = coding
+            response["Content-Length"] = len(body)
+        response["ETag"] = etag
+        response["Last-Modified"] = self.last_modified
+        response["Cache-Control"] = self.cache_control
+        if len(self.encodings) > 1:
+            response["Vary"] = "Accept-Encoding"
+        return response
+
+
+def build_card_asset():
+    from .card import agent_card
+
+    # Not card.py's mtime: a config change would serve a new card under an old date.
+    return Asset(dumps(agent_card()), "application/json", AGENT_CARD_MAX_AGE, time.time())
+
+
+def build_page_asset(name):
+    # The pages have no template tags; rendering them once is all there is to it.
+    from django.template.loader import render_to_string
+
+    body = render_to_string(name).encode()
+    return Asset(body, "text/html; charset=utf-8", PAGE_MAX_AGE, os.path.getmtime(TEMPLATE_DIR / name))
+
+
+_assets = {}
+_assets_lock = threading.Lock()
+
+
+def get_asset(name):
+    """The asset for "agent.json" or one of PAGES, built on first use."""
+    asset = _assets.get(name)
+    if asset is None:
+        with _assets_lock:
+            asset = _assets.get(name)
+            if asset is None:
+                asset = _assets[name] = build_card_asset() if name == "agent.json" else build_page_asset(name)
+                logger.info("Built %s: %s bytes, encodings %s.", name, len(asset.body),
+                            ", ".join(coding for coding in asset.encodings if coding) or "none")
+    return asset
+
+
+def build_assets():
+    for name in ("agent.json", *PAGES):
+        get_asset(name)
+
+
+def _reset_lock():
+    # Built assets are kept: sharing them with the workers is the point.
+    global _assets_lock
+    _assets_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock)
@@ -0,0 +1,104 @@
+"""JSON-RPC 2.0 batch requests: an array of calls in one HTTP request.
+
+Every element is validated and answered on its own, so one bad call does
+not fail the others, and the response array is in request order. Elements
+run concurrently: at most A2A_BATCH_CONCURRENCY of one batch at a time, on
+a shared pool of A2A_BATCH_WORKERS threads per worker process (sync views)
+or as gathered coroutines (async view). Gemini capacity is still enforced
+by the governor for each call.
+
+`message/stream` cannot be batched (the response is one JSON array, not an
+event stream); such elements get an Invalid Request error.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from decouple import config
+
+from .jsonrpc import JsonRpcError, INVALID_REQUEST
+
+logger = logging.getLogger("ai")
+
+A2A_BATCH_MAX_SIZE = config("A2A_BATCH_MAX_SIZE", default=20, cast=int)
+A2A_BATCH_CONCURRENCY = config("A2A_BATCH_CONCURRENCY", default=8, cast=int)
+A2A_BATCH_WORKERS = config("A2A_BATCH_WORKERS", default=32, cast=int)
+
+
+def check_batch(body):
+    """Reject batches that are empty or larger than A2A_BATCH_MAX_SIZE."""
+    if not body:
+        raise JsonRpcError(INVALID_REQUEST, "Invalid Request: empty batch.")
+    if len(body) > A2A_BATCH_MAX_SIZE:
+        raise JsonRpcError(
+            INVALID_REQUEST,
+            f"Invalid Request: batch of {len(body)} calls exceeds the limit of {A2A_BATCH_MAX_SIZE}.",
+        )
+
+
+def _call(handle, item):
+    try:
+        return handle(item)
+    finally:
+        from django.db import close_old_connections
+        close_old_connections()
+
+
+def run_batch(handle, items, concurrency=None, executor=None):
+    """`handle(item)` for every item on the shared pool (or `executor`); results in item order."""
+    concurrency = max(concurrency or A2A_BATCH_CONCURRENCY, 1)
+    executor = executor or get_batch_executor()
+    results = [None] * len(items)
+    running = {}
+    pending = iter(enumerate(items))
+    while True:
+        for index, item in pending:
+            # Each call gets a copy of the request context, so stage timings
+            # still land in the request's trace.
+            future = executor.submit(contextvars.copy_context().run, _call, handle, item)
+            running[future] = index
+            if len(running) >= concurrency:
+                break
+        if not running:
+            return results
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[running.pop(future)] = future.result()
+
+
+async def run_batch_async(handle, items, concurrency=None):
+    """Await `handle(item)` for every item, at most `concurrency` at once."""
+    semaphore = asyncio.Semaphore(max(concurrency or A2A_BATCH_CONCURRENCY, 1))
+
+    async def call(item):
+        async with semaphore:
+            return await handle(item)
+
+    return list(await asyncio.gather(*(call(item) for item in items)))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=A2A_BATCH_WORKERS, thread_name_prefix="a2a-batch")
+    return _executor
+
+
+def _reset_executor():
+    # Pool threads do not survive fork; the child starts its own pool.
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
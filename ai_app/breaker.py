@@ -0,0 +1,251 @@
+"""Circuit breaker in front of Gemini.
+
+When Gemini degrades, every call waits for its timeout and worker threads
+pile up behind it. The breaker watches how Gemini calls end (all models
+together, after the router's fallbacks) over the last BREAKER_WINDOW
+seconds. Once it has seen at least BREAKER_MIN_CALLS calls, and either
+
+- BREAKER_ERROR_RATE of them failed (5xx, 429 after retries, timeouts,
+  connection errors), or
+- BREAKER_SLOW_RATE of them took longer than BREAKER_SLOW_SECONDS
+  (BREAKER_SLOW_SECONDS=0 turns this off). Only the time Gemini itself
+  took counts, not the wait in the governor queue or between retries;
+  streams count their time to first chunk, and a call cut off by its
+  deadline counts its time too,
+
+the circuit opens. For BREAKER_OPEN_SECONDS every call fails at once with
+CircuitOpen, which the views turn into a JSON-RPC "upstream unavailable"
+error with a retryAfter. With BREAKER_SERVE_STORED and the answer store on
+(answers.py), a stored answer to a similar question is served instead,
+marked ``degraded`` in the result metadata.
+
+Then the circuit is half-open: BREAKER_PROBES calls at a time are let
+through as probes, and the rest are still refused. That many successful
+probes close it again; a failed or slow probe opens it for another
+BREAKER_OPEN_SECONDS.
+
+The state is per worker. /ai/metrics exports how many workers are in each
+state (a2a_breaker_state) and what the breakers saw (a2a_breaker_total).
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import httpx
+from decouple import config
+
+from .governor import CapacityExceeded
+
+logger = logging.getLogger("ai")
+
+BREAKER_ENABLED = config("BREAKER_ENABLED", default=True, cast=bool)
+BREAKER_WINDOW = config("BREAKER_WINDOW", default=60.0, cast=float)
+BREAKER_MIN_CALLS = config("BREAKER_MIN_CALLS", default=20, cast=int)
+BREAKER_ERROR_RATE = config("BREAKER_ERROR_RATE", default=0.5, cast=float)
+BREAKER_SLOW_SECONDS = config("BREAKER_SLOW_SECONDS", default=20.0, cast=float)
+BREAKER_SLOW_RATE = config("BREAKER_SLOW_RATE", default=0.8, cast=float)
+BREAKER_OPEN_SECONDS = config("BREAKER_OPEN_SECONDS", default=30.0, cast=float)
+BREAKER_PROBES = config("BREAKER_PROBES", default=3, cast=int)
+BREAKER_SERVE_STORED = config("BREAKER_SERVE_STORED", default=True, cast=bool)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+FAILURE_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """Gemini is failing or too slow; not calling it until `retry_after` seconds from now."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_failure(error):
+    """Whether `error` says something about Gemini's health (not about the request or this worker)."""
+    if isinstance(error, CapacityExceeded):
+        # Only when Gemini rate limited us; a full local queue is our own load.
+        return error.__cause__ is not None
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    from google.genai import errors
+
+    return isinstance(error, errors.APIError) and error.code in FAILURE_CODES
+
+
+class BreakerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow": self.slow,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "probes": self.probes,
+            }
+
+
+class CircuitBreaker:
+    def __init__(self, window, min_calls, error_rate, slow_seconds, slow_rate, open_seconds, probes):
+        self.window = window
+        self.min_calls = max(min_calls, 1)
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = max(probes, 1)
+        self.stats = BreakerStats()
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        # (finished at, failed, slow) for the calls of the last `window` seconds.
+        self._outcomes = deque()
+        self._failed = 0
+        self._slow = 0
+        self._open_until = 0.0
+        self._probing = 0
+        self._probe_successes = 0
+
+    def _retry_after(self, now):
+        return max(math.ceil(self._open_until - now), 1)
+
+    def allow(self):
+        """Admit one Gemini call; returns whether it is a half-open probe.
+
+        Raises CircuitOpen when the call must not go out.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if now < self._open_until:
+                    self.stats.incr("rejected")
+                    raise CircuitOpen("Gemini is failing, not calling it for now.", self._retry_after(now))
+                self.state = HALF_OPEN
+                self._probing = 0
+                self._probe_successes = 0
+                logger.info("Circuit half-open, probing Gemini.")
+            if self.state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    self.stats.incr("rejected")
+                    raise CircuitOpen("Gemini is recovering, please retry shortly.", 1)
+                self._probing += 1
+                self.stats.incr("probes")
+                return True
+        return False
+
+    def record(self, probe, seconds, error=None):
+        """Outcome of a call admitted by allow(): how long it took and what it raised."""
+        failed = error is not None and is_failure(error)
+        slow = bool(self.slow_seconds) and seconds > self.slow_seconds
+        if error is not None and not failed and not slow:
+            # The request's own fault (bad input, a deadline too short to
+            # judge Gemini by...): no news about Gemini.
+            self.cancel(probe)
+            return
+        self.stats.incr("calls")
+        if failed:
+            self.stats.incr("failures")
+        if slow:
+            self.stats.incr("slow")
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                # Clamped: a probe may outlive the half-open period that admitted it.
+                self._probing = max(self._probing - 1, 0)
+                if self.state != HALF_OPEN:
+                    return
+                if failed or slow:
+                    self._open_locked(now, "probe failed" if failed else "probe was slow")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    self._failed = self._slow = 0
+                    logger.warning("Circuit closed, Gemini is answering again.")
+                return
+            if self.state != CLOSED:
+                # Started before the circuit opened; the verdict is already in.
+                return
+            self._outcomes.append((now, failed, slow))
+            self._failed += failed
+            self._slow += slow
+            self._trim_locked(now)
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            if self._failed / calls >= self.error_rate:
+                self._open_locked(now, f"{self._failed}/{calls} calls failed")
+            elif self.slow_seconds and self._slow / calls >= self.slow_rate:
+                self._open_locked(now, f"{self._slow}/{calls} calls slower than {self.slow_seconds:g}s")
+
+    def cancel(self, probe):
+        """A call admitted by allow() ended without telling anything (cancelled, client gone...)."""
+        if not probe:
+            return
+        with self._lock:
+            self._probing = max(self._probing - 1, 0)
+
+    def _trim_locked(self, now):
+        horizon = now - self.window
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            _, failed, slow = self._outcomes.popleft()
+            self._failed -= failed
+            self._slow -= slow
+
+    def _open_locked(self, now, reason):
+        self.state = OPEN
+        self._open_until = now + self.open_seconds
+        self._outcomes.clear()
+        self._failed = self._slow = 0
+        self.stats.incr("opened")
+        logger.error("Circuit open for %.0fs: %s.", self.open_seconds, reason)
+
+    @contextmanager
+    def guard(self):
+        """Run the block as one Gemini call: refused while open, its outcome recorded.
+
+        The call is judged by how long the block took, unless it puts
+        another time in the yielded dict's "seconds" (a stream's time to
+        first chunk).
+        """
+        probe = self.allow()
+        started = time.perf_counter()
+        outcome = {}
+        try:
+            yield outcome
+        except Exception as e:
+            self.record(probe, outcome.get("seconds", time.perf_counter() - started), e)
+            raise
+        except BaseException:
+            self.cancel(probe)
+            raise
+        self.record(probe, outcome.get("seconds", time.perf_counter() - started))
+
+
+def build_breaker():
+    if not BREAKER_ENABLED:
+        return None
+    return CircuitBreaker(
+        BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_SLOW_SECONDS,
+        BREAKER_SLOW_RATE, BREAKER_OPEN_SECONDS, BREAKER_PROBES,
+    )
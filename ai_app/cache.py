@@ -0,0 +1,330 @@
+"""Response cache in front of Gemini.
+
+Lookups try an exact match on the normalized question first, then (when
+RESPONSE_CACHE_SEMANTIC is on) the closest previously answered question by
+embedding cosine similarity. Entries live in a pluggable backend:
+
+- ``memory``: in-process LRU with TTL (default)
+- ``django``: the Django cache framework (``RESPONSE_CACHE_DJANGO_ALIAS``)
+- ``sqlite``: a local SQLite file, shared by every worker on the host
+- ``none``: caching disabled
+
+The semantic index is per worker and per model (a similar question
+answered by another model is not a hit). Each model keeps at most
+RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES vectors, and a lookup scans them all:
+one matrix-vector product when numpy is installed, a Python loop of dot
+products otherwise.
+"""
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+try:
+    import numpy  # optional: vectorizes the semantic index scan
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("ai")
+
+CACHE_BACKEND = config("RESPONSE_CACHE_BACKEND", default="memory")
+CACHE_TTL = config("RESPONSE_CACHE_TTL", default=3600, cast=int)
+CACHE_MAX_ENTRIES = config("RESPONSE_CACHE_MAX_ENTRIES", default=1000, cast=int)
+CACHE_DJANGO_ALIAS = config("RESPONSE_CACHE_DJANGO_ALIAS", default="default")
+CACHE_SQLITE_PATH = config("RESPONSE_CACHE_SQLITE_PATH", default="")
+SEMANTIC_ENABLED = config("RESPONSE_CACHE_SEMANTIC", default=False, cast=bool)
+SEMANTIC_THRESHOLD = config("RESPONSE_CACHE_SEMANTIC_THRESHOLD", default=0.92, cast=float)
+SEMANTIC_MAX_ENTRIES = config("RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES", default=1000, cast=int)
+EMBEDDING_MODEL = config("RESPONSE_CACHE_EMBEDDING_MODEL", default="gemini-embedding-001")
+
+HIT = "hit"
+SEMANTIC_HIT = "semantic-hit"
+MISS = "miss"
+BYPASS = "bypass"
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize(text):
+    """Fold case, whitespace and trailing punctuation so trivial variants match."""
+    return _whitespace.sub(" ", text).strip().rstrip("?!. ").lower()
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\n{normalize(text)}".encode()).hexdigest()
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stores": self.stores,
+            }
+
+
+class LocalLRUBackend:
+    """Per-process LRU with TTL; the cheapest option and the default."""
+    blocking = False
+
+    def __init__(self, max_entries, stats):
+        self.max_entries = max_entries
+        self.stats = stats
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.stats.incr("evictions")
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheBackend:
+    """Delegates to a configured Django cache (Redis, Memcached, database...).
+
+    Evictions happen inside the cache server and are not counted here.
+    """
+    blocking = True
+
+    def __init__(self, alias):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(f"ai_response:{key}")
+
+    def set(self, key, value, ttl):
+        self.cache.set(f"ai_response:{key}", value, ttl)
+
+
+class SQLiteBackend:
+    """Shared on-disk cache; least recently used rows are pruned past max_entries."""
+    blocking = True
+
+    def __init__(self, path, max_entries, stats):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = stats
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)")
+
+    def _connection(self):
+        # One connection per thread and process; sqlite3 objects must not
+        # cross either boundary.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        now = time.time()
+        if expires_at < now:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            self.stats.incr("evictions")
+            return None
+        conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl, now),
+        )
+        deleted = conn.execute(
+            "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        if deleted > 0:
+            self.stats.incr("evictions", deleted)
+
+
+class SemanticIndex:
+    """Bounded in-process (unit vector, cache key) entries per model, for similarity lookups."""
+
+    def __init__(self, max_entries, threshold):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = {}
+        # model -> (keys, matrix of their vectors), rebuilt after a change (numpy only).
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def add(self, model, key, vector):
+        vector = self._unit(vector)
+        with self._lock:
+            entries = self._entries.setdefault(model, OrderedDict())
+            entries[key] = vector
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._matrices.pop(model, None)
+
+    def discard(self, model, key):
+        with self._lock:
+            entries = self._entries.get(model)
+            if entries is not None and entries.pop(key, None) is not None:
+                self._matrices.pop(model, None)
+
+    def nearest(self, model, vector):
+        """Key of `model`'s entry most similar to `vector`, if at least `threshold` similar."""
+        query = self._unit(vector)
+        with self._lock:
+            entries = self._entries.get(model)
+            if not entries:
+                return None
+            if numpy is not None:
+                matrix = self._matrices.get(model)
+                if matrix is None:
+                    matrix = self._matrices[model] = (list(entries), numpy.array(list(entries.values())))
+            else:
+                items = list(entries.items())
+        if numpy is not None:
+            keys, vectors = matrix
+            scores = vectors @ numpy.asarray(query)
+            index = int(scores.argmax())
+            return keys[index] if scores[index] >= self.threshold else None
+        best_key, best_score = None, self.threshold
+        for key, candidate in items:
+            score = sum(a * b for a, b in zip(query, candidate))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl, stats, semantic_index=None, embed=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = stats
+        self.semantic_index = semantic_index
+        self.embed = embed
+
+    @property
+    def blocking(self):
+        """True when lookups may hit the network or disk (run them off the event loop)."""
+        return self.backend.blocking or self.semantic_index is not None
+
+    def _embedding(self, text):
+        try:
+            return self.embed(normalize(text))
+        except Exception as e:
+            logger.warning("Could not embed question for semantic cache lookup: %s", e)
+            return None
+
+    def lookup(self, model, text):
+        """Return (answer or None, cache status, embedding to pass to store())."""
+        key = cache_key(model, text)
+        value = self.backend.get(key)
+        if value is not None:
+            self.stats.incr("hits")
+            return value, HIT, None
+
+        vector = None
+        if self.semantic_index is not None and self.embed is not None:
+            vector = self._embedding(text)
+            if vector is not None:
+                similar_key = self.semantic_index.nearest(model, vector)
+                if similar_key is not None:
+                    value = self.backend.get(similar_key)
+                    if value is not None:
+                        self.stats.incr("semantic_hits")
+                        return value, SEMANTIC_HIT, vector
+                    self.semantic_index.discard(model, similar_key)
+
+        self.stats.incr("misses")
+        return None, MISS, vector
+
+    def peek(self, model, text):
+        """Exact lookup that leaves the hit/miss counters alone."""
+        return self.backend.get(cache_key(model, text))
+
+    def store(self, model, text, value, vector=None):
+        key = cache_key(model, text)
+        self.backend.set(key, value, self.ttl)
+        self.stats.incr("stores")
+        if self.semantic_index is not None and vector is not None:
+            self.semantic_index.add(model, key, vector)
+
+
+def build_backend(name, stats):
+    if name == "memory":
+        return LocalLRUBackend(CACHE_MAX_ENTRIES, stats)
+    if name == "django":
+        return DjangoCacheBackend(CACHE_DJANGO_ALIAS)
+    if name == "sqlite":
+        from django.conf import settings
+        path = CACHE_SQLITE_PATH or os.path.join(settings.BASE_DIR, "response_cache.sqlite3")
+        return SQLiteBackend(path, CACHE_MAX_ENTRIES, stats)
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND '{name}' (expected memory, django, sqlite or none).")
+
+
+def build_response_cache(embed=None):
+    """Build the cache configured in the environment, or None when disabled."""
+    if CACHE_BACKEND == "none":
+        return None
+    stats = CacheStats()
+    semantic_index = SemanticIndex(SEMANTIC_MAX_ENTRIES, SEMANTIC_THRESHOLD) if SEMANTIC_ENABLED else None
+    logger.info("Response cache: backend=%s, ttl=%ss, max_entries=%s, semantic=%s", CACHE_BACKEND, CACHE_TTL, CACHE_MAX_ENTRIES, SEMANTIC_ENABLED)
+    return ResponseCache(build_backend(CACHE_BACKEND, stats), CACHE_TTL, stats, semantic_index, embed)
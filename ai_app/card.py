@@ -0,0 +1,62 @@
+"""The A2A agent card served at /.well-known/agent.json.
+
+AGENT_CARD is the definition, with relative paths where the card has
+URLs. agent_card() resolves those paths against BASE_URL (or a placeholder
+host when it is not set) and fills in capabilities that depend on
+settings. The served bytes are built from it once (see assets.py).
+"""
+from decouple import config
+
+from .push import PUSH_ENABLED
+
+BASE_URL = config("BASE_URL", default=None)
+PLACEHOLDER_URL = "https://your-deployed-app.up.railway.app"
+
+AGENT_CARD = {
+    "name": "CodeHelperAgent",
+    "description": "An AI agent to help with coding questions in Python, Django, and JavaScript.",
+    "url": "/ai",
+    "provider": {
+        "organization": "HNG Internship",
+        "url": "https://hng.tech/"
+    },
+    "version": "1.0.0",
+    "documentationUrl": "/ai/docs",
+    "capabilities": {
+        "streaming": True,
+        "pushNotifications": False,
+        "stateTransitionHistory": False
+    },
+    "defaultInputModes": ["text/plain", "application/json"],
+    "defaultOutputModes": ["text/plain", "application/json"],
+    "skills": [
+        {
+            "id": "coding_assistant",
+            "name": "Code Explanation & Snippets",
+            "description": "Explains programming concepts and provides code snippets for Python, Django, and JavaScript.",
+            "inputModes": ["text/plain"],
+            "outputModes": ["text/plain"],
+            "examples": [
+                {
+                    "input": { "parts": [{"type": "text", "text": "How do I loop through a list in Python?"}] },
+                    "output": { "parts": [{"type": "text", "text": "You can loop through a list using a `for` loop:\n```python\nmy_list = ['item1', 'item2', 'item3']\nfor item in my_list:\n    print(item)\n```\nThis iterates over each element (`item`) in `my_list`."}] }
+                },
+                {
+                    "input": { "parts": [{"type": "text", "text": "How do I create a Django model?"}] },
+                    "output": { "parts": [{"type": "text", "text": "In Django, you create a model by subclassing `models.Model` in your `models.py`:\n```python\nfrom django.db import models\nclass MyModel(models.Model):\n    name = models.CharField(max_length=100)\n    description = models.TextField(blank=True)\n    created_at = models.DateTimeField(auto_now_add=True)\n    def __str__(self):\n        return self.name\n```\nRemember to create and run migrations after defining your model:\n```bash\npython manage.py makemigrations\npython manage.py migrate\n```"}] }
+                }
+            ]
+        }
+    ]
+}
+
+
+def agent_card():
+    """AGENT_CARD with absolute URLs and the current settings."""
+    base = BASE_URL.rstrip("/") if BASE_URL else PLACEHOLDER_URL
+    return dict(
+        AGENT_CARD,
+        url=base + AGENT_CARD["url"],
+        documentationUrl=base + AGENT_CARD["documentationUrl"],
+        capabilities=dict(AGENT_CARD["capabilities"], pushNotifications=PUSH_ENABLED),
+    )
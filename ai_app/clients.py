@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+
+import httpx
+from decouple import config
+
+logger = logging.getLogger("ai")
+
+api_key = config("GEMINI_API_KEY", default=None)
+
+# Connection pool settings for the shared Gemini HTTP client.
+POOL_MAX_CONNECTIONS = config("GEMINI_POOL_MAX_CONNECTIONS", default=100, cast=int)
+POOL_MAX_KEEPALIVE = config("GEMINI_POOL_MAX_KEEPALIVE", default=20, cast=int)
+POOL_KEEPALIVE_EXPIRY = config("GEMINI_POOL_KEEPALIVE_EXPIRY", default=60.0, cast=float)
+USE_HTTP2 = config("GEMINI_HTTP2", default=True, cast=bool)
+# Point the SDK at another host (e.g. a local fake Gemini server for load tests).
+BASE_URL = config("GEMINI_BASE_URL", default=None)
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ConnectionStats:
+    """Counts upstream requests against new TCP connections so reuse is visible."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def reset(self):
+        # Also called right after fork, when the old lock may be held by a
+        # thread that no longer exists, so start from a fresh one.
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def _tracer(self, secure):
+        # httpcore trace hook: fires for every stage of a request, we only
+        # care about the ones that happen when a new connection is made.
+        from .metrics import observe
+        started = []
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                started.append(time.perf_counter())
+            elif event_name == "connection.connect_tcp.complete":
+                with self._lock:
+                    self.connections_opened += 1
+                if not secure and started:
+                    observe("upstream_connect", time.perf_counter() - started[0])
+            elif event_name == "connection.start_tls.complete":
+                with self._lock:
+                    self.tls_handshakes += 1
+                if started:
+                    observe("upstream_connect", time.perf_counter() - started[0])
+        return trace
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._tracer(request.url.scheme == "https")
+
+    async def on_async_request(self, request):
+        with self._lock:
+            self.requests += 1
+        trace = self._tracer(request.url.scheme == "https")
+
+        async def async_trace(event_name, info):
+            trace(event_name, info)
+        request.extensions["trace"] = async_trace
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.connections_opened, 0)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "connections_reused": reused,
+            }
+
+
+connection_stats = ConnectionStats()
+
+_lock = threading.Lock()
+_client = None
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _build_client():
+    # The SDK takes about a second to import; nothing else needs it loaded.
+    from google import genai
+    from google.genai import types
+
+    if not api_key:
+        raise ValueError("Gemini API key not found in environment variables.")
+
+    http2 = USE_HTTP2 and HTTP2_AVAILABLE
+    if USE_HTTP2 and not HTTP2_AVAILABLE:
+        logger.warning("GEMINI_HTTP2 is enabled but the 'h2' package is not installed, using HTTP/1.1 keep-alive.")
+
+    sync_http = httpx.Client(
+        http2=http2,
+        limits=_pool_limits(),
+        event_hooks={"request": [connection_stats.on_request]},
+    )
+    async_http = httpx.AsyncClient(
+        http2=http2,
+        limits=_pool_limits(),
+        event_hooks={"request": [connection_stats.on_async_request]},
+    )
+    http_options = types.HttpOptions(httpx_client=sync_http, httpx_async_client=async_http, base_url=BASE_URL)
+    logger.info("Creating shared Gemini client (pid=%s, http2=%s, max_connections=%s).", os.getpid(), http2, POOL_MAX_CONNECTIONS)
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def get_client():
+    """Return the process-wide Gemini client, creating it on first use."""
+    global _client
+    client = _client
+    if client is not None:
+        return client
+    with _lock:
+        if _client is None:
+            _client = _build_client()
+        return _client
+
+
+def reset_client():
+    """Drop the shared client so the next call to get_client() builds a new one."""
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+    connection_stats.reset()
+
+
+# Pooled sockets must never be shared between a gunicorn master and its
+# workers, so each forked child starts with an empty registry.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_client)
@@ -0,0 +1,98 @@
+"""Gemini explicit context caching for the system instruction.
+
+With CONTEXT_CACHE_ENABLED the system instruction is uploaded once with
+`client.caches.create` and every generate call refers to it by name
+(`cached_content`), so its tokens are billed at the cached rate instead
+of being sent and processed again. The cache is extended with
+`client.caches.update` once it is within CONTEXT_CACHE_REFRESH_MARGIN
+seconds of expiring; requests keep using it while that happens.
+
+Gemini only accepts caches above a minimum size (1024 tokens for Flash
+models), so this pays off once the shared prefix is that large. If the
+cache cannot be created we log it once and fall back to a plain
+`system_instruction`, which still lets Gemini's implicit prefix caching
+apply. Each worker process keeps its own cache.
+"""
+import logging
+import threading
+import time
+
+from decouple import config
+
+logger = logging.getLogger("ai")
+
+CONTEXT_CACHE_ENABLED = config("CONTEXT_CACHE_ENABLED", default=False, cast=bool)
+CONTEXT_CACHE_TTL = config("CONTEXT_CACHE_TTL", default=3600, cast=int)
+CONTEXT_CACHE_REFRESH_MARGIN = config("CONTEXT_CACHE_REFRESH_MARGIN", default=300, cast=int)
+# After a failed create, wait this long before trying again.
+RETRY_AFTER_FAILURE = 600
+
+
+class ContextCache:
+    def __init__(self, client, model, system_instruction, ttl, refresh_margin):
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl // 2)
+        self.name = None
+        self.expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        from google.genai import types
+
+        self._fallback = types.GenerateContentConfig(system_instruction=system_instruction)
+
+    def needs_refresh(self):
+        now = time.monotonic()
+        if self.name is None:
+            return now >= self._retry_at
+        return self.expires_at - now < self.refresh_margin
+
+    def generate_config(self):
+        """GenerateContentConfig for the next call; may create or extend the cache (blocking)."""
+        if self.needs_refresh() and self._lock.acquire(blocking=False):
+            # Whoever gets the lock refreshes; everyone else carries on with
+            # the current (still valid) cache or the plain system instruction.
+            try:
+                if self.needs_refresh():
+                    self._refresh()
+            finally:
+                self._lock.release()
+        name = self.name
+        if name is None or time.monotonic() >= self.expires_at:
+            return self._fallback
+        from google.genai import types
+
+        return types.GenerateContentConfig(cached_content=name)
+
+    def _refresh(self):
+        from google.genai import types
+
+        ttl = f"{self.ttl}s"
+        try:
+            if self.name is None:
+                cached = self.client.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=self.system_instruction, ttl=ttl, display_name="codehelper-system",
+                    ),
+                )
+                if not cached.name:
+                    raise ValueError("Gemini returned a cache without a name")
+                self.name = cached.name
+                logger.info("Created Gemini context cache %s (ttl %s).", self.name, ttl)
+            else:
+                self.client.caches.update(name=self.name, config=types.UpdateCachedContentConfig(ttl=ttl))
+                logger.info("Extended Gemini context cache %s (ttl %s).", self.name, ttl)
+            self.expires_at = time.monotonic() + self.ttl
+        except Exception as e:
+            logger.warning("Gemini context cache unavailable, sending the system instruction inline: %s", e)
+            self.name = None
+            self._retry_at = time.monotonic() + RETRY_AFTER_FAILURE
+
+
+def build_context_cache(client, model, system_instruction):
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    return ContextCache(client, model, system_instruction, CONTEXT_CACHE_TTL, CONTEXT_CACHE_REFRESH_MARGIN)
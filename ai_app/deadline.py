@@ -0,0 +1,115 @@
+"""End-to-end deadlines for A2A calls, carried down to the Gemini request.
+
+Every message/send and message/stream call gets a time budget when it
+starts: A2A_SEND_DEADLINE or A2A_STREAM_DEADLINE seconds, and
+A2A_TASK_DEADLINE for a non-blocking task from when it starts running
+(0 means no deadline). A client may ask for less by sending
+A2A_DEADLINE_HEADER with the seconds it is willing to wait; it cannot ask
+for more, nor for more than A2A_MAX_DEADLINE where the method has none.
+
+The deadline lives in a ContextVar, like the metrics trace, so it follows
+the call into batch threads, hedged attempts and map-reduce chunks. Along
+the way:
+
+- the governor queue waits at most until the deadline (governor.py)
+- a 429/503 retry whose backoff would overrun it is not attempted
+- every generate_content call gets the time left as its HTTP timeout,
+  which the SDK also sends to Gemini as X-Server-Timeout
+- a stream stops between chunks once the deadline has passed
+
+Running out raises DeadlineExceeded, which the views turn into a JSON-RPC
+"deadline exceeded" error instead of holding the worker thread.
+"""
+import time
+from contextvars import ContextVar
+
+from decouple import config
+
+A2A_SEND_DEADLINE = config("A2A_SEND_DEADLINE", default=60.0, cast=float)
+A2A_STREAM_DEADLINE = config("A2A_STREAM_DEADLINE", default=300.0, cast=float)
+A2A_TASK_DEADLINE = config("A2A_TASK_DEADLINE", default=300.0, cast=float)
+A2A_DEADLINE_HEADER = config("A2A_DEADLINE_HEADER", default="X-Request-Timeout")
+A2A_MAX_DEADLINE = config("A2A_MAX_DEADLINE", default=3600.0, cast=float)
+
+METHOD_DEADLINES = {
+    "message/send": A2A_SEND_DEADLINE,
+    "message/stream": A2A_STREAM_DEADLINE,
+}
+
+_deadline = ContextVar("a2a_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The call ran out of its time budget before Gemini answered."""
+
+    def __init__(self, message="The request ran out of time.", budget=None):
+        super().__init__(message)
+        self.budget = budget
+
+
+def budget_of(request, method):
+    """Seconds `method` may take for this request (None for no limit)."""
+    budget = METHOD_DEADLINES.get(method, 0.0)
+    asked = request.headers.get(A2A_DEADLINE_HEADER) if A2A_DEADLINE_HEADER and request is not None else None
+    if asked:
+        try:
+            # Also keeps "inf" (and "nan", which is not > 0) finite for timeout_ms().
+            asked = min(float(asked), A2A_MAX_DEADLINE)
+        except ValueError:
+            asked = 0.0
+        if asked > 0:
+            budget = min(budget, asked) if budget > 0 else asked
+    return budget if budget > 0 else None
+
+
+def start_deadline(budget):
+    """Give the current context a deadline `budget` seconds from now (none for None/0).
+
+    Returns the deadline, to hand to use_deadline() where the context is not carried over.
+    """
+    deadline = (time.monotonic() + budget, budget) if budget else None
+    _deadline.set(deadline)
+    return deadline
+
+
+def use_deadline(deadline):
+    """Put a deadline returned by start_deadline() back in place, e.g. in a response generator."""
+    _deadline.set(deadline)
+
+
+def time_left():
+    """Seconds left before the deadline, or None when there is none."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline[0] - time.monotonic()
+
+
+def expired():
+    left = time_left()
+    return left is not None and left <= 0
+
+
+def check_deadline():
+    """Raise DeadlineExceeded once the deadline has passed."""
+    if expired():
+        raise exceeded()
+
+
+def exceeded():
+    """The DeadlineExceeded to raise for the current deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return DeadlineExceeded()
+    return DeadlineExceeded(f"No answer from Gemini within the {deadline[1]:g}s deadline.", deadline[1])
+
+
+def timeout_ms():
+    """The time left as an SDK `HttpOptions.timeout` (milliseconds), or None.
+
+    Raises DeadlineExceeded if nothing is left.
+    """
+    left = time_left()
+    if left is None:
+        return None
+    if left <= 0:
+        raise exceeded()
+    return max(int(left * 1000), 1)
@@ -0,0 +1,554 @@
+"""Client-side governor for Gemini calls.
+
+Every generate call goes through one Governor per worker, which enforces:
+
+- GEMINI_RPM requests and GEMINI_TPM tokens per minute (token buckets; the
+  token cost is estimated from the prompt up front and corrected with the
+  response's `usage_metadata` afterwards)
+- at most GEMINI_MAX_CONCURRENCY calls in flight
+
+Callers that cannot go yet wait in a priority queue ordered by arrival time
+plus a penalty for size (GEMINI_PRIORITY_TOKENS_PER_SECOND estimated tokens
+count like arriving one second later), so short questions overtake large
+code pastes without starving them.
+
+A call made under a share (use_share(), set per tenant by tenants.py) is
+queued by weighted fair queueing instead: its place is the share's own
+backlog plus its size divided by the share's weight, counted from the
+place of the last call let through (self-clocked fair queueing). A share
+with many calls waiting goes behind the first call of every other share,
+however early it queued them, and a share of weight 2 gets twice the
+calls (or tokens) of a share of weight 1 while both have some waiting.
+
+A caller that has waited GEMINI_MAX_WAIT
+seconds, or finds GEMINI_MAX_QUEUE callers ahead of it, gets
+CapacityExceeded, which the views turn into a JSON-RPC "server busy" error.
+A caller whose request deadline (deadline.py) comes sooner waits only until
+then and gets DeadlineExceeded.
+
+Gemini's own 429 / 503 answers pause the whole governor for the delay the
+server asks for (Retry-After header or RetryInfo), or a jittered exponential
+backoff, and the call is retried up to GEMINI_MAX_RETRIES times.
+
+The limits are per worker process: divide the project quota by the number
+of workers.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from decouple import config
+
+from .deadline import exceeded, expired, time_left, DeadlineExceeded
+from .memory import estimate_tokens
+from .metrics import timer
+
+logger = logging.getLogger("ai")
+
+GEMINI_RPM = config("GEMINI_RPM", default=1000, cast=int)
+GEMINI_TPM = config("GEMINI_TPM", default=1000000, cast=int)
+GEMINI_MAX_CONCURRENCY = config("GEMINI_MAX_CONCURRENCY", default=32, cast=int)
+GEMINI_MAX_QUEUE = config("GEMINI_MAX_QUEUE", default=256, cast=int)
+GEMINI_MAX_WAIT = config("GEMINI_MAX_WAIT", default=30.0, cast=float)
+GEMINI_MAX_RETRIES = config("GEMINI_MAX_RETRIES", default=3, cast=int)
+GEMINI_RETRY_BASE = config("GEMINI_RETRY_BASE", default=1.0, cast=float)
+GEMINI_EXPECTED_OUTPUT_TOKENS = config("GEMINI_EXPECTED_OUTPUT_TOKENS", default=500, cast=int)
+GEMINI_PRIORITY_TOKENS_PER_SECOND = config("GEMINI_PRIORITY_TOKENS_PER_SECOND", default=1000, cast=int)
+
+RETRY_CODES = {429, 503}
+_delay_pattern = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+_share = ContextVar("gemini_share", default=None)
+
+
+def use_share(share):
+    """Queue this context's Gemini calls fairly under `share`, a (key, weight) pair.
+
+    None (the default) queues them by arrival time and size.
+    """
+    _share.set(share)
+
+
+class CapacityExceeded(Exception):
+    """No Gemini capacity for this call within GEMINI_MAX_WAIT; try again later."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_request_tokens(contents):
+    """Tokens a generate call will probably cost: prompt estimate plus expected output."""
+    if isinstance(contents, str):
+        text = contents
+    else:
+        text = " ".join(
+            part.get("text", "") for item in contents for part in item.get("parts", [])
+        )
+    return estimate_tokens(text) + GEMINI_EXPECTED_OUTPUT_TOKENS
+
+
+def used_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+
+def usage_record(response):
+    """Token accounting for one Gemini response, from its usage_metadata."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_token_count or 0,
+        "cached_tokens": usage.cached_content_token_count or 0,
+        "output_tokens": usage.candidates_token_count or 0,
+        "total_tokens": usage.total_token_count or 0,
+    }
+
+
+def add_usage(total, record):
+    """`record` added to the running `total` (None before the first call)."""
+    if total is None:
+        return dict(record)
+    return {key: total.get(key, 0) + value for key, value in record.items()}
+
+
+class UsageStats:
+    """Running token totals, to measure what prompt and context caching save."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.total_tokens = 0
+
+    def add(self, record):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += record["prompt_tokens"]
+            self.cached_tokens += record["cached_tokens"]
+            self.output_tokens += record["output_tokens"]
+            self.total_tokens += record["total_tokens"]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.total_tokens,
+            }
+
+
+def retry_after_of(error):
+    """Seconds Gemini asked us to wait, from Retry-After or google.rpc.RetryInfo."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    details = error.details if isinstance(error.details, dict) else {}
+    for detail in (details.get("error") or {}).get("details") or []:
+        if isinstance(detail, dict) and detail.get("@type", "").endswith("RetryInfo"):
+            match = _delay_pattern.match(str(detail.get("retryDelay", "")))
+            if match:
+                return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        # A single call bigger than the whole bucket only has to wait for a full one.
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative: usage corrections are debts paid off by refilling.
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class GovernorStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.tokens_used = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "tokens_used": self.tokens_used,
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "share", "granted", "event", "loop", "future")
+
+    def __init__(self, priority, seq, tokens, share=None, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.share = share
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class Governor:
+    def __init__(self, rpm, tpm, max_concurrency, max_queue, max_wait, max_retries, retry_base):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.stats = GovernorStats()
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        # Fair queueing: place of the last call let through, and the place
+        # of each share's last queued call.
+        self._virtual = 0.0
+        self._finish = {}
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return len(self._queue)
+
+    def _admit_locked(self, now):
+        """Grant queued callers in priority order while capacity allows.
+
+        Returns the seconds until the head of the queue could go, or None
+        when only a release (or nothing) can unblock it.
+        """
+        while self._queue:
+            if self._active >= self.max_concurrency:
+                return None
+            if self._paused_until > now:
+                return self._paused_until - now
+            head = self._queue[0]
+            wait = 0.0
+            if self.requests is not None:
+                wait = self.requests.delay(1, now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.delay(head.tokens, now))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            if head.share is not None:
+                self._virtual = head.priority
+                self._forget_locked(head)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(head.tokens)
+            self._active += 1
+            head.granted = True
+            head.wake()
+            self.stats.incr("admitted")
+        return None
+
+    def _enqueue(self, tokens, loop=None):
+        now = time.monotonic()
+        cost = tokens / GEMINI_PRIORITY_TOKENS_PER_SECOND
+        share = _share.get()
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.stats.incr("rejected")
+                raise CapacityExceeded(f"Gemini request queue is full ({len(self._queue)} waiting).", self._retry_hint(now))
+            if share is None:
+                waiter = _Waiter(now + cost, next(self._seq), tokens, None, loop)
+            else:
+                key, weight = share
+                if not self._queue:
+                    # Idle: nobody's backlog carries over, and the places
+                    # stay comparable with arrival times.
+                    self._virtual = max(self._virtual, now)
+                priority = max(self._virtual, self._finish.get(key, 0.0)) + cost / weight
+                self._finish[key] = priority
+                waiter = _Waiter(priority, next(self._seq), tokens, share, loop)
+            heapq.heappush(self._queue, waiter)
+            retry_in = self._admit_locked(now)
+        return waiter, retry_in
+
+    def _forget_locked(self, waiter):
+        # A share's place only matters while it has calls queued.
+        key = waiter.share[0]
+        if self._finish.get(key) == waiter.priority:
+            del self._finish[key]
+
+    def _remove_locked(self, waiter):
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        if waiter.share is not None:
+            self._forget_locked(waiter)
+
+    def _retry_hint(self, now):
+        return max(round(self._paused_until - now, 1), 1.0)
+
+    def _give_up_locked(self, waiter, now, max_wait, by_deadline):
+        self._remove_locked(waiter)
+        self._admit_locked(now)
+        self.stats.incr("rejected")
+        logger.warning("Gave up waiting %.1fs for Gemini capacity (%s active, %s waiting).", max_wait, self._active, len(self._queue))
+        if by_deadline:
+            return exceeded()
+        return CapacityExceeded("Gemini is at capacity, please retry shortly.", self._retry_hint(now))
+
+    def _wait_limit(self):
+        """Seconds a caller may queue, and whether its request deadline is what limits that."""
+        left = time_left()
+        if left is None or left >= self.max_wait:
+            return self.max_wait, False
+        if left <= 0:
+            raise exceeded()
+        return left, True
+
+    def acquire(self, tokens):
+        max_wait, by_deadline = self._wait_limit()
+        waiter, retry_in = self._enqueue(tokens)
+        deadline = time.monotonic() + max_wait
+        while not waiter.granted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    if not waiter.granted:
+                        raise self._give_up_locked(waiter, time.monotonic(), max_wait, by_deadline)
+                break
+            waiter.event.wait(min(remaining, retry_in) if retry_in else remaining)
+            with self._lock:
+                if not waiter.granted:
+                    retry_in = self._admit_locked(time.monotonic())
+
+    async def acquire_async(self, tokens):
+        max_wait, by_deadline = self._wait_limit()
+        waiter, retry_in = self._enqueue(tokens, asyncio.get_running_loop())
+        deadline = time.monotonic() + max_wait
+        try:
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        if not waiter.granted:
+                            raise self._give_up_locked(waiter, time.monotonic(), max_wait, by_deadline)
+                    break
+                await asyncio.wait({waiter.future}, timeout=min(remaining, retry_in) if retry_in else remaining)
+                with self._lock:
+                    if not waiter.granted:
+                        retry_in = self._admit_locked(time.monotonic())
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    granted = True
+                else:
+                    granted = False
+                    self._remove_locked(waiter)
+            if granted:
+                self.release(tokens)
+            raise
+
+    def release(self, tokens, actual_tokens=None):
+        """Free the concurrency slot and settle the token estimate against real usage."""
+        with self._lock:
+            self._active -= 1
+            if actual_tokens is not None:
+                self.stats.incr("tokens_used", actual_tokens)
+                if self.tokens is not None:
+                    if actual_tokens > tokens:
+                        self.tokens.take(actual_tokens - tokens)
+                    else:
+                        self.tokens.give(tokens - actual_tokens)
+            self._admit_locked(time.monotonic())
+
+    def backoff(self, error, attempt):
+        """Seconds to wait before retrying after `error`, or None if it is not retryable.
+
+        Also pauses admission for everyone, since the quota is shared.
+        """
+        from google.genai import errors
+
+        if not isinstance(error, errors.APIError) or error.code not in RETRY_CODES:
+            return None
+        self.stats.incr("rate_limited")
+        delay = retry_after_of(error)
+        if delay is None:
+            delay = random.uniform(0, self.retry_base * 2 ** attempt) + self.retry_base / 2
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning("Gemini answered %s (attempt %s), pausing calls for %.1fs.", error.code, attempt + 1, delay)
+        return delay
+
+    def _check_retry(self, error, attempt, max_retries):
+        delay = self.backoff(error, attempt)
+        if delay is None:
+            return None
+        left = time_left()
+        if attempt >= max_retries or delay > self.max_wait or (left is not None and delay >= left):
+            raise CapacityExceeded(f"Gemini is rate limiting us ({error.code}), please retry shortly.", round(delay, 1)) from error
+        self.stats.incr("retries")
+        return delay
+
+    def call(self, fn, tokens, retries=None):
+        """Run the Gemini call `fn()` under the governor, retrying 429/503.
+
+        `retries` overrides GEMINI_MAX_RETRIES, e.g. 0 when the caller has
+        another model to fall back to.
+        """
+        max_retries = self.max_retries if retries is None else retries
+        for attempt in range(max_retries + 1):
+            with timer("queue_wait"):
+                self.acquire(tokens)
+            try:
+                with timer("upstream_total"):
+                    response = fn()
+            except Exception as e:
+                self.release(tokens)
+                if expired() and not isinstance(e, DeadlineExceeded):
+                    # Most likely the SDK timeout set from the deadline.
+                    raise exceeded() from e
+                delay = self._check_retry(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.release(tokens, used_tokens(response))
+            return response
+
+    @contextmanager
+    def slot(self, tokens):
+        """Hold a slot around a streamed call; put its token count in the yielded dict.
+
+        Streams are not retried (chunks may already be on their way to the
+        client), but a 429/503 still pauses the governor.
+        """
+        with timer("queue_wait"):
+            self.acquire(tokens)
+        usage = {}
+        released = False
+        try:
+            yield usage
+        except Exception as e:
+            self.release(tokens)
+            released = True
+            if expired() and not isinstance(e, DeadlineExceeded):
+                raise exceeded() from e
+            if self.backoff(e, 0) is not None:
+                raise CapacityExceeded(f"Gemini is rate limiting us ({e.code}), please retry shortly.") from e
+            raise
+        finally:
+            if not released:
+                self.release(tokens, usage.get("tokens"))
+
+    @asynccontextmanager
+    async def slot_async(self, tokens):
+        with timer("queue_wait"):
+            await self.acquire_async(tokens)
+        usage = {}
+        released = False
+        try:
+            yield usage
+        except Exception as e:
+            self.release(tokens)
+            released = True
+            if expired() and not isinstance(e, DeadlineExceeded):
+                raise exceeded() from e
+            if self.backoff(e, 0) is not None:
+                raise CapacityExceeded(f"Gemini is rate limiting us ({e.code}), please retry shortly.") from e
+            raise
+        finally:
+            if not released:
+                self.release(tokens, usage.get("tokens"))
+
+    async def call_async(self, coro_fn, tokens, retries=None):
+        max_retries = self.max_retries if retries is None else retries
+        for attempt in range(max_retries + 1):
+            with timer("queue_wait"):
+                await self.acquire_async(tokens)
+            try:
+                with timer("upstream_total"):
+                    response = await coro_fn()
+            except asyncio.CancelledError:
+                # E.g. the losing half of a hedged request.
+                self.release(tokens)
+                raise
+            except Exception as e:
+                self.release(tokens)
+                if expired() and not isinstance(e, DeadlineExceeded):
+                    # Most likely the SDK timeout set from the deadline.
+                    raise exceeded() from e
+                delay = self._check_retry(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.release(tokens, used_tokens(response))
+            return response
+
+
+def build_governor():
+    logger.info("Gemini governor: rpm=%s, tpm=%s, max_concurrency=%s", GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_CONCURRENCY)
+    return Governor(
+        GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_CONCURRENCY, GEMINI_MAX_QUEUE,
+        GEMINI_MAX_WAIT, GEMINI_MAX_RETRIES, GEMINI_RETRY_BASE,
+    )
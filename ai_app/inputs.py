@@ -0,0 +1,273 @@
+"""Turning A2A message parts into one prompt, and keeping big inputs in bounds.
+
+Every part of a message is used, in order:
+
+- ``text`` parts as they are
+- ``file`` parts with inline base64 ``bytes``, decoded as UTF-8 and sent as
+  a fenced block under the file's name; binary files are refused with a
+  ContentTypeNotSupported error
+- ``file`` parts with a ``uri``, fetched (streamed into a bounded buffer)
+  only from hosts listed in A2A_FILE_URI_HOSTS, since fetching arbitrary
+  URLs on a client's behalf is a request-forgery risk
+- ``data`` parts, as pretty-printed JSON
+
+Hard limits, each answered with a clean JSON-RPC error: A2A_MAX_BODY_BYTES
+for the HTTP body, A2A_MAX_FILE_BYTES per file and A2A_MAX_INPUT_CHARS for
+the assembled prompt.
+
+Inputs longer than A2A_CHUNK_THRESHOLD characters are not sent whole: they
+are split into A2A_CHUNK_SIZE chunks on line boundaries, Gemini takes notes
+on every chunk in parallel (map) and the answer is generated from the
+question plus those notes (reduce). See Ai_Agent._condense. Every map call
+is a Gemini call, so there are at most A2A_MAX_CHUNKS of them: past that
+the chunks get bigger instead of more numerous.
+"""
+import base64
+import binascii
+import json
+import logging
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+from decouple import Csv, config
+
+from .jsonrpc import JsonRpcError, INVALID_REQUEST, INVALID_PARAMS, CONTENT_TYPE_NOT_SUPPORTED
+
+logger = logging.getLogger("ai")
+
+A2A_MAX_BODY_BYTES = config("A2A_MAX_BODY_BYTES", default=8 * 1024 * 1024, cast=int)
+A2A_MAX_FILE_BYTES = config("A2A_MAX_FILE_BYTES", default=2 * 1024 * 1024, cast=int)
+A2A_MAX_INPUT_CHARS = config("A2A_MAX_INPUT_CHARS", default=200_000, cast=int)
+A2A_FILE_URI_HOSTS = config("A2A_FILE_URI_HOSTS", default="", cast=Csv())
+A2A_CHUNK_THRESHOLD = config("A2A_CHUNK_THRESHOLD", default=60_000, cast=int)
+A2A_CHUNK_SIZE = config("A2A_CHUNK_SIZE", default=20_000, cast=int)
+A2A_CHUNK_CONCURRENCY = config("A2A_CHUNK_CONCURRENCY", default=4, cast=int)
+A2A_MAX_CHUNKS = config("A2A_MAX_CHUNKS", default=10, cast=int)
+
+READ_CHUNK = 64 * 1024
+QUESTION_MAX_CHARS = 2000
+_fence = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+
+
+def check_content_length(request):
+    """Refuse a body over A2A_MAX_BODY_BYTES before reading any of it."""
+    length = request.META.get("CONTENT_LENGTH")
+    if length and length.isdigit() and int(length) > A2A_MAX_BODY_BYTES:
+        raise _too_large("Request body", int(length), A2A_MAX_BODY_BYTES, INVALID_REQUEST)
+
+
+def read_body(request):
+    """The request body, read in pieces into one buffer of at most A2A_MAX_BODY_BYTES."""
+    check_content_length(request)
+    body = bytearray()
+    while True:
+        piece = request.read(READ_CHUNK)
+        if not piece:
+            return body
+        body += piece
+        if len(body) > A2A_MAX_BODY_BYTES:
+            raise _too_large("Request body", len(body), A2A_MAX_BODY_BYTES, INVALID_REQUEST)
+
+
+def _too_large(what, size, limit, code=INVALID_PARAMS):
+    logger.warning("%s of %s bytes refused (limit %s).", what, size, limit)
+    return JsonRpcError(code, f"{what} is too large ({size} > {limit} bytes).", {"limit": limit})
+
+
+def _kind(part):
+    # Check for 'kind' first (A2A standard), then fall back to 'type'
+    return part.get("kind") or part.get("type")
+
+
+def _file_text(name, mime_type, raw):
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = None
+    if text is None or "\x00" in text:
+        raise JsonRpcError(
+            CONTENT_TYPE_NOT_SUPPORTED,
+            f"Incompatible content types: file '{name}' ({mime_type or 'unknown type'}) is not text.",
+        )
+    language = name.rsplit(".", 1)[-1] if "." in name else ""
+    return f"File `{name}`:\n```{language}\n{text}\n```"
+
+
+def _decode_bytes(name, encoded):
+    if not isinstance(encoded, str):
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: file '{name}' bytes must be a base64 string.")
+    if len(encoded) * 3 // 4 > A2A_MAX_FILE_BYTES:
+        raise _too_large(f"File '{name}'", len(encoded) * 3 // 4, A2A_MAX_FILE_BYTES)
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: file '{name}' bytes are not valid base64.")
+
+
+def has_file_uris(params):
+    """Whether parsing this message will fetch files (so async callers can do it off the loop)."""
+    message = params.get("message") if isinstance(params, dict) else None
+    parts = message.get("parts") if isinstance(message, dict) else None
+    return bool(A2A_FILE_URI_HOSTS) and isinstance(parts, list) and any(
+        isinstance(part, dict) and isinstance(part.get("file"), dict) and part["file"].get("uri") for part in parts
+    )
+
+
+def _fetch(name, uri):
+    url = urlsplit(uri)
+    if url.scheme not in ("http", "https") or url.hostname not in A2A_FILE_URI_HOSTS:
+        raise JsonRpcError(
+            INVALID_PARAMS, f"Invalid params: file '{name}' must be sent inline; this agent does not fetch {uri}.",
+        )
+    try:
+        with httpx.stream("GET", uri, timeout=10, follow_redirects=False) as response:
+            response.raise_for_status()
+            content = bytearray()
+            for piece in response.iter_bytes(READ_CHUNK):
+                content += piece
+                if len(content) > A2A_MAX_FILE_BYTES:
+                    raise _too_large(f"File '{name}'", len(content), A2A_MAX_FILE_BYTES)
+            return bytes(content)
+    except httpx.HTTPError as e:
+        logger.warning("Could not fetch file %s from %s: %s", name, uri, e)
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: could not fetch file '{name}': {e}")
+
+
+def part_text(index, part):
+    """Prompt text for one message part."""
+    if not isinstance(part, dict):
+        raise JsonRpcError(INVALID_REQUEST, f"Invalid Request: message part {index} is not an object.")
+    kind = _kind(part)
+    if kind == "text":
+        text = part.get("text", "")
+        return text.strip() if isinstance(text, str) else ""
+    if kind == "data":
+        return "Data:\n```json\n" + json.dumps(part.get("data"), indent=2, ensure_ascii=False, default=str) + "\n```"
+    if kind == "file":
+        file = part.get("file")
+        if not isinstance(file, dict):
+            raise JsonRpcError(INVALID_REQUEST, f"Invalid Request: message part {index} has no 'file' object.")
+        name = str(file.get("name") or f"part-{index}")
+        if file.get("bytes") is not None:
+            raw = _decode_bytes(name, file["bytes"])
+        elif file.get("uri"):
+            raw = _fetch(name, str(file["uri"]))
+        else:
+            raise JsonRpcError(INVALID_REQUEST, f"Invalid Request: file '{name}' has neither 'bytes' nor 'uri'.")
+        return _file_text(name, file.get("mimeType"), raw)
+    logger.error("Message part %s has unsupported kind '%s'.", index, kind)
+    raise JsonRpcError(INVALID_REQUEST, f"Invalid Request: message part {index} has unsupported kind '{kind}'.")
+
+
+def message_text(parts):
+    """All parts of a message as one prompt, within A2A_MAX_INPUT_CHARS."""
+    texts = []
+    size = 0
+    for index, part in enumerate(parts):
+        text = part_text(index, part)
+        if not text:
+            continue
+        size += len(text)
+        if size > A2A_MAX_INPUT_CHARS:
+            raise JsonRpcError(
+                INVALID_PARAMS,
+                f"Invalid params: message is too long (over {A2A_MAX_INPUT_CHARS} characters).",
+                {"limit": A2A_MAX_INPUT_CHARS},
+            )
+        texts.append(text)
+    return "\n\n".join(texts)
+
+
+def needs_chunking(text):
+    return len(text) > A2A_CHUNK_THRESHOLD
+
+
+def split_chunks(text, size=None, max_chunks=None):
+    """Split `text` into pieces of at most `size` characters, on line boundaries where possible.
+
+    More than `max_chunks` pieces are joined into that many bigger ones.
+    """
+    size = size or A2A_CHUNK_SIZE
+    max_chunks = max(max_chunks or A2A_MAX_CHUNKS, 1)
+    chunks = []
+    current = []
+    length = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > size:
+            # A single line longer than a chunk (minified code, logs) is cut hard.
+            if current:
+                chunks.append("".join(current))
+                current, length = [], 0
+            chunks.append(line[:size])
+            line = line[size:]
+        if length + len(line) > size and current:
+            chunks.append("".join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line)
+    if current:
+        chunks.append("".join(current))
+    if len(chunks) > max_chunks:
+        per = math.ceil(len(chunks) / max_chunks)
+        chunks = ["".join(chunks[i:i + per]) for i in range(0, len(chunks), per)]
+    return chunks
+
+
+def question_of(text):
+    """What the user is asking: the prose outside code blocks, or a generic request."""
+    prose = " ".join(_fence.sub(" ", text).split())
+    if not prose:
+        return "Explain this input and point out any problems in it."
+    if len(prose) > QUESTION_MAX_CHARS:
+        half = QUESTION_MAX_CHARS // 2
+        prose = f"{prose[:half]} ... {prose[-half:]}"
+    return prose
+
+
+def map_prompt(question, chunk, index, total):
+    return (
+        f"You are reading part {index} of {total} of a message too long to process at once.\n"
+        f"The user's request: {question}\n\n"
+        "Write concise notes on this part for answering that request. Keep exact names, signatures, "
+        "error messages and the lines that matter; skip anything irrelevant.\n\n"
+        f"Part {index}/{total}:\n{chunk}"
+    )
+
+
+def reduce_prompt(question, notes):
+    sections = "\n\n".join(f"### Part {index}/{len(notes)}\n{note}" for index, note in enumerate(notes, 1))
+    return (
+        f"{question}\n\n"
+        "(My message was too long to send whole, so here are notes on each part of it.)\n\n"
+        f"{sections}"
+    )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_chunk_executor():
+    # Not the batch pool: a batched call that condenses would otherwise wait
+    # on threads its own batch may be holding.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=4 * A2A_CHUNK_CONCURRENCY, thread_name_prefix="a2a-chunk")
+    return _executor
+
+
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
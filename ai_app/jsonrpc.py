@@ -0,0 +1,93 @@
+"""JSON-RPC 2.0 envelope helpers shared by the sync and async A2A views."""
+import json
+import logging
+
+try:
+    import orjson  # optional: several times faster than the stdlib json module
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("ai")
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# Implementation-defined server errors (-32000 to -32099); the A2A spec
+# reserves -32001 to -32007.
+SERVER_BUSY = -32000
+TASK_NOT_FOUND = -32001
+TASK_NOT_CANCELABLE = -32002
+PUSH_NOT_SUPPORTED = -32003
+CONTENT_TYPE_NOT_SUPPORTED = -32005
+UPSTREAM_UNAVAILABLE = -32010
+DEADLINE_EXCEEDED = -32011
+QUOTA_EXCEEDED = -32012
+UNAUTHORIZED = -32013
+
+
+class JsonRpcError(Exception):
+    """Raised while handling a request; turned into a JSON-RPC error payload."""
+
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def loads(body):
+    """Decode a request body (bytes, bytearray or str)."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(payload):
+    """Encode a payload as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+def parse_body(body):
+    """Decode a request body, turning bad JSON into a JSON-RPC parse error."""
+    try:
+        return loads(body)
+    except ValueError as e:
+        logger.error("Error parsing JSON in A2A request body: %s", e)
+        raise JsonRpcError(PARSE_ERROR, f"Parse error: {str(e)}")
+
+
+def error_payload(request_id, code, message, data=None):
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+
+def result_payload(request_id, result):
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+def request_id_of(body):
+    """Best-effort request id, so even envelope errors echo the caller's id."""
+    return body.get("id") if isinstance(body, dict) else None
+
+
+def check_envelope(body):
+    """Validate the JSON-RPC envelope and return (request_id, method, params)."""
+    if not isinstance(body, dict):
+        raise JsonRpcError(INVALID_REQUEST, "Invalid Request: body is not a JSON object.")
+    request_id = body.get("id")
+    jsonrpc_version = body.get("jsonrpc")
+    if jsonrpc_version != "2.0":
+        logger.warning("Invalid JSON-RPC version: %s", jsonrpc_version)
+        raise JsonRpcError(INVALID_REQUEST, f"Invalid Request: Unsupported JSON-RPC version '{jsonrpc_version}'")
+    params = body.get("params", {})
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'params' is not an object.")
+    return request_id, body.get("method"), params
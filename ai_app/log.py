@@ -0,0 +1,225 @@
+"""Logging pipeline: queue handler, JSON lines, multi-process rotation, sampling.
+
+Request threads only filter the record, merge its arguments and put it on
+a queue. A listener thread per worker process formats it and writes it to
+a SharedRotatingFileHandler, so disk I/O never sits on the request path.
+A full queue drops records (and counts them) instead of blocking callers.
+
+All gunicorn workers append to the same file. Rotation (by size, and at the
+first write of a new LOG_ROTATE_SECONDS period) happens under an flock, and
+every process reopens the file when another one has rotated it.
+
+High-volume INFO lines are logged with ``extra=SAMPLED``; SamplingFilter
+keeps one in `every` of each such message. Warnings and errors are never
+sampled.
+
+Everything here is wired up from settings.LOGGING.
+"""
+import fcntl
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+SAMPLED = {"sampled": True}
+
+# Attributes every LogRecord has; anything else came in through `extra`.
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, pid and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep 1 in `every` INFO-or-lower records logged with ``extra=SAMPLED``, per message."""
+
+    def __init__(self, every=10):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.every == 1 or not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        with self._lock:
+            count = self._counts.get(record.msg, 0)
+            self._counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+class SharedRotatingFileHandler(logging.Handler):
+    """Append to `filename` from any number of processes, rotating by size and time."""
+
+    def __init__(self, filename, max_bytes=0, backup_count=5, rotate_seconds=0):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_seconds = rotate_seconds
+        self.stream = None
+        self._lock_file = None
+
+    def _open(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = open(self.filename, "a", encoding="utf-8")
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.stat(self.filename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _should_rotate(self, size):
+        self.stream.seek(0, os.SEEK_END)
+        position = self.stream.tell()
+        if position == 0:
+            return False
+        if self.max_bytes and position + size > self.max_bytes:
+            return True
+        if self.rotate_seconds:
+            last_write = os.fstat(self.stream.fileno()).st_mtime
+            return int(last_write // self.rotate_seconds) != int(time.time() // self.rotate_seconds)
+        return False
+
+    def _rotate(self):
+        self.stream.close()
+        self.stream = None
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.filename}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.filename}.{index + 1}")
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.truncate(self.filename, 0)
+        self._open()
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + "\n"
+            if self._lock_file is None:
+                self._lock_file = open(f"{self.filename}.lock", "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                if self.stream is None or self._rotated_elsewhere():
+                    self._open()
+                if self._should_rotate(len(line)):
+                    self._rotate()
+                self.stream.write(line)
+                self.stream.flush()
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for handle in (self.stream, self._lock_file):
+            if handle is not None:
+                handle.close()
+        self.stream = None
+        self._lock_file = None
+        super().close()
+
+
+_queue_handlers = weakref.WeakSet()
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Hands records to a per-process listener thread that writes them to the log file."""
+
+    def __init__(self, filename, max_bytes=0, backup_count=5, rotate_seconds=0, queue_size=10000):
+        self.queue_size = queue_size
+        super().__init__(queue.Queue(queue_size))
+        self.target = SharedRotatingFileHandler(filename, max_bytes, backup_count, rotate_seconds)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        _queue_handlers.add(self)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, in the target handler.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only what must happen in the caller's thread: merge the arguments
+        # (they may change later) and render the traceback.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            formatter = self.target.formatter or logging.Formatter()
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = logging.handlers.QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def after_fork(self):
+        # The listener thread did not survive the fork and the queue may hold
+        # the parent's records or a lock taken by a thread that is gone.
+        self.queue = queue.Queue(self.queue_size)
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.target.stream = None
+        self.target._lock_file = None
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+        self.target.close()
+        super().close()
+
+
+def _after_fork():
+    for handler in list(_queue_handlers):
+        handler.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
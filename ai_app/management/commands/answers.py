@@ -0,0 +1,45 @@
+import statistics
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from ai_app.answers import search
+from ai_app.models import Answer
+
+
+class Command(BaseCommand):
+    help = (
+        "Stored Gemini answers (ANSWER_STORE): per-model counts, tokens and latency percentiles, "
+        "or, with --search, the past questions that best match some text."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="only answers from the last DAYS days (0 = all)")
+        parser.add_argument("--model", help="only answers from this model")
+        parser.add_argument("--search", help="full-text search of past questions")
+        parser.add_argument("--limit", type=int, default=10, help="results shown by --search")
+
+    def handle(self, *args, **options):
+        if options["search"]:
+            for question, answer in search(options["search"], options["model"], options["limit"]):
+                self.stdout.write(f"Q: {' '.join(question.split())[:120]}")
+                self.stdout.write(f"A: {' '.join(answer.split())[:200]}\n")
+            return
+        answers = Answer.objects.all()
+        if options["days"]:
+            answers = answers.filter(created_at__gte=timezone.now() - timedelta(days=options["days"]))
+        if options["model"]:
+            answers = answers.filter(model=options["model"])
+        rows = answers.values("model").annotate(
+            count=Count("id"), follow_ups=Count("id", filter=Q(follow_up=True)),
+            avg_tokens=Avg("total_tokens"), tokens=Sum("total_tokens"),
+        ).order_by("-count")
+        self.stdout.write(f"{'model':<28}{'answers':>9}{'follow-ups':>12}{'avg tokens':>12}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'tokens':>12}")
+        for row in rows:
+            latencies = sorted(answers.filter(model=row["model"]).values_list("latency_ms", flat=True))
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f"{row['model']:<28}{row['count']:>9}{row['follow_ups']:>12}{row['avg_tokens'] or 0:>12.0f}"
+                              f"{statistics.median(latencies):>9.0f}{p95:>9.0f}{row['tokens'] or 0:>12}")
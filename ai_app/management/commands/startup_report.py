@@ -0,0 +1,59 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+STAGES = ("setup", "urls", "preload", "agent")
+
+
+class Command(BaseCommand):
+    help = (
+        "Start-up time and memory of a fresh worker per settings profile: django.setup(), "
+        "URLconf, preload (Gemini SDK, templates) and building the agent. Each profile runs "
+        "--repeat times in new interpreters; times are medians, cumulative from the start."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", default="ai_agent.settings,ai_agent.settings_agent",
+                            help="comma-separated settings modules to compare")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--no-agent", action="store_true", help="stop before building the Gemini agent")
+        parser.add_argument("--output", help="also append the results as JSON lines to this file")
+
+    def run_once(self, module, build_agent):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=module)
+        # The agent needs a key to be built, but makes no Gemini call here.
+        env.setdefault("GEMINI_API_KEY", "startup-report")
+        code = f"from ai_app.startup import measure; measure(build_agent={build_agent!r})"
+        completed = subprocess.run(
+            [sys.executable, "-c", code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise CommandError(f"{module} failed to start:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        build_agent = not options["no_agent"]
+        stages = STAGES if build_agent else STAGES[:-1]
+        self.stdout.write(f"{'profile':<28}" + "".join(f"{stage + ' ms':>12}" for stage in stages)
+                          + f"{'rss MB':>9}{'modules':>9}")
+        timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        for module in options["profiles"].split(","):
+            runs = [self.run_once(module, build_agent) for _ in range(max(options["repeat"], 1))]
+            result = {
+                "timestamp": timestamp,
+                "settings": module,
+                "ms": {stage: statistics.median(run["stages"][stage]["ms"] for run in runs) for stage in stages},
+                "rss_mb": {stage: runs[-1]["stages"][stage]["rss_mb"] for stage in stages},
+                "modules": runs[-1]["modules"],
+            }
+            self.stdout.write(f"{module:<28}" + "".join(f"{result['ms'][stage]:>12}" for stage in stages)
+                              + f"{result['rss_mb'][stages[-1]]:>9}{result['modules']:>9}")
+            if options["output"]:
+                with open(options["output"], "a") as handle:
+                    handle.write(json.dumps(result) + "\n")
@@ -0,0 +1,233 @@
+"""Multi-turn conversation memory keyed by A2A contextId (scoped by tenant, see a2a.conversation_id).
+
+Each conversation keeps its recent turns verbatim plus a rolling summary of
+older ones. When the verbatim turns exceed MEMORY_TOKEN_BUDGET, the oldest
+are folded into the summary (by Gemini, in the background) so the prompt we
+send, and the memory held per conversation, stay bounded.
+
+Stores:
+
+- ``memory``: in-process, at most MEMORY_MAX_CONVERSATIONS (LRU)
+- ``db``: the Conversation/Turn models, shared by all workers
+- ``none``: no memory, every message is answered on its own
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from decouple import config
+
+logger = logging.getLogger("ai")
+
+MEMORY_BACKEND = config("MEMORY_BACKEND", default="memory")
+MEMORY_TOKEN_BUDGET = config("MEMORY_TOKEN_BUDGET", default=2000, cast=int)
+MEMORY_SUMMARY_MAX_TOKENS = config("MEMORY_SUMMARY_MAX_TOKENS", default=400, cast=int)
+MEMORY_MAX_CONVERSATIONS = config("MEMORY_MAX_CONVERSATIONS", default=1000, cast=int)
+MEMORY_TTL_DAYS = config("MEMORY_TTL_DAYS", default=7, cast=int)
+MEMORY_PRUNE_INTERVAL = config("MEMORY_PRUNE_INTERVAL", default=3600.0, cast=float)
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a developer and a programming assistant "
+    "in at most {words} words. Keep code identifiers, error messages and decisions; "
+    "drop pleasantries.\n\n{transcript}"
+)
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def clip_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[-max_chars:]
+
+
+class InMemoryConversationStore:
+    blocking = False
+
+    def __init__(self, max_conversations):
+        self.max_conversations = max_conversations
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, context_id):
+        """Return (summary, [(role, text, tokens), ...])."""
+        with self._lock:
+            conversation = self._conversations.get(context_id)
+            if conversation is None:
+                return "", []
+            self._conversations.move_to_end(context_id)
+            return conversation["summary"], list(conversation["turns"])
+
+    def append(self, context_id, turns):
+        with self._lock:
+            conversation = self._conversations.get(context_id)
+            if conversation is None:
+                conversation = self._conversations[context_id] = {"summary": "", "turns": []}
+            conversation["turns"].extend(turns)
+            self._conversations.move_to_end(context_id)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def compact(self, context_id, summary, drop_count):
+        """Replace the summary and drop the `drop_count` oldest turns it now covers."""
+        with self._lock:
+            conversation = self._conversations.get(context_id)
+            if conversation is not None:
+                conversation["summary"] = summary
+                del conversation["turns"][:drop_count]
+
+
+class DatabaseConversationStore:
+    blocking = True
+
+    def load(self, context_id):
+        from .models import Conversation
+        conversation = Conversation.objects.filter(context_id=context_id).first()
+        if conversation is None:
+            return "", []
+        turns = [(turn.role, turn.text, turn.tokens) for turn in conversation.turns.all()]
+        return conversation.summary, turns
+
+    def append(self, context_id, turns):
+        from .models import Conversation, Turn
+        conversation, _ = Conversation.objects.get_or_create(context_id=context_id)
+        Turn.objects.bulk_create([
+            Turn(conversation=conversation, role=role, text=text, tokens=tokens)
+            for role, text, tokens in turns
+        ])
+        # touch updated_at so pruning keeps active conversations
+        conversation.save(update_fields=["updated_at"])
+
+    def compact(self, context_id, summary, drop_count):
+        from django.db import transaction
+        from .models import Conversation, Turn
+        with transaction.atomic():
+            conversation = Conversation.objects.filter(context_id=context_id).first()
+            if conversation is None:
+                return
+            conversation.summary = summary
+            conversation.save(update_fields=["summary", "updated_at"])
+            old_ids = list(conversation.turns.values_list("id", flat=True)[:drop_count])
+            Turn.objects.filter(id__in=old_ids).delete()
+
+    def prune(self, max_age_days):
+        from django.utils import timezone
+        from .models import Conversation
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        deleted, _ = Conversation.objects.filter(updated_at__lt=cutoff).delete()
+        return deleted
+
+
+class ConversationMemory:
+    def __init__(self, store, token_budget, summary_max_tokens, summarize=None):
+        self.store = store
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.summarize = summarize
+        # One background thread is plenty: summaries are rare and off the request path.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+        self._compacting = set()
+        self._lock = threading.Lock()
+        if hasattr(store, "prune"):
+            self._executor.submit(self._prune)
+
+    def _prune(self):
+        """Delete expired conversations, then again every MEMORY_PRUNE_INTERVAL seconds."""
+        try:
+            pruned = self.store.prune(MEMORY_TTL_DAYS)
+            if pruned:
+                logger.info("Pruned %s conversations older than %s days.", pruned, MEMORY_TTL_DAYS)
+        except Exception as e:
+            logger.warning("Could not prune old conversations: %s", e)
+        finally:
+            from django.db import close_old_connections
+            close_old_connections()
+        if MEMORY_PRUNE_INTERVAL > 0:
+            timer = threading.Timer(MEMORY_PRUNE_INTERVAL, self._executor.submit, (self._prune,))
+            timer.daemon = True
+            timer.start()
+
+    def contents(self, context_id):
+        """Earlier turns of the conversation as Gemini `contents` entries."""
+        summary, turns = self.store.load(context_id)
+        contents = []
+        if summary:
+            contents.append({"role": "user", "parts": [{"text": f"Summary of our conversation so far: {summary}"}]})
+            contents.append({"role": "model", "parts": [{"text": "Got it, I'll keep that in mind."}]})
+        # Compaction runs in the background, so cap what we send even if it lags.
+        budget, start = 0, len(turns)
+        while start > 0 and budget + turns[start - 1][2] <= self.token_budget:
+            start -= 1
+            budget += turns[start][2]
+        start += start % 2
+        for role, text, _ in turns[start:]:
+            contents.append({"role": role, "parts": [{"text": text}]})
+        return contents
+
+    def record(self, context_id, user_text, answer):
+        self.store.append(context_id, [
+            ("user", user_text, estimate_tokens(user_text)),
+            ("model", answer, estimate_tokens(answer)),
+        ])
+        summary, turns = self.store.load(context_id)
+        if sum(tokens for _, _, tokens in turns) > self.token_budget:
+            self._schedule_compaction(context_id)
+
+    def _schedule_compaction(self, context_id):
+        with self._lock:
+            if context_id in self._compacting:
+                return
+            self._compacting.add(context_id)
+        self._executor.submit(self._compact, context_id)
+
+    def _compact(self, context_id):
+        try:
+            summary, turns = self.store.load(context_id)
+            # Keep the newest turns that fit in half the budget verbatim and
+            # fold everything older into the summary (always whole user/model pairs).
+            keep_tokens, keep = 0, 0
+            for _, _, tokens in reversed(turns):
+                if keep_tokens + tokens > self.token_budget // 2:
+                    break
+                keep_tokens += tokens
+                keep += 1
+            keep -= keep % 2
+            old_turns = turns[:len(turns) - keep]
+            if not old_turns:
+                return
+            transcript = "\n".join(f"{role}: {text}" for role, text, _ in old_turns)
+            if summary:
+                transcript = f"Earlier summary: {summary}\n{transcript}"
+            new_summary = None
+            if self.summarize is not None:
+                try:
+                    prompt = SUMMARY_PROMPT.format(words=self.summary_max_tokens * 3 // 4, transcript=transcript)
+                    new_summary = self.summarize(prompt)
+                except Exception as e:
+                    logger.warning("Could not summarize conversation %s, truncating instead: %s", context_id, e)
+            if not new_summary:
+                new_summary = transcript
+            self.store.compact(context_id, clip_to_tokens(new_summary, self.summary_max_tokens), len(old_turns))
+            logger.info("Compacted conversation %s: folded %s turns into the summary.", context_id, len(old_turns))
+        finally:
+            with self._lock:
+                self._compacting.discard(context_id)
+            if isinstance(self.store, DatabaseConversationStore):
+                from django.db import close_old_connections
+                close_old_connections()
+
+
+def build_conversation_memory(summarize=None):
+    if MEMORY_BACKEND == "none":
+        return None
+    if MEMORY_BACKEND == "memory":
+        store = InMemoryConversationStore(MEMORY_MAX_CONVERSATIONS)
+    elif MEMORY_BACKEND == "db":
+        store = DatabaseConversationStore()
+    else:
+        raise ValueError(f"Unknown MEMORY_BACKEND '{MEMORY_BACKEND}' (expected memory, db or none).")
+    return ConversationMemory(store, MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_MAX_TOKENS, summarize)
@@ -0,0 +1,342 @@
+"""Per-stage latency histograms and counters, exposed at /ai/metrics.
+
+Hot-path code times its stages with ``timer("parse")`` or ``observe(...)``;
+each observation is a bisect plus a locked increment on fixed buckets.
+Stages: parse, validate, queue_wait, condense, upstream_connect,
+upstream_ttft, upstream_total, serialize and request.
+
+The scrape output is the Prometheus text format. Under gunicorn every
+worker has its own registry, so set METRICS_DIR to a directory shared by
+the workers (wiped on deploy): each worker then dumps its registry there
+every METRICS_FLUSH_INTERVAL seconds and a scrape, whichever worker
+serves it, sums the histograms and counters of all of them. Gauges only
+count live workers. Without METRICS_DIR a scrape shows the serving worker.
+
+When a request carries the METRICS_TRACE_HEADER header, its stage timings
+are echoed back in the result's ``metadata.trace``.
+"""
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from decouple import config
+
+logger = logging.getLogger("ai")
+
+METRICS_DIR = config("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=5.0, cast=float)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+METRICS_TRACE_HEADER = config("METRICS_TRACE_HEADER", default="X-Trace-Id")
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "a2a_stage_duration_seconds": ("histogram", "Time spent in each stage of handling an A2A request."),
+    "a2a_model_duration_seconds": ("histogram", "Duration of successful Gemini calls, per model."),
+    "a2a_model_total": ("counter", "Model selections, fallbacks, failures and hedged calls."),
+    "a2a_gemini_requests_total": ("counter", "HTTP requests sent to Gemini."),
+    "a2a_gemini_connections_opened_total": ("counter", "New TCP connections opened to Gemini."),
+    "a2a_gemini_tls_handshakes_total": ("counter", "TLS handshakes with Gemini."),
+    "a2a_gemini_tokens_total": ("counter", "Tokens reported by Gemini usage_metadata."),
+    "a2a_response_cache_total": ("counter", "Response cache lookups and writes."),
+    "a2a_singleflight_total": ("counter", "Gemini calls led or shared by request coalescing."),
+    "a2a_governor_total": ("counter", "Gemini governor admissions, rejections and retries."),
+    "a2a_push_total": ("counter", "Push notification deliveries."),
+    "a2a_answer_store_total": ("counter", "Answers queued, written, dropped and reused by the answer store."),
+    "a2a_code_checks_total": ("counter", "Python syntax checks of code parts: ok, errors, and late (result not in time)."),
+    "a2a_breaker_total": ("counter", "Gemini calls seen by the circuit breaker, failures, slow calls, openings, rejections and probes."),
+    "a2a_tenant_total": ("counter", "Calls admitted and refused by tenant quotas, and tenant usage rows flushed."),
+    "a2a_governor_active": ("gauge", "Gemini calls in flight."),
+    "a2a_governor_waiting": ("gauge", "Gemini calls waiting for capacity."),
+    "a2a_task_queue_depth": ("gauge", "Non-blocking tasks queued or running."),
+    "a2a_answer_store_queue": ("gauge", "Answers waiting to be written."),
+    "a2a_breaker_state": ("gauge", "Workers whose Gemini circuit breaker is closed, open or half-open."),
+    "a2a_tenants_tracked": ("gauge", "Tenants with quota state or unflushed usage in memory."),
+}
+
+
+class Histogram:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+_histograms = {}
+_model_histograms = {}
+_histograms_lock = threading.Lock()
+_trace = ContextVar("a2a_trace", default=None)
+
+
+def _histogram(registry, key):
+    histogram = registry.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = registry.setdefault(key, Histogram())
+    return histogram
+
+
+def observe_model(model, seconds):
+    """Latency of one successful Gemini call, per model (see router.py)."""
+    _histogram(_model_histograms, model).observe(seconds)
+    _flusher.ensure_started()
+
+
+def observe(stage, seconds):
+    _histogram(_histograms, stage).observe(seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace["timings_ms"][stage] = round(trace["timings_ms"].get(stage, 0.0) + seconds * 1000, 3)
+    _flusher.ensure_started()
+
+
+@contextmanager
+def timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def start_trace(trace_id):
+    """Collect this request's stage timings (in the current context) under `trace_id`.
+
+    Called at the start of every request: with no trace id it clears
+    whatever an earlier request on this thread left behind.
+    """
+    trace = {"id": trace_id, "timings_ms": {}} if trace_id else None
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def trace_id_of(request):
+    return request.headers.get(METRICS_TRACE_HEADER) if METRICS_TRACE_HEADER else None
+
+
+def with_trace(payload, trace):
+    """Copy of a JSON-RPC payload (or batch of them) with the trace in `result.metadata.trace`."""
+    if isinstance(payload, list):
+        return [with_trace(item, trace) for item in payload]
+    result = payload.get("result")
+    if trace is None or not isinstance(result, dict):
+        return payload
+    metadata = dict(result.get("metadata") or {}, trace=trace)
+    return dict(payload, result=dict(result, metadata=metadata))
+
+
+def _module_samples():
+    """Counters and gauges kept by the other modules, as {(name, labels): value}."""
+    from . import ai, push, tasks, tenants
+    from .breaker import STATES
+    from .clients import connection_stats
+    from .postprocess import check_stats, A2A_SPLIT_CODE
+
+    counters, gauges = {}, {}
+    connections = connection_stats.snapshot()
+    counters[("a2a_gemini_requests_total", "")] = connections["requests"]
+    counters[("a2a_gemini_connections_opened_total", "")] = connections["connections_opened"]
+    counters[("a2a_gemini_tls_handshakes_total", "")] = connections["tls_handshakes"]
+    if A2A_SPLIT_CODE:
+        for result, value in check_stats.snapshot().items():
+            counters[("a2a_code_checks_total", f'result="{result}"')] = value
+
+    # Only report what already exists; a scrape must not build the agent.
+    agent = ai._agent
+    if agent is not None:
+        for kind in ("prompt", "cached", "output"):
+            counters[("a2a_gemini_tokens_total", f'kind="{kind}"')] = agent.usage.snapshot()[f"{kind}_tokens"]
+        if agent.cache is not None:
+            for result, value in agent.cache.stats.snapshot().items():
+                counters[("a2a_response_cache_total", f'result="{result}"')] = value
+        if agent.flights is not None:
+            for role, value in agent.flights.stats.snapshot().items():
+                counters[("a2a_singleflight_total", f'role="{role}"')] = value
+        governors = agent.router.governors.values()
+        for governor in governors:
+            for event, value in governor.stats.snapshot().items():
+                key = ("a2a_governor_total", f'event="{event}"')
+                counters[key] = counters.get(key, 0) + value
+        gauges[("a2a_governor_active", "")] = sum(governor.active for governor in governors)
+        gauges[("a2a_governor_waiting", "")] = sum(governor.waiting for governor in governors)
+        if agent.answers is not None:
+            for event, value in agent.answers.stats.snapshot().items():
+                counters[("a2a_answer_store_total", f'event="{event}"')] = value
+            gauges[("a2a_answer_store_queue", "")] = agent.answers.queue_depth
+        if agent.breaker is not None:
+            for event, value in agent.breaker.stats.snapshot().items():
+                counters[("a2a_breaker_total", f'event="{event}"')] = value
+            for state in STATES:
+                gauges[("a2a_breaker_state", f'state="{state}"')] = int(agent.breaker.state == state)
+        for model, stats in list(agent.router.stats.items()):
+            for event, value in stats.snapshot().items():
+                counters[("a2a_model_total", f'model="{model}",event="{event}"')] = value
+    if push._dispatcher is not None:
+        for event, value in push._dispatcher.stats.snapshot().items():
+            counters[("a2a_push_total", f'event="{event}"')] = value
+    if tasks._runner is not None:
+        gauges[("a2a_task_queue_depth", "")] = tasks._runner.queue_depth
+    if tenants._tenants is not None:
+        for event, value in tenants._tenants.stats.snapshot().items():
+            counters[("a2a_tenant_total", f'event="{event}"')] = value
+        gauges[("a2a_tenants_tracked", "")] = tenants._tenants.tracked
+    return counters, gauges
+
+
+def _encode(samples):
+    return {f"{name}|{labels}": value for (name, labels), value in samples.items()}
+
+
+def _decode(samples):
+    return {tuple(key.split("|", 1)): value for key, value in samples.items()}
+
+
+def process_snapshot():
+    with _histograms_lock:
+        histograms = dict(_histograms)
+        model_histograms = dict(_model_histograms)
+    counters, gauges = _module_samples()
+    return {
+        "pid": os.getpid(),
+        "histograms": {stage: histogram.snapshot() for stage, histogram in histograms.items()},
+        "model_histograms": {model: histogram.snapshot() for model, histogram in model_histograms.items()},
+        "counters": _encode(counters),
+        "gauges": _encode(gauges),
+    }
+
+
+class _Flusher:
+    """Background thread dumping this worker's registry into METRICS_DIR."""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if not METRICS_DIR or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            flush()
+
+
+_flusher = _Flusher()
+
+
+def flush():
+    if not METRICS_DIR:
+        return
+    snapshot = process_snapshot()
+    path = os.path.join(METRICS_DIR, f"metrics-{snapshot['pid']}.json")
+    try:
+        with open(f"{path}.tmp", "w") as handle:
+            json.dump(snapshot, handle)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.warning("Could not write metrics to %s: %s", path, e)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Snapshots of every worker (just this one without METRICS_DIR)."""
+    if not METRICS_DIR:
+        return [process_snapshot()]
+    flush()
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+        try:
+            with open(path) as handle:
+                snapshots.append(json.load(handle))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(merged, histograms):
+    for key, data in histograms.items():
+        into = merged.setdefault(key, {"counts": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0})
+        into["counts"] = [a + b for a, b in zip(into["counts"], data["counts"])]
+        into["sum"] += data["sum"]
+        into["count"] += data["count"]
+
+
+def _render_histograms(lines, name, label, histograms):
+    lines.append(f"# HELP {name} {HELP[name][1]}")
+    lines.append(f"# TYPE {name} histogram")
+    for key in sorted(histograms):
+        data = histograms[key]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), data["counts"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {data["sum"]:.6f}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {data["count"]}')
+
+
+def render():
+    """Prometheus text exposition of all workers' metrics, summed."""
+    histograms, model_histograms, counters, gauges = {}, {}, {}, {}
+    for snapshot in collect():
+        _merge(histograms, snapshot["histograms"])
+        _merge(model_histograms, snapshot.get("model_histograms", {}))
+        for key, value in _decode(snapshot["counters"]).items():
+            counters[key] = counters.get(key, 0) + value
+        # A dead worker's counters still happened; its gauges no longer apply.
+        if snapshot["pid"] == os.getpid() or _alive(snapshot["pid"]):
+            for key, value in _decode(snapshot["gauges"]).items():
+                gauges[key] = gauges.get(key, 0) + value
+
+    lines = []
+    _render_histograms(lines, "a2a_stage_duration_seconds", "stage", histograms)
+    if model_histograms:
+        _render_histograms(lines, "a2a_model_duration_seconds", "model", model_histograms)
+
+    samples = dict(counters)
+    samples.update(gauges)
+    for name in sorted({name for name, _ in samples}):
+        kind, help_text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (sample_name, labels), value in sorted(samples.items()):
+            if sample_name == name:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:03
+
+from django.db import migrations, models
+
+# Full-text index over question and answer, kept in step with the table by
+# triggers, so every insert path (bulk_create included) is indexed.
+FTS_SQL = [
+    "CREATE VIRTUAL TABLE ai_app_answer_fts USING fts5("
+    "question, answer, content='ai_app_answer', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER ai_app_answer_ai AFTER INSERT ON ai_app_answer BEGIN "
+    "INSERT INTO ai_app_answer_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer); END",
+    "CREATE TRIGGER ai_app_answer_ad AFTER DELETE ON ai_app_answer BEGIN "
+    "INSERT INTO ai_app_answer_fts(ai_app_answer_fts, rowid, question, answer) "
+    "VALUES ('delete', old.id, old.question, old.answer); END",
+]
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS ai_app_answer_ad",
+    "DROP TRIGGER IF EXISTS ai_app_answer_ai",
+    "DROP TABLE IF EXISTS ai_app_answer_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite's; on other databases the answers are stored but not searchable.
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Answer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('answer', models.TextField()),
+                ('model', models.CharField(db_index=True, max_length=64)),
+                ('follow_up', models.BooleanField(default=False)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('cached_tokens', models.PositiveIntegerField(default=0)),
+                ('output_tokens', models.PositiveIntegerField(default=0)),
+                ('total_tokens', models.PositiveIntegerField(default=0)),
+                ('latency_ms', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(_run(FTS_SQL), _run(DROP_FTS_SQL)),
+    ]
@@ -1,3 +1,76 @@
 from django.db import models
 
 # Create your models here.
+
+
+class Conversation(models.Model):
+    """A2A conversation, keyed by the `contextId` (or `taskId`) Telex sends."""
+    context_id = models.CharField(max_length=128, unique=True)
+    summary = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.context_id
+
+
+class Turn(models.Model):
+    """One user question or agent answer that has not been summarized yet."""
+    ROLE_CHOICES = [("user", "user"), ("model", "model")]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="turns")
+    role = models.CharField(max_length=8, choices=ROLE_CHOICES)
+    text = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.conversation_id}:{self.role}"
+
+
+class Answer(models.Model):
+    """A question Gemini answered, with what the answer cost (see answers.py).
+
+    Rows are written in batches by a background thread; the ai_app_answer_fts
+    table (FTS5, kept in step by triggers) indexes question and answer.
+    """
+    question = models.TextField()
+    answer = models.TextField()
+    model = models.CharField(max_length=64, db_index=True)
+    follow_up = models.BooleanField(default=False)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    total_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.FloatField(default=0)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.question[:50]
+
+
+class TenantUsage(models.Model):
+    """What one tenant (an organization, channel or API key) used in one hour (see tenants.py).
+
+    Each worker keeps its counters in memory and adds them to the row of
+    the current hour every TENANT_FLUSH_INTERVAL seconds.
+    """
+    tenant = models.CharField(max_length=128)
+    period = models.DateTimeField(db_index=True)
+    requests = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    output_tokens = models.PositiveBigIntegerField(default=0)
+    total_latency_ms = models.FloatField(default=0)
+    max_latency_ms = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["tenant", "period"], name="ai_app_tenantusage_unique")]
+
+    def __str__(self):
+        return f"{self.tenant}@{self.period:%Y-%m-%d %H:00}"
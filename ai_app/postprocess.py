@@ -0,0 +1,300 @@
+"""Answers split into prose and code parts as they stream, with Python code syntax-checked.
+
+Gemini answers in markdown. With A2A_SPLIT_CODE on, an answer is no
+longer sent as one text part that every client has to parse again. Every
+fenced code block becomes a text part of its own. That part has
+``{"type": "code", "language": ...}`` in its metadata and no fences. The
+prose between the blocks becomes plain text parts. message/send answers
+carry these parts in the status message and the ``agent_response``
+artifact (the same list, encoded twice, never copied). message/stream
+sends each segment as its own artifact while it streams:
+
+- the Splitter works on the chunks as they arrive
+- a line is held back only while it could still turn out to be a fence
+- prose keeps flowing while a code block is still open
+
+Code tagged ``python`` (or ``py``) is syntax-checked with ast.parse on a
+pool of A2A_CHECK_WORKERS threads, as soon as its block closes. The
+answer does not wait for the checks. Results that are in within
+A2A_CHECK_WAIT seconds of the end of the answer are added to the code
+part's metadata: ``syntaxOk``, plus ``syntaxError`` ("line 3: invalid
+syntax") when the code does not parse. Later results are dropped.
+"""
+import ast
+import asyncio
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from decouple import config
+
+A2A_SPLIT_CODE = config("A2A_SPLIT_CODE", default=False, cast=bool)
+A2A_CHECK_PYTHON = config("A2A_CHECK_PYTHON", default=True, cast=bool)
+A2A_CHECK_WORKERS = config("A2A_CHECK_WORKERS", default=2, cast=int)
+A2A_CHECK_WAIT = config("A2A_CHECK_WAIT", default=0.05, cast=float)
+A2A_CHECK_MAX_CHARS = config("A2A_CHECK_MAX_CHARS", default=100000, cast=int)
+
+PROSE = "prose"
+CODE = "code"
+PYTHON_LANGUAGES = {"python", "python3", "py", "py3"}
+
+# CommonMark fences: up to 3 spaces, then 3+ backticks or tildes. A
+# backtick fence's info string cannot contain a backtick.
+_opening = re.compile(r" {0,3}(`{3,}|~{3,})(.*)")
+_closing = re.compile(r" {0,3}(`{3,}|~{3,})[ \t]*")
+# The start of a line that could still become a fence once more arrives.
+_maybe_fence = re.compile(r" {0,3}(?:`{1,2}|~{1,2})?| {0,3}(?:`{3,}|~{3,}).*")
+
+# `text` of segment number `segment`; `last` once the segment is complete.
+Piece = namedtuple("Piece", "segment kind language text last")
+
+
+class Segment:
+    """One prose run or code block of an answer; its text is joined once, when asked for."""
+
+    __slots__ = ("kind", "language", "pieces", "_text")
+
+    def __init__(self, kind, language=None):
+        self.kind = kind
+        self.language = language
+        self.pieces = []
+        self._text = None
+
+    def append(self, text):
+        self.pieces.append(text)
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.pieces)
+            self.pieces = [self._text]
+        return self._text
+
+
+class Splitter:
+    """Splits markdown fed in arbitrary chunks into prose and fenced code segments.
+
+    feed() and close() return the new Pieces, in order; `segments` has
+    every segment so far.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self._current = None
+        self._fence = None
+        self._pending = ""
+        self._held = ""
+        self._line_start = True
+
+    def feed(self, text):
+        out = []
+        data = self._pending + text
+        self._pending = ""
+        pos = 0
+        while pos < len(data):
+            newline = data.find("\n", pos)
+            end = len(data) if newline < 0 else newline + 1
+            line = data[pos:end]
+            if self._line_start:
+                if newline < 0 and _maybe_fence.fullmatch(line):
+                    # Wait for the rest of the line to know whether it is a fence.
+                    self._pending = line
+                    break
+                if self._fence_line(line, out):
+                    pos = end
+                    continue
+            self._content(line, out)
+            self._line_start = newline >= 0
+            pos = end
+        return out
+
+    def close(self):
+        """End of the answer: flush what was held back and complete the last segment."""
+        out = []
+        if self._pending:
+            line, self._pending = self._pending, ""
+            if not self._fence_line(line, out):
+                self._content(line, out)
+        self._end_segment(out)
+        return out
+
+    def _fence_line(self, line, out):
+        bare = line.rstrip("\r\n")
+        if self._fence is None:
+            match = _opening.fullmatch(bare)
+            if match is None or (match.group(1)[0] == "`" and "`" in match.group(2)):
+                return False
+            self._end_segment(out)
+            info = match.group(2).split()
+            self._fence = (match.group(1)[0], len(match.group(1)))
+            self._start_segment(CODE, info[0].lower() if info else None, out)
+            return True
+        match = _closing.fullmatch(bare)
+        if match is None or match.group(1)[0] != self._fence[0] or len(match.group(1)) < self._fence[1]:
+            return False
+        self._end_segment(out)
+        self._fence = None
+        return True
+
+    def _start_segment(self, kind, language, out):
+        self._current = Segment(kind, language)
+        self.segments.append(self._current)
+        if kind == CODE:
+            # Announce the block (and its language) before its first line.
+            out.append(Piece(len(self.segments) - 1, kind, language, "", False))
+
+    def _end_segment(self, out):
+        self._held = ""
+        if self._current is not None:
+            out.append(Piece(len(self.segments) - 1, self._current.kind, self._current.language, "", True))
+            self._current = None
+
+    def _content(self, text, out):
+        if self._current is None:
+            if self._fence is None and not text.strip():
+                # Blank lines between blocks are not worth a part of their own.
+                self._held += text
+                return
+            text, self._held = self._held + text, ""
+            self._start_segment(PROSE, None, out)
+        self._current.append(text)
+        out.append(Piece(len(self.segments) - 1, self._current.kind, self._current.language, text, False))
+
+
+def check_python(code):
+    """None if `code` parses as Python, else what is wrong with it."""
+    try:
+        ast.parse(code)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except (ValueError, RecursionError, MemoryError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+def _checkable(segment):
+    if not A2A_CHECK_PYTHON or segment.language not in PYTHON_LANGUAGES:
+        return False
+    code = segment.text
+    # Interactive sessions (">>> ...") are not meant to parse as a module.
+    return len(code) <= A2A_CHECK_MAX_CHARS and not code.lstrip().startswith(">>>")
+
+
+class CheckStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ok = 0
+        self.errors = 0
+        self.late = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {"ok": self.ok, "errors": self.errors, "late": self.late}
+
+
+check_stats = CheckStats()
+
+
+class CodeChecks:
+    """The syntax checks running for one answer's code parts."""
+
+    def __init__(self):
+        self._running = []
+
+    def submit(self, segment, metadata):
+        """Check `segment` if it is Python; the result goes into `metadata` when collected."""
+        if _checkable(segment):
+            self._running.append((metadata, get_check_executor().submit(check_python, segment.text)))
+
+    def _attach(self):
+        for metadata, future in self._running:
+            if not future.done():
+                check_stats.incr("late")
+                future.cancel()
+                continue
+            error = future.result()
+            metadata["syntaxOk"] = error is None
+            if error is not None:
+                metadata["syntaxError"] = error
+                check_stats.incr("errors")
+            else:
+                check_stats.incr("ok")
+        self._running = []
+
+    def collect(self, timeout=A2A_CHECK_WAIT):
+        """Wait up to `timeout` seconds for the checks and add their results."""
+        if self._running:
+            wait([future for _, future in self._running], timeout=timeout)
+        self._attach()
+
+    async def collect_async(self, timeout=A2A_CHECK_WAIT):
+        if self._running:
+            futures = [asyncio.wrap_future(future) for _, future in self._running if not future.done()]
+            if futures:
+                await asyncio.wait(futures, timeout=timeout)
+        self._attach()
+
+
+def segment_part(segment, checks=None):
+    """The A2A part for a segment; a code part's Python syntax check is started with `checks`."""
+    if segment.kind == PROSE:
+        return {"kind": "text", "text": segment.text}
+    metadata = {"type": CODE, "language": segment.language}
+    if checks is not None:
+        checks.submit(segment, metadata)
+    return {"kind": "text", "text": segment.text, "metadata": metadata}
+
+
+def _split(text):
+    splitter = Splitter()
+    splitter.feed(text)
+    splitter.close()
+    checks = CodeChecks()
+    return [segment_part(segment, checks) for segment in splitter.segments], checks
+
+
+def answer_parts(text):
+    """The A2A parts for a whole answer: one text part, or split with A2A_SPLIT_CODE."""
+    if not A2A_SPLIT_CODE or not text:
+        return [{"kind": "text", "text": text}]
+    parts, checks = _split(text)
+    checks.collect()
+    return parts
+
+
+async def answer_parts_async(text):
+    if not A2A_SPLIT_CODE or not text:
+        return [{"kind": "text", "text": text}]
+    parts, checks = _split(text)
+    await checks.collect_async()
+    return parts
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_check_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(A2A_CHECK_WORKERS, 1), thread_name_prefix="code-check")
+    return _executor
+
+
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
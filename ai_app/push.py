@@ -0,0 +1,337 @@
+"""A2A push notifications: POST finished tasks to the client's webhook.
+
+Clients register a webhook with `tasks/pushNotificationConfig/set` (or
+`configuration.pushNotificationConfig` on a non-blocking `message/send`).
+When the task reaches a final state it is handed to the dispatcher, which
+runs its own event loop thread so request threads never wait on webhooks:
+
+- one pooled httpx client, at most PUSH_MAX_CONCURRENCY POSTs in flight
+- failed POSTs (network errors, 429, 5xx) are retried with full-jitter
+  exponential backoff, up to PUSH_MAX_RETRIES times
+- tasks that finish within PUSH_BATCH_WINDOW seconds of each other for the
+  same webhook go out as one POST whose body is a JSON array of tasks; a
+  lone task is sent as the task object itself. Batching is opt-in: the
+  default PUSH_BATCH_MAX=1 always sends single tasks, which is what A2A
+  receivers expect; raise it only for receivers that accept arrays
+
+Webhooks on loopback, link-local (cloud metadata), private or otherwise
+internal addresses are refused, so a client cannot make the server POST
+into its own network. The name is checked when the webhook is registered
+and again right before each POST, which then connects to the very address
+that was checked (so a name that re-resolves to an internal address in
+between gets nowhere). PUSH_ALLOWED_HOSTS lists hosts that are let through
+anyway, e.g. a webhook receiver on the same private network.
+"""
+import asyncio
+import atexit
+import ipaddress
+import logging
+import os
+import random
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+from decouple import Csv, config
+
+from .jsonrpc import JsonRpcError, INVALID_PARAMS, PUSH_NOT_SUPPORTED
+
+logger = logging.getLogger("ai")
+
+PUSH_ENABLED = config("PUSH_NOTIFICATIONS_ENABLED", default=True, cast=bool)
+PUSH_MAX_CONCURRENCY = config("PUSH_MAX_CONCURRENCY", default=8, cast=int)
+PUSH_MAX_RETRIES = config("PUSH_MAX_RETRIES", default=4, cast=int)
+PUSH_BACKOFF_BASE = config("PUSH_BACKOFF_BASE", default=0.5, cast=float)
+PUSH_BACKOFF_MAX = config("PUSH_BACKOFF_MAX", default=30.0, cast=float)
+PUSH_BATCH_WINDOW = config("PUSH_BATCH_WINDOW", default=0.05, cast=float)
+PUSH_BATCH_MAX = config("PUSH_BATCH_MAX", default=1, cast=int)
+PUSH_TIMEOUT = config("PUSH_TIMEOUT", default=10.0, cast=float)
+PUSH_ALLOWED_HOSTS = config("PUSH_ALLOWED_HOSTS", default="", cast=Csv())
+
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+BLOCKED_HOSTNAMES = {"localhost", "metadata", "metadata.google.internal"}
+
+
+def _internal(address):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+def _literal(host):
+    """[host] if it is an IP address, else None."""
+    try:
+        return [ipaddress.ip_address(host).compressed]
+    except ValueError:
+        return None
+
+
+def _check_name(host):
+    if host in BLOCKED_HOSTNAMES or host.endswith(".localhost"):
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: webhook host '{host}' is not allowed.")
+
+
+def _check_addresses(host, addresses):
+    if any(_internal(address) for address in addresses):
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: webhook host '{host}' resolves to an internal address.")
+
+
+def check_webhook_host(url):
+    """Refuse webhooks that point into the server's own network, unless allowed."""
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        host = None
+    if not host:
+        raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'pushNotificationConfig.url' has no host.")
+    host = host.rstrip(".").lower()
+    if host in PUSH_ALLOWED_HOSTS:
+        return
+    _check_name(host)
+    addresses = _literal(host)
+    if addresses is None:
+        try:
+            infos = socket.getaddrinfo(host, port or 443, proto=socket.IPPROTO_TCP)
+        except (OSError, UnicodeError):
+            raise JsonRpcError(INVALID_PARAMS, f"Invalid params: webhook host '{host}' cannot be resolved.")
+        addresses = [info[4][0] for info in infos]
+    _check_addresses(host, addresses)
+
+
+async def _pinned(url):
+    """(url, extra headers, request extensions) for a POST to an address checked just now.
+
+    Raises JsonRpcError if the webhook host now points into our network and
+    OSError if it does not resolve.
+    """
+    target = httpx.URL(url)
+    host = target.host.rstrip(".").lower()
+    if host in PUSH_ALLOWED_HOSTS:
+        return target, {}, {}
+    _check_name(host)
+    addresses = _literal(host)
+    if addresses is not None:
+        _check_addresses(host, addresses)
+        return target, {}, {}
+    name = target.raw_host.decode("ascii")
+    infos = await asyncio.get_running_loop().getaddrinfo(name, target.port or (443 if target.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    addresses = [info[4][0] for info in infos]
+    _check_addresses(host, addresses)
+    # Connect to the checked address, but present the name to the server and to TLS.
+    extensions = {"sni_hostname": name} if target.scheme == "https" else {}
+    return target.copy_with(host=addresses[0].split("%", 1)[0]), {"Host": target.netloc.decode("ascii")}, extensions
+
+
+def parse_push_config(push_config):
+    """Validate an A2A PushNotificationConfig and return the fields we keep."""
+    if not PUSH_ENABLED:
+        raise JsonRpcError(PUSH_NOT_SUPPORTED, "Push Notification is not supported.")
+    if not isinstance(push_config, dict):
+        raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'pushNotificationConfig' must be an object.")
+    url = push_config.get("url")
+    if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+        raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'pushNotificationConfig.url' must be an http(s) URL.")
+    check_webhook_host(url)
+    token = push_config.get("token")
+    if token is not None and not isinstance(token, str):
+        raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'pushNotificationConfig.token' must be a string.")
+    cleaned = {"url": url}
+    if token:
+        cleaned["token"] = token
+    authentication = push_config.get("authentication")
+    if isinstance(authentication, dict):
+        cleaned["authentication"] = {
+            "schemes": list(authentication.get("schemes") or []),
+            "credentials": authentication.get("credentials"),
+        }
+    return cleaned
+
+
+def _headers(push_config):
+    headers = {"Content-Type": "application/json"}
+    if push_config.get("token"):
+        headers["X-A2A-Notification-Token"] = push_config["token"]
+    authentication = push_config.get("authentication") or {}
+    credentials = authentication.get("credentials")
+    if credentials and "bearer" in [scheme.lower() for scheme in authentication.get("schemes", [])]:
+        headers["Authorization"] = f"Bearer {credentials}"
+    return headers
+
+
+class PushStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.posts = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "retries": self.retries,
+                "posts": self.posts,
+            }
+
+
+class PushDispatcher:
+    def __init__(self, max_concurrency, max_retries, backoff_base, backoff_max, batch_window, batch_max, timeout):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_window = batch_window
+        self.batch_max = max(batch_max, 1)
+        self.timeout = timeout
+        self.stats = PushStats()
+        self._loop = None
+        self._http = None
+        self._semaphore = None
+        self._batches = {}
+        self._inflight = set()
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            ready = threading.Event()
+            thread = threading.Thread(target=self._run_loop, args=(ready,), name="a2a-push", daemon=True)
+            thread.start()
+            ready.wait()
+
+    def _run_loop(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop = loop
+        ready.set()
+        loop.run_forever()
+
+    def notify(self, push_config, task):
+        """Queue `task` for delivery to the webhook; safe to call from any thread."""
+        self._ensure_started()
+        self.stats.incr("queued")
+        self._loop.call_soon_threadsafe(self._enqueue, push_config, task)
+
+    def _enqueue(self, push_config, task):
+        headers = _headers(push_config)
+        key = (push_config["url"], tuple(sorted(headers.items())))
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            self._loop.call_later(self.batch_window, self._flush, key, batch)
+        batch.append(task)
+        if len(batch) >= self.batch_max:
+            self._flush(key, batch)
+
+    def _flush(self, key, batch):
+        # The window timer may fire after a full batch was already sent and a
+        # new one started for the same webhook; leave that one alone.
+        if self._batches.get(key) is not batch:
+            return
+        del self._batches[key]
+        delivery = self._loop.create_task(self._deliver(key[0], dict(key[1]), batch))
+        self._inflight.add(delivery)
+        delivery.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, url, headers, tasks):
+        body = tasks[0] if len(tasks) == 1 else tasks
+        for attempt in range(self.max_retries + 1):
+            try:
+                target, host_header, extensions = await _pinned(url)
+                async with self._semaphore:
+                    self.stats.incr("posts")
+                    response = await self._http.post(target, json=body, headers={**headers, **host_header}, extensions=extensions)
+                if response.status_code < 400:
+                    self.stats.incr("delivered", len(tasks))
+                    logger.info("Pushed %s task(s) to %s (attempt %s).", len(tasks), url, attempt + 1)
+                    return
+                if response.status_code not in RETRY_STATUSES:
+                    logger.warning("Webhook %s rejected %s task(s) with HTTP %s, giving up.", url, len(tasks), response.status_code)
+                    break
+                problem = f"HTTP {response.status_code}"
+            except JsonRpcError as e:
+                logger.warning("Not pushing %s task(s) to %s: %s", len(tasks), url, e.message)
+                break
+            except (httpx.HTTPError, OSError) as e:
+                problem = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                logger.warning("Push to %s failed (%s), retrying in %.2fs.", url, problem, delay)
+                self.stats.incr("retries")
+                await asyncio.sleep(delay)
+            else:
+                logger.error("Push to %s failed (%s) after %s attempts, dropping %s task(s).", url, problem, attempt + 1, len(tasks))
+        self.stats.incr("failed", len(tasks))
+
+    def close(self, timeout=5.0):
+        """Send whatever is still batched and wait up to `timeout` seconds for it."""
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+
+        async def drain():
+            for key, batch in list(self._batches.items()):
+                self._flush(key, batch)
+            if self._inflight:
+                await asyncio.wait(list(self._inflight), timeout=timeout)
+            await self._http.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(drain(), loop).result(timeout + 1)
+        except Exception as e:
+            logger.warning("Push dispatcher did not drain cleanly: %s", e)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_push_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = PushDispatcher(
+                    PUSH_MAX_CONCURRENCY, PUSH_MAX_RETRIES, PUSH_BACKOFF_BASE, PUSH_BACKOFF_MAX,
+                    PUSH_BATCH_WINDOW, PUSH_BATCH_MAX, PUSH_TIMEOUT,
+                )
+    return _dispatcher
+
+
+def _close_dispatcher():
+    if _dispatcher is not None:
+        _dispatcher.close()
+
+
+def _reset_dispatcher():
+    # The loop thread does not survive fork; the child builds its own.
+    global _dispatcher, _dispatcher_lock
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+
+
+atexit.register(_close_dispatcher)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_dispatcher)
@@ -0,0 +1,352 @@
+"""Pick a Gemini model per question, and fall back to another when it struggles.
+
+With MODEL_ROUTING on, cheap local heuristics choose the tier:
+
+- ``lite`` (GEMINI_LITE_MODEL) for short conceptual questions: at most
+  MODEL_LITE_MAX_CHARS characters, no code and no debugging keywords
+- ``flash`` (GEMINI_MODEL) for everything else, and for follow-ups
+- ``pro`` (GEMINI_PRO_MODEL) only when the client asks for it with
+  ``"metadata": {"model": "pro"}`` on the message
+
+A client may also ask for ``lite`` or ``flash`` that way. Without
+MODEL_ROUTING every call uses GEMINI_MODEL unless the client asks.
+
+When the chosen model is rate limited (429), failing (5xx), busy (its
+governor has no capacity) or slower than MODEL_SLOW_SECONDS, the call moves
+on to the next of GEMINI_FALLBACK_MODELS and the model is skipped for
+MODEL_COOLDOWN seconds. With MODEL_HEDGE_AFTER > 0, a call that has not
+answered after that many seconds is also sent to the first fallback and
+the first answer wins.
+
+Gemini quotas are per model, so every model gets its own governor (with
+the GEMINI_RPM/TPM/... limits each).
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from decouple import Csv, config
+
+from .governor import build_governor, CapacityExceeded
+from .metrics import observe_model
+
+logger = logging.getLogger("ai")
+
+GEMINI_MODEL = config("GEMINI_MODEL", default="gemini-2.5-flash")
+GEMINI_LITE_MODEL = config("GEMINI_LITE_MODEL", default="gemini-2.5-flash-lite")
+GEMINI_PRO_MODEL = config("GEMINI_PRO_MODEL", default="gemini-2.5-pro")
+GEMINI_FALLBACK_MODELS = config("GEMINI_FALLBACK_MODELS", default="", cast=Csv())
+MODEL_ROUTING = config("MODEL_ROUTING", default=False, cast=bool)
+MODEL_LITE_MAX_CHARS = config("MODEL_LITE_MAX_CHARS", default=240, cast=int)
+MODEL_SLOW_SECONDS = config("MODEL_SLOW_SECONDS", default=0.0, cast=float)
+MODEL_COOLDOWN = config("MODEL_COOLDOWN", default=30.0, cast=float)
+MODEL_HEDGE_AFTER = config("MODEL_HEDGE_AFTER", default=0.0, cast=float)
+MODEL_HEDGE_WORKERS = config("MODEL_HEDGE_WORKERS", default=32, cast=int)
+
+FALLBACK_CODES = {429, 500, 502, 503, 504}
+
+# Signs that a question needs more than the lite model: code, stack traces,
+# or asking for debugging / design work.
+_code_pattern = re.compile(
+    r"```|\bdef |\bclass |\bimport |=>|[{};]|\w+\(.*\)|Traceback|Error:"
+)
+_heavy_words = re.compile(
+    r"\b(debug|fix|error|exception|traceback|bug|refactor|optimi[sz]e|performance|architecture|design|"
+    r"implement|migrat\w*|deploy\w*|security|concurren\w*|async|compare|review)\b",
+    re.IGNORECASE,
+)
+
+
+def requested_tier(message_data):
+    """Tier the client asked for in the message's metadata ("lite", "flash" or "pro"), if any."""
+    metadata = message_data.get("metadata") if isinstance(message_data, dict) else None
+    tier = metadata.get("model") if isinstance(metadata, dict) else None
+    return tier if tier in ("lite", "flash", "pro") else None
+
+
+def is_simple(text):
+    """Short conceptual question without code or debugging keywords."""
+    return len(text) <= MODEL_LITE_MAX_CHARS and not _code_pattern.search(text) and not _heavy_words.search(text)
+
+
+def should_fall_back(error):
+    """Whether another model might succeed where this one failed."""
+    if isinstance(error, (CapacityExceeded, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    from google.genai import errors
+
+    return isinstance(error, errors.APIError) and error.code in FALLBACK_CODES
+
+
+class ModelStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.selected = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.slow = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "selected": self.selected,
+                "fallbacks": self.fallbacks,
+                "failures": self.failures,
+                "slow": self.slow,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+
+
+class ModelRouter:
+    def __init__(self, default, lite, pro, fallbacks, routing, slow_seconds, cooldown, hedge_after):
+        self.default = default
+        self.tiers = {"lite": lite or default, "flash": default, "pro": pro or default}
+        self.fallbacks = [model for model in fallbacks if model]
+        self.routing = routing
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.stats = {}
+        self._governors = {}
+        self._cooling = {}
+        self._lock = threading.Lock()
+
+    @property
+    def governors(self):
+        return dict(self._governors)
+
+    def governor(self, model):
+        governor = self._governors.get(model)
+        if governor is None:
+            with self._lock:
+                governor = self._governors.get(model)
+                if governor is None:
+                    governor = self._governors[model] = build_governor()
+                    self.stats.setdefault(model, ModelStats())
+        return governor
+
+    def _stats(self, model):
+        stats = self.stats.get(model)
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault(model, ModelStats())
+        return stats
+
+    def choose(self, text, tier=None, follow_up=False):
+        """Model for a question; `tier` is what the client asked for, if anything."""
+        if tier is None and self.routing and not follow_up and is_simple(text):
+            tier = "lite"
+        model = self.tiers.get(tier, self.default)
+        self._stats(model).incr("selected")
+        return model
+
+    def candidates(self, model):
+        """`model` and its fallbacks, with models that are cooling down moved last."""
+        models = [model] + [fallback for fallback in self.fallbacks if fallback != model]
+        now = time.monotonic()
+        with self._lock:
+            ready = [m for m in models if self._cooling.get(m, 0.0) <= now]
+        return ready + [m for m in models if m not in ready]
+
+    def record_failure(self, model, error):
+        self._stats(model).incr("failures")
+        retry_after = getattr(error, "retry_after", None) or self.cooldown
+        with self._lock:
+            self._cooling[model] = time.monotonic() + min(retry_after, self.cooldown)
+        logger.warning("Model %s failed (%s), falling back for %.0fs.", model, error, min(retry_after, self.cooldown))
+
+    def record_success(self, model, seconds, fallback):
+        observe_model(model, seconds)
+        if fallback:
+            self._stats(model).incr("fallbacks")
+        if self.slow_seconds and seconds > self.slow_seconds:
+            # Still a good answer, but send the next calls elsewhere for a while.
+            self._stats(model).incr("slow")
+            if len(self.candidates(model)) > 1:
+                with self._lock:
+                    self._cooling[model] = time.monotonic() + self.cooldown
+
+    def run(self, model, call):
+        """`call(model, retries, timing)` on `model`, falling back on failure; returns (response, model used).
+
+        Every model but the last is tried without governor retries, since
+        moving to another model is quicker than waiting out a 429. `call`
+        puts the seconds the upstream request itself took in
+        ``timing["seconds"]``: a model is judged slow by that, not by time
+        spent in the governor queue or between retries, which is this
+        worker's load.
+        """
+        candidates = self.candidates(model)
+        if self.hedge_after > 0 and len(candidates) > 1:
+            return self._run_hedged(model, candidates, call)
+        for index, candidate in enumerate(candidates):
+            last = index == len(candidates) - 1
+            try:
+                response, seconds = _timed(call, candidate, None if last else 0)
+            except Exception as e:
+                if last or not should_fall_back(e):
+                    raise
+                self.record_failure(candidate, e)
+                continue
+            self.record_success(candidate, seconds, candidate != model)
+            return response, candidate
+
+    def _run_hedged(self, model, candidates, call):
+        executor = get_hedge_executor()
+        queue = list(candidates)
+        pending = {}
+        hedged = False
+
+        def launch():
+            candidate = queue.pop(0)
+            attempt = contextvars.copy_context().run
+            pending[executor.submit(attempt, _timed, call, candidate, None if not queue else 0)] = candidate
+
+        launch()
+        error = None
+        while pending:
+            timeout = self.hedge_after if queue and not hedged else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                self._stats(candidates[0]).incr("hedged")
+                launch()
+                continue
+            for future in done:
+                candidate = pending.pop(future)
+                try:
+                    response, seconds = future.result()
+                except Exception as e:
+                    if not should_fall_back(e):
+                        raise
+                    self.record_failure(candidate, e)
+                    error = e
+                    if queue and not pending:
+                        launch()
+                    continue
+                # A slower attempt still running finishes on its own; its answer is dropped.
+                self.record_success(candidate, seconds, candidate != model)
+                if hedged and candidate != candidates[0]:
+                    self._stats(candidate).incr("hedge_wins")
+                return response, candidate
+        raise error
+
+    async def run_async(self, model, call):
+        """Async twin of run(); `call(model, retries, timing)` returns an awaitable."""
+        candidates = self.candidates(model)
+        if self.hedge_after > 0 and len(candidates) > 1:
+            return await self._run_hedged_async(model, candidates, call)
+        for index, candidate in enumerate(candidates):
+            last = index == len(candidates) - 1
+            try:
+                response, seconds = await _timed_async(call, candidate, None if last else 0)
+            except Exception as e:
+                if last or not should_fall_back(e):
+                    raise
+                self.record_failure(candidate, e)
+                continue
+            self.record_success(candidate, seconds, candidate != model)
+            return response, candidate
+
+    async def _run_hedged_async(self, model, candidates, call):
+        queue = list(candidates)
+        pending = {}
+        hedged = False
+
+        def launch():
+            candidate = queue.pop(0)
+            pending[asyncio.ensure_future(_timed_async(call, candidate, None if not queue else 0))] = candidate
+
+        launch()
+        error = None
+        try:
+            while pending:
+                timeout = self.hedge_after if queue and not hedged else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self._stats(candidates[0]).incr("hedged")
+                    launch()
+                    continue
+                for task in done:
+                    candidate = pending.pop(task)
+                    try:
+                        response, seconds = task.result()
+                    except Exception as e:
+                        if not should_fall_back(e):
+                            raise
+                        self.record_failure(candidate, e)
+                        error = e
+                        if queue and not pending:
+                            launch()
+                        continue
+                    self.record_success(candidate, seconds, candidate != model)
+                    if hedged and candidate != candidates[0]:
+                        self._stats(candidate).incr("hedge_wins")
+                    return response, candidate
+            raise error
+        finally:
+            # The losing attempt is cancelled; the governor frees its slot.
+            for task in pending:
+                task.cancel()
+
+
+def _timed(call, model, retries):
+    """(response, seconds the upstream request took); the whole call if it does not say."""
+    timing = {}
+    started = time.perf_counter()
+    response = call(model, retries, timing)
+    return response, timing.get("seconds", time.perf_counter() - started)
+
+
+async def _timed_async(call, model, retries):
+    timing = {}
+    started = time.perf_counter()
+    response = await call(model, retries, timing)
+    return response, timing.get("seconds", time.perf_counter() - started)
+
+
+def build_model_router():
+    router = ModelRouter(
+        GEMINI_MODEL, GEMINI_LITE_MODEL, GEMINI_PRO_MODEL, GEMINI_FALLBACK_MODELS,
+        MODEL_ROUTING, MODEL_SLOW_SECONDS, MODEL_COOLDOWN, MODEL_HEDGE_AFTER,
+    )
+    if MODEL_ROUTING or router.fallbacks:
+        logger.info("Model routing: %s, fallbacks: %s", "on" if MODEL_ROUTING else "off", ", ".join(router.fallbacks) or "none")
+    return router
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hedge_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MODEL_HEDGE_WORKERS, thread_name_prefix="gemini-hedge")
+    return _executor
+
+
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
@@ -0,0 +1,256 @@
+"""Request coalescing ("single flight") for identical in-flight prompts.
+
+While one caller (the leader) is fetching an answer for a key, everyone
+else asking for the same key waits for that call and shares its result
+instead of starting their own.
+
+Inside a worker this is a dict of pending calls. Across gunicorn workers
+on the same host, set SINGLEFLIGHT_LOCK_DIR: a leader then re-checks the
+(shared) response cache and leaves an in-flight marker file for the key,
+both under a short flock on a striped lock file; the Gemini call itself
+runs without the lock. A worker that finds the marker polls the cache
+until the answer is there, the marker is gone (the call failed: it then
+leads itself) or older than SINGLEFLIGHT_STALE seconds (its worker died).
+That only saves the call if RESPONSE_CACHE_BACKEND is shared
+(sqlite/django).
+
+A follower waits at most until its own request deadline (deadline.py),
+then gets DeadlineExceeded, so a hung leader cannot hold it forever. When
+the leader runs out of its own deadline or is cancelled, its followers do
+not inherit that: they try again, one of them as the new leader.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from decouple import config
+
+from .deadline import DeadlineExceeded, exceeded, time_left
+
+logger = logging.getLogger("ai")
+
+SINGLEFLIGHT_ENABLED = config("SINGLEFLIGHT_ENABLED", default=True, cast=bool)
+SINGLEFLIGHT_LOCK_DIR = config("SINGLEFLIGHT_LOCK_DIR", default="")
+SINGLEFLIGHT_STALE = config("SINGLEFLIGHT_STALE", default=120.0, cast=float)
+# Lock files are striped so their number stays bounded however many prompts we see.
+LOCK_STRIPES = 1024
+# How often a worker looks again at a lock or a key another worker is answering.
+POLL_INTERVAL = 0.05
+
+
+class FlightStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.cross_process_hits = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "cross_process_hits": self.cross_process_hits,
+            }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _pause():
+    """Sleep one poll interval, or raise DeadlineExceeded if the deadline comes first."""
+    left = time_left()
+    if left is not None and left <= POLL_INTERVAL:
+        raise exceeded()
+    time.sleep(POLL_INTERVAL)
+
+
+async def _pause_async():
+    left = time_left()
+    if left is not None and left <= POLL_INTERVAL:
+        raise exceeded()
+    await asyncio.sleep(POLL_INTERVAL)
+
+
+class SingleFlight:
+    def __init__(self, lock_dir="", stale=SINGLEFLIGHT_STALE):
+        self.lock_dir = lock_dir
+        self.stale = stale
+        self.stats = FlightStats()
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    @contextmanager
+    def _process_lock(self, digest):
+        """The flock of the key's stripe, only ever held for a few file operations.
+
+        Unrelated keys share stripes, and threads of one worker contend too
+        (flock is per open file), so it is waited for no longer than the
+        request deadline allows.
+        """
+        stripe = int(digest, 16) % LOCK_STRIPES
+        with open(os.path.join(self.lock_dir, f"flight-{stripe}.lock"), "a") as handle:
+            while True:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    _pause()
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _marker(self, digest):
+        return os.path.join(self.lock_dir, f"flight-{digest}.pending")
+
+    def _in_flight(self, marker):
+        try:
+            return time.time() - os.stat(marker).st_mtime < self.stale
+        except FileNotFoundError:
+            return False
+
+    def _claim(self, digest, recheck):
+        """(value another worker stored, or None; whether this worker now leads the key)."""
+        with self._process_lock(digest):
+            if recheck is not None:
+                value = recheck()
+                if value is not None:
+                    return value, False
+            marker = self._marker(digest)
+            if self._in_flight(marker):
+                return None, False
+            with open(marker, "w"):
+                pass
+            return None, True
+
+    def _release(self, digest):
+        # After fn() stored its answer, so whoever sees the marker gone finds it.
+        try:
+            os.unlink(self._marker(digest))
+        except FileNotFoundError:
+            pass
+
+    def _lead(self, key, fn, recheck):
+        if not self.lock_dir:
+            return fn()
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        while True:
+            value, claimed = self._claim(digest, recheck)
+            if value is not None:
+                self.stats.incr("cross_process_hits")
+                return value
+            if claimed:
+                break
+            _pause()
+        try:
+            return fn()
+        finally:
+            self._release(digest)
+
+    def do(self, key, fn, recheck=None):
+        """Run fn() once per key across concurrent callers; return (result, shared)."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            self.stats.incr("coalesced")
+            left = time_left()
+            if not call.done.wait(None if left is None else max(left, 0)):
+                raise exceeded()
+            if isinstance(call.error, DeadlineExceeded):
+                # The leader's deadline, not ours: try again.
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self.stats.incr("leaders")
+        try:
+            call.result = self._lead(key, fn, recheck)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, coro_fn, recheck=None):
+        """Async twin of do(); coalesces callers on the current event loop."""
+        while (future := self._async_calls.get(key)) is not None:
+            self.stats.incr("coalesced")
+            left = time_left()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), None if left is None else max(left, 0)), True
+            except asyncio.TimeoutError:
+                raise exceeded() from None
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled, not us: try again.
+            except DeadlineExceeded:
+                pass
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        self.stats.incr("leaders")
+        try:
+            if self.lock_dir:
+                result = await self._lead_async(key, coro_fn, recheck)
+            else:
+                result = await coro_fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+    async def _lead_async(self, key, coro_fn, recheck):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        while True:
+            value, claimed = await asyncio.to_thread(self._claim, digest, recheck)
+            if value is not None:
+                self.stats.incr("cross_process_hits")
+                return value
+            if claimed:
+                break
+            await _pause_async()
+        try:
+            return await coro_fn()
+        finally:
+            self._release(digest)
+
+
+def build_single_flight():
+    if not SINGLEFLIGHT_ENABLED:
+        return None
+    return SingleFlight(SINGLEFLIGHT_LOCK_DIR)
@@ -0,0 +1,89 @@
+"""Worker start-up: loading things before fork, and measuring what start-up costs.
+
+wsgi.py and asgi.py call preload() once the Django application exists
+(A2A_PRELOAD, on by default). It loads the Gemini SDK and the URLconf,
+and builds the agent card and doc/blog pages (assets.py), so the first
+request does not pay for them. Under ``gunicorn --preload`` this happens
+once, in the master, before the workers are forked. The workers then share those pages copy-on-write
+instead of each importing its own copy.
+
+Nothing here creates a thread, lock or socket that a worker would inherit.
+The Gemini client, the pools and the log writer are built lazily in each
+worker, and the register_at_fork hooks reset them in a forked child.
+
+``python manage.py startup_report`` runs measure() in fresh interpreters
+to compare start-up time and memory between settings profiles.
+"""
+import gc
+import json
+import os
+import sys
+import time
+
+from decouple import config
+
+A2A_PRELOAD = config("A2A_PRELOAD", default=True, cast=bool)
+
+
+def preload():
+    from django.urls import get_resolver
+
+    from google import genai  # noqa: F401
+    from google.genai import errors, types  # noqa: F401
+
+    from .assets import build_assets
+
+    get_resolver().url_patterns
+    build_assets()
+    # What is loaded now lives as long as the process. Moving it out of the
+    # collector's generations stops GC passes in the workers from writing
+    # to (and so un-sharing) the preloaded pages.
+    gc.collect()
+    gc.freeze()
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def measure(build_agent=True):
+    """Print, as one JSON line, how long each start-up stage takes and the memory after it.
+
+    Times are cumulative from the start of django.setup(). Meant to run in
+    a fresh interpreter with DJANGO_SETTINGS_MODULE set.
+    """
+    started = time.perf_counter()
+    stages = {}
+
+    def mark(stage):
+        stages[stage] = {"ms": round((time.perf_counter() - started) * 1000, 1), "rss_mb": rss_mb()}
+
+    import django
+
+    django.setup()
+    mark("setup")
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    mark("urls")
+    preload()
+    mark("preload")
+    if build_agent:
+        from ai_app.ai import get_agent
+
+        get_agent()
+        mark("agent")
+    print(json.dumps({
+        "settings": os.environ.get("DJANGO_SETTINGS_MODULE"),
+        "stages": stages,
+        "modules": len(sys.modules),
+    }))
@@ -0,0 +1,367 @@
+"""Non-blocking A2A tasks: `message/send` with `configuration.blocking: false`.
+
+The request returns a `submitted` task right away and the Gemini call runs
+on a bounded thread pool. Clients poll with `tasks/get` or abort with
+`tasks/cancel`, or register a webhook (see push.py) to be told when the
+task is done. When TASK_QUEUE_MAX tasks are already queued or running,
+new ones are refused with a SERVER_BUSY error instead of piling up.
+
+Task state lives in a pluggable store: ``memory`` (per worker, so polls
+must reach the same worker) or ``django`` (the Django cache framework,
+shared by all workers when it is Redis/Memcached/database backed).
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from decouple import config
+
+from .a2a import build_task_result, user_message
+from .deadline import start_deadline, A2A_TASK_DEADLINE
+from .router import requested_tier
+from .tenants import tracked
+from .jsonrpc import (
+    JsonRpcError, INVALID_PARAMS, SERVER_BUSY, TASK_NOT_CANCELABLE, TASK_NOT_FOUND,
+)
+from .push import get_push_dispatcher, parse_push_config
+
+logger = logging.getLogger("ai")
+
+TASK_WORKERS = config("TASK_WORKERS", default=8, cast=int)
+TASK_QUEUE_MAX = config("TASK_QUEUE_MAX", default=64, cast=int)
+TASK_STORE_BACKEND = config("TASK_STORE_BACKEND", default="memory")
+TASK_STORE_MAX = config("TASK_STORE_MAX", default=5000, cast=int)
+TASK_TTL = config("TASK_TTL", default=3600, cast=int)
+TASK_DJANGO_ALIAS = config("TASK_DJANGO_ALIAS", default="default")
+
+TERMINAL_STATES = {"completed", "canceled", "failed", "rejected"}
+# How long a task update may hold the task's lock in the Django cache store.
+UPDATE_LOCK_TTL = 5
+
+
+class InMemoryTaskStore:
+    """Per-worker store; hands out copies so callers never share a task dict."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._tasks = OrderedDict()
+        self._push_configs = {}
+        self._lock = threading.Lock()
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def save(self, task):
+        with self._lock:
+            self._save(task)
+
+    def _save(self, task):
+        self._tasks[task["id"]] = dict(task)
+        self._tasks.move_to_end(task["id"])
+        while len(self._tasks) > self.max_entries:
+            evicted, _ = self._tasks.popitem(last=False)
+            self._push_configs.pop(evicted, None)
+
+    def update(self, task_id, change):
+        """Save change(task or None) unless it returns None, atomically; return what was saved."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            task = change(dict(task) if task is not None else None)
+            if task is not None:
+                self._save(task)
+            return task
+
+    def get_push_config(self, task_id):
+        with self._lock:
+            return self._push_configs.get(task_id)
+
+    def save_push_config(self, task_id, push_config):
+        with self._lock:
+            self._push_configs[task_id] = push_config
+
+
+class DjangoCacheTaskStore:
+    def __init__(self, alias, ttl):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, task_id):
+        return self.cache.get(f"a2a_task:{task_id}")
+
+    def save(self, task):
+        self.cache.set(f"a2a_task:{task['id']}", task, self.ttl)
+
+    def update(self, task_id, change):
+        """Like InMemoryTaskStore.update(), across workers: under a lock made with cache.add()."""
+        lock = f"a2a_task_lock:{task_id}"
+        # The lock expires, so a worker that died holding it only delays the others.
+        while not self.cache.add(lock, 1, UPDATE_LOCK_TTL):
+            time.sleep(0.01)
+        try:
+            task = change(self.get(task_id))
+            if task is not None:
+                self.save(task)
+            return task
+        finally:
+            self.cache.delete(lock)
+
+    def get_push_config(self, task_id):
+        return self.cache.get(f"a2a_push:{task_id}")
+
+    def save_push_config(self, task_id, push_config):
+        self.cache.set(f"a2a_push:{task_id}", push_config, self.ttl)
+
+
+def _status(state):
+    return {"state": state, "timestamp": datetime.utcnow().isoformat()}
+
+
+def _unless_canceled(task):
+    """A store.update() change that saves `task` unless the stored one was canceled meanwhile."""
+    return lambda current: None if current is not None and current["status"]["state"] == "canceled" else task
+
+
+class TaskRunner:
+    def __init__(self, store, workers, queue_max):
+        self.store = store
+        self.queue_max = queue_max
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="a2a-task")
+        self._futures = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    def submit(self, message_data, user_text, context_id, agent, push_config=None, ticket=None, conversation=None):
+        """Queue a Gemini call and return the `submitted` task for the response.
+
+        `conversation` is the memory key of the message (a2a.conversation_id()).
+
+        `ticket` is the call's admission by its tenant (tenants.py), if any;
+        it is finished here when the task is refused, canceled while queued
+        or done.
+        """
+        with self._lock:
+            full = self._pending >= self.queue_max
+            if not full:
+                self._pending += 1
+        if full:
+            logger.warning("Task queue full (%s/%s), refusing new task.", self._pending, self.queue_max)
+            error = JsonRpcError(SERVER_BUSY, "Server busy: too many queued tasks, retry later.", {"queueDepth": self._pending})
+            if ticket is not None:
+                ticket.finish(error=error)
+            raise error
+
+        task = {
+            "id": str(uuid.uuid4()),
+            "contextId": context_id,
+            "kind": "task",
+            "status": _status("submitted"),
+            "history": [user_message(message_data, user_text)],
+        }
+        self.store.save(task)
+        if push_config is not None:
+            self.store.save_push_config(task["id"], push_config)
+        # Registered under the lock, so _run cannot finish and drop it before it is there.
+        with self._lock:
+            try:
+                future = self._executor.submit(self._run, task["id"], message_data, user_text, context_id, agent, ticket, conversation)
+            except Exception as e:
+                self._pending -= 1
+                if ticket is not None:
+                    ticket.finish(error=e)
+                raise
+            self._futures[task["id"]] = future
+        if ticket is not None:
+            # A task canceled while queued never reaches _run.
+            future.add_done_callback(lambda future: future.cancelled() and ticket.finish())
+        logger.info("Queued task %s (queue depth %s).", task['id'], self._pending)
+        return task
+
+    def _run(self, task_id, message_data, user_text, context_id, agent, ticket=None, conversation=None):
+        # Pool threads keep their context between tasks, so always set it.
+        start_deadline(A2A_TASK_DEADLINE)
+        if ticket is not None:
+            ticket.resume()
+        try:
+            def start(task):
+                if task is None or task["status"]["state"] == "canceled":
+                    return None
+                task["status"] = _status("working")
+                return task
+
+            if self.store.update(task_id, start) is None:
+                return
+
+            metadata = {}
+            with tracked(ticket, metadata):
+                ai_agent_response = agent.gemini_response(user_text, meta=metadata, context_id=conversation, tier=requested_tier(message_data))
+
+            # The task may have been canceled (possibly by another worker) meanwhile.
+            task = build_task_result(message_data, user_text, ai_agent_response, metadata, context_id, task_id)
+            if self.store.update(task_id, _unless_canceled(task)) is None:
+                logger.info("Task %s was canceled, dropping its result.", task_id)
+                return
+            self._notify(task)
+        except Exception as e:
+            logger.error("Task %s failed: %s", task_id, e, exc_info=True)
+
+            def fail(task):
+                if task is not None and task["status"]["state"] == "canceled":
+                    return None
+                task = task or {"id": task_id, "contextId": context_id, "kind": "task"}
+                task["status"] = _status("failed")
+                return task
+
+            task = self.store.update(task_id, fail)
+            if task is not None:
+                self._notify(task)
+        finally:
+            if ticket is not None:
+                # Canceled before it started; a call that ran is finished already.
+                ticket.finish()
+            with self._lock:
+                self._pending -= 1
+                self._futures.pop(task_id, None)
+            if isinstance(self.store, DjangoCacheTaskStore):
+                from django.db import close_old_connections
+                close_old_connections()
+
+    def get(self, task_id, history_length=None):
+        task = self.store.get(task_id)
+        if task is None:
+            raise JsonRpcError(TASK_NOT_FOUND, f"Task not found: {task_id}")
+        if history_length is not None and "history" in task:
+            task = dict(task, history=task["history"][-history_length:] if history_length else [])
+        return task
+
+    def cancel(self, task_id):
+        def cancel(task):
+            # Checked in the same update as the save, so a task completing meanwhile stays completed.
+            if task is None:
+                raise JsonRpcError(TASK_NOT_FOUND, f"Task not found: {task_id}")
+            if task["status"]["state"] in TERMINAL_STATES:
+                raise JsonRpcError(TASK_NOT_CANCELABLE, f"Task cannot be canceled: {task_id} is already {task['status']['state']}.")
+            task["status"] = _status("canceled")
+            return task
+
+        task = self.store.update(task_id, cancel)
+        with self._lock:
+            future = self._futures.get(task_id)
+        # A queued call never starts; a running one finishes but its result is dropped.
+        if future is not None and future.cancel():
+            # _run will not run, so its bookkeeping is done here.
+            with self._lock:
+                self._pending -= 1
+                self._futures.pop(task_id, None)
+        logger.info("Canceled task %s.", task_id)
+        self._notify(task)
+        return task
+
+    def _notify(self, task):
+        push_config = self.store.get_push_config(task["id"])
+        if push_config is not None:
+            get_push_dispatcher().notify(push_config, task)
+
+    def set_push_config(self, task_id, push_config):
+        task = self.store.get(task_id)
+        if task is None:
+            raise JsonRpcError(TASK_NOT_FOUND, f"Task not found: {task_id}")
+        self.store.save_push_config(task_id, push_config)
+        # Registered after the task already finished: deliver it straight away.
+        if task["status"]["state"] in TERMINAL_STATES:
+            get_push_dispatcher().notify(push_config, task)
+        return {"taskId": task_id, "pushNotificationConfig": push_config}
+
+    def get_push_config(self, task_id):
+        if self.store.get(task_id) is None:
+            raise JsonRpcError(TASK_NOT_FOUND, f"Task not found: {task_id}")
+        push_config = self.store.get_push_config(task_id)
+        if push_config is None:
+            raise JsonRpcError(INVALID_PARAMS, f"Invalid params: no push notification config for task {task_id}.")
+        return {"taskId": task_id, "pushNotificationConfig": push_config}
+
+
+def _task_id_param(params, name="id"):
+    task_id = params.get(name)
+    if not isinstance(task_id, str) or not task_id:
+        raise JsonRpcError(INVALID_PARAMS, f"Invalid params: 'params.{name}' must be a task id string.")
+    return task_id
+
+
+def handle_task_method(method, params):
+    """Result for `tasks/get`, `tasks/cancel` and `tasks/pushNotificationConfig/*`."""
+    runner = get_task_runner()
+    if method == "tasks/get":
+        history_length = params.get("historyLength")
+        if history_length is not None and (not isinstance(history_length, int) or history_length < 0):
+            raise JsonRpcError(INVALID_PARAMS, "Invalid params: 'params.historyLength' must be a non-negative integer.")
+        return runner.get(_task_id_param(params), history_length)
+    if method == "tasks/pushNotificationConfig/set":
+        push_config = parse_push_config(params.get("pushNotificationConfig"))
+        return runner.set_push_config(_task_id_param(params, "taskId"), push_config)
+    if method == "tasks/pushNotificationConfig/get":
+        return runner.get_push_config(_task_id_param(params))
+    return runner.cancel(_task_id_param(params))
+
+
+TASK_METHODS = (
+    "tasks/get", "tasks/cancel",
+    "tasks/pushNotificationConfig/set", "tasks/pushNotificationConfig/get",
+)
+
+
+def _configuration(params):
+    configuration = params.get("configuration") or {}
+    return configuration if isinstance(configuration, dict) else {}
+
+
+def is_non_blocking(params):
+    return _configuration(params).get("blocking") is False
+
+
+def push_config_of(params):
+    """The webhook sent along with `message/send`, validated, or None."""
+    push_config = _configuration(params).get("pushNotificationConfig")
+    return parse_push_config(push_config) if push_config is not None else None
+
+
+def build_task_store():
+    if TASK_STORE_BACKEND == "memory":
+        return InMemoryTaskStore(TASK_STORE_MAX)
+    if TASK_STORE_BACKEND == "django":
+        return DjangoCacheTaskStore(TASK_DJANGO_ALIAS, TASK_TTL)
+    raise ValueError(f"Unknown TASK_STORE_BACKEND '{TASK_STORE_BACKEND}' (expected memory or django).")
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_task_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = TaskRunner(build_task_store(), TASK_WORKERS, TASK_QUEUE_MAX)
+    return _runner
+
+
+def _reset_runner():
+    global _runner, _runner_lock
+    _runner = None
+    _runner_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_runner)
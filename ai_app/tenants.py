@@ -0,0 +1,461 @@
+"""Per-tenant quotas, usage accounting and fair scheduling of Gemini calls.
+
+Every Telex organization and channel posts to the same /ai/work, so
+without this one noisy channel can use up the Gemini quota of all of
+them. Every message/send and message/stream call is put down to a
+tenant, which scopes its conversation memory (see a2a.conversation_id)
+and, with TENANTS_ENABLED, its quota. With TENANT_API_KEYS ("key=tenant,...") that is the
+tenant of its API key, sent as ``Authorization: Bearer <key>`` or
+``X-API-Key``, and a call without a key it lists is refused with a
+JSON-RPC "unauthorized" error. Without keys, it is the first of:
+
+- the TENANT_HEADER header
+- the TENANT_METADATA_KEYS of the message's (or the params') metadata,
+  joined with "/" (``org_id/channel_id`` by default)
+- "anonymous"
+
+The header and the metadata are whatever the caller says, so put the
+agent behind keys when that matters.
+
+Each tenant may make TENANT_RPM calls and spend TENANT_TPM tokens a minute
+(0 for no limit), or what TENANT_QUOTAS says for it ("tenant=rpm:tpm").
+Tokens are estimated up front like the governor does, and settled with
+the usage Gemini reports (nothing for an answer from a cache). A message
+long enough to be condensed is charged for its map calls before they run
+(see charge()). A call over
+quota is refused at once with QuotaExceeded, which the views turn into a
+JSON-RPC "quota exceeded" error with a retryAfter. Like the governor's,
+the limits are per worker process.
+
+With TENANT_FAIR_QUEUE, calls waiting in the governor queue are ordered
+by weighted fair queueing between tenants (see governor.py), a tenant
+getting the share TENANT_WEIGHTS gives it ("tenant=weight", 1 by default).
+
+What each tenant used (calls, rejections, errors, tokens, latency) is
+counted in memory and added to its TenantUsage row for the hour every
+TENANT_FLUSH_INTERVAL seconds by a background thread; the Django admin
+lists the rows. Only TENANT_MAX_TRACKED tenants are tracked per worker at
+a time; calls of any more are counted (and limited) as "other".
+
+Needs ``python manage.py migrate``.
+"""
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from decouple import Csv, config
+
+from .governor import estimate_request_tokens, use_share, TokenBucket
+from .jsonrpc import JsonRpcError, UNAUTHORIZED
+
+logger = logging.getLogger("ai")
+
+TENANTS_ENABLED = config("TENANTS_ENABLED", default=False, cast=bool)
+TENANT_HEADER = config("TENANT_HEADER", default="X-Tenant-Id")
+TENANT_API_KEYS = config("TENANT_API_KEYS", default="", cast=Csv())
+TENANT_METADATA_KEYS = config("TENANT_METADATA_KEYS", default="org_id,channel_id", cast=Csv())
+TENANT_RPM = config("TENANT_RPM", default=0, cast=int)
+TENANT_TPM = config("TENANT_TPM", default=0, cast=int)
+TENANT_QUOTAS = config("TENANT_QUOTAS", default="", cast=Csv())
+TENANT_WEIGHTS = config("TENANT_WEIGHTS", default="", cast=Csv())
+TENANT_FAIR_QUEUE = config("TENANT_FAIR_QUEUE", default=True, cast=bool)
+TENANT_FLUSH_INTERVAL = config("TENANT_FLUSH_INTERVAL", default=10.0, cast=float)
+TENANT_MAX_TRACKED = config("TENANT_MAX_TRACKED", default=10000, cast=int)
+
+ANONYMOUS = "anonymous"
+OTHER = "other"
+MAX_NAME = 128
+
+_ticket = ContextVar("tenant_ticket", default=None)
+
+# Counters added to the TenantUsage row of the hour on every flush.
+SUMS = ("requests", "rejected", "errors", "prompt_tokens", "cached_tokens", "output_tokens", "total_latency_ms")
+
+
+class QuotaExceeded(Exception):
+    """The tenant used up its quota; it may call again in `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=None, tenant=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.tenant = tenant
+
+
+def _pairs(items):
+    """{"a": "b"} from ["a=b", ...]; entries without "=" are ignored."""
+    pairs = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+def parse_quotas(items, rpm, tpm):
+    """{tenant: (rpm, tpm)} from ["tenant=rpm:tpm", ...]; a missing number takes the default."""
+    quotas = {}
+    for tenant, value in _pairs(items).items():
+        requests, _, tokens = value.partition(":")
+        quotas[tenant] = (int(requests) if requests else rpm, int(tokens) if tokens else tpm)
+    return quotas
+
+
+def parse_weights(items):
+    return {tenant: max(float(weight), 0.01) for tenant, weight in _pairs(items).items()}
+
+
+API_KEYS = _pairs(TENANT_API_KEYS)
+
+
+def _clean(name):
+    return name.strip()[:MAX_NAME] or ANONYMOUS
+
+
+def api_key_of(request):
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[7:].strip()
+    return request.headers.get("X-API-Key")
+
+
+def tenant_of(request, params, message_data=None):
+    """Name of the tenant a JSON-RPC call is made for.
+
+    Raises JsonRpcError (UNAUTHORIZED) when TENANT_API_KEYS is set and the
+    call does not carry one of its keys: the caller's word is not taken then.
+    """
+    if API_KEYS:
+        tenant = API_KEYS.get(api_key_of(request) or "") if request is not None else None
+        if not tenant:
+            raise JsonRpcError(UNAUTHORIZED, "Unauthorized: send a valid API key as 'Authorization: Bearer <key>' or X-API-Key.")
+        return tenant
+    if TENANT_HEADER and request is not None:
+        tenant = request.headers.get(TENANT_HEADER)
+        if tenant:
+            return _clean(tenant)
+    for source in (message_data, params):
+        metadata = source.get("metadata") if isinstance(source, dict) else None
+        if isinstance(metadata, dict):
+            values = [str(metadata[key]) for key in TENANT_METADATA_KEYS if metadata.get(key)]
+            if values:
+                return _clean("/".join(values))
+    return ANONYMOUS
+
+
+class TenantStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flush_errors = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "flushed": self.flushed,
+                "flush_errors": self.flush_errors,
+            }
+
+
+def _zero():
+    return dict.fromkeys(SUMS, 0) | {"max_latency_ms": 0.0}
+
+
+class Tenant:
+    """One tenant's quota buckets and the usage not flushed yet."""
+
+    __slots__ = ("name", "share", "requests", "tokens", "usage")
+
+    def __init__(self, name, rpm, tpm, weight):
+        self.name = name
+        self.share = (name, weight)
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.usage = _zero()
+
+    def idle(self, now):
+        """Nothing to flush and quotas back to full: nothing lost by forgetting it."""
+        if self.usage["requests"] or self.usage["rejected"]:
+            return False
+        return all(bucket is None or bucket.delay(bucket.capacity, now) == 0 for bucket in (self.requests, self.tokens))
+
+
+class Ticket:
+    """A call admitted by Tenants.admit(); finish() it when it is answered.
+
+    Only the first finish() counts, so a safety net may finish it again.
+    """
+
+    __slots__ = ("tenants", "tenant", "tokens", "started", "finished")
+
+    def __init__(self, tenants, tenant, tokens):
+        self.tenants = tenants
+        self.tenant = tenant
+        self.tokens = tokens
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def resume(self):
+        """Queue the Gemini calls of the current context under this tenant's share.
+
+        For contexts the view's is not carried to: response generators, task threads.
+        """
+        use_share(self.tenant.share if self.tenants.fair else None)
+        _ticket.set(self)
+
+    def finish(self, meta=None, error=None):
+        """Count the call, and settle its token estimate against the usage in `meta`."""
+        self.tenants.finish(self, (meta or {}).get("usage"), error, time.perf_counter() - self.started)
+
+
+class Tenants:
+    def __init__(self, rpm, tpm, quotas, weights, fair, flush_interval, max_tracked):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.quotas = quotas
+        self.weights = weights
+        self.fair = fair
+        self.flush_interval = flush_interval
+        self.max_tracked = max(max_tracked, 1)
+        self.stats = TenantStats()
+        self._tenants = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name="tenant-usage", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @property
+    def tracked(self):
+        return len(self._tenants)
+
+    def _tenant_locked(self, name):
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            if len(self._tenants) >= self.max_tracked and name not in self.quotas and name not in self.weights:
+                name = OTHER
+                tenant = self._tenants.get(name)
+                if tenant is not None:
+                    return tenant
+            rpm, tpm = self.quotas.get(name, (self.rpm, self.tpm))
+            tenant = self._tenants[name] = Tenant(name, rpm, tpm, self.weights.get(name, 1.0))
+        return tenant
+
+    def admit(self, name, text):
+        """Let one call of tenant `name` about `text` through, or raise QuotaExceeded.
+
+        Also queues the current context's Gemini calls under the tenant's share.
+        """
+        tokens = estimate_request_tokens(text)
+        now = time.monotonic()
+        with self._lock:
+            tenant = self._tenant_locked(name)
+            wait = 0.0
+            if tenant.requests is not None:
+                wait = tenant.requests.delay(1, now)
+            if tenant.tokens is not None:
+                wait = max(wait, tenant.tokens.delay(tokens, now))
+            if wait > 0:
+                tenant.usage["rejected"] += 1
+            else:
+                if tenant.requests is not None:
+                    tenant.requests.take(1)
+                if tenant.tokens is not None:
+                    tenant.tokens.take(tokens)
+        if wait > 0:
+            self.stats.incr("rejected")
+            logger.warning("Tenant '%s' is over its quota, refusing a call for %.1fs.", tenant.name, wait)
+            raise QuotaExceeded(f"Quota of tenant '{tenant.name}' used up, please retry later.", math.ceil(wait), tenant.name)
+        self.stats.incr("admitted")
+        ticket = Ticket(self, tenant, tokens)
+        ticket.resume()
+        return ticket
+
+    def charge(self, ticket, tokens):
+        """Take `tokens` more for an admitted call, or raise QuotaExceeded."""
+        bucket = ticket.tenant.tokens
+        with self._lock:
+            wait = bucket.delay(tokens, time.monotonic()) if bucket is not None else 0.0
+            if wait <= 0:
+                if bucket is not None:
+                    bucket.take(tokens)
+                # Settled against the usage like the admission estimate.
+                ticket.tokens += tokens
+        if wait > 0:
+            self.stats.incr("rejected")
+            logger.warning("Tenant '%s' cannot afford %s more tokens, refusing for %.1fs.", ticket.tenant.name, tokens, wait)
+            raise QuotaExceeded(f"Quota of tenant '{ticket.tenant.name}' used up, please retry later.", math.ceil(wait), ticket.tenant.name)
+
+    def finish(self, ticket, usage, error, seconds):
+        used = usage["total_tokens"] if usage else 0
+        latency_ms = seconds * 1000
+        with self._lock:
+            if ticket.finished:
+                return
+            ticket.finished = True
+            # Forgotten by a flush while the call ran (or already tracked anew).
+            tenant = self._tenants.setdefault(ticket.tenant.name, ticket.tenant)
+            counts = tenant.usage
+            counts["requests"] += 1
+            counts["errors"] += error is not None
+            if usage:
+                counts["prompt_tokens"] += usage["prompt_tokens"]
+                counts["cached_tokens"] += usage["cached_tokens"]
+                counts["output_tokens"] += usage["output_tokens"]
+            counts["total_latency_ms"] += latency_ms
+            counts["max_latency_ms"] = max(counts["max_latency_ms"], latency_ms)
+            if tenant.tokens is not None:
+                if used > ticket.tokens:
+                    tenant.tokens.take(used - ticket.tokens)
+                else:
+                    tenant.tokens.give(ticket.tokens - used)
+
+    def _take_usage(self):
+        """The usage counted since the last flush, {tenant: counts}; forgets idle tenants."""
+        now = time.monotonic()
+        taken = {}
+        with self._lock:
+            for name, tenant in list(self._tenants.items()):
+                if tenant.usage["requests"] or tenant.usage["rejected"]:
+                    taken[name] = tenant.usage
+                    tenant.usage = _zero()
+                elif tenant.idle(now):
+                    del self._tenants[name]
+        return taken
+
+    def _give_back(self, taken):
+        with self._lock:
+            for name, counts in taken.items():
+                tenant = self._tenant_locked(name)
+                for key in SUMS:
+                    tenant.usage[key] += counts[key]
+                tenant.usage["max_latency_ms"] = max(tenant.usage["max_latency_ms"], counts["max_latency_ms"])
+
+    def flush(self):
+        """Add the usage counted since the last flush to this hour's TenantUsage rows."""
+        taken = self._take_usage()
+        if not taken:
+            return
+        from django.db import close_old_connections, transaction
+        from django.db.models import F, Value
+        from django.db.models.functions import Greatest
+        from django.utils import timezone
+        from .models import TenantUsage
+
+        period = timezone.now().replace(minute=0, second=0, microsecond=0)
+        try:
+            with transaction.atomic():
+                for name, counts in taken.items():
+                    row, _ = TenantUsage.objects.get_or_create(tenant=name, period=period)
+                    TenantUsage.objects.filter(pk=row.pk).update(
+                        max_latency_ms=Greatest("max_latency_ms", Value(counts["max_latency_ms"])),
+                        **{key: F(key) + counts[key] for key in SUMS},
+                    )
+        except Exception as e:
+            # Kept for the next flush rather than lost.
+            self._give_back(taken)
+            self.stats.incr("flush_errors")
+            logger.warning("Could not store the usage of %s tenants (did you run migrate?): %s", len(taken), e)
+            return
+        finally:
+            close_old_connections()
+        self.stats.incr("flushed", len(taken))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self, timeout=5.0):
+        """Stop the flusher and write what is still counted."""
+        if not self._flusher.is_alive():
+            return
+        self._stop.set()
+        self._flusher.join(timeout)
+        self.flush()
+
+
+def build_tenants():
+    if not TENANTS_ENABLED:
+        return None
+    return Tenants(
+        TENANT_RPM, TENANT_TPM, parse_quotas(TENANT_QUOTAS, TENANT_RPM, TENANT_TPM),
+        parse_weights(TENANT_WEIGHTS), TENANT_FAIR_QUEUE, TENANT_FLUSH_INTERVAL, TENANT_MAX_TRACKED,
+    )
+
+
+_tenants = None
+_tenants_lock = threading.Lock()
+
+
+def get_tenants():
+    """This worker's Tenants, or None without TENANTS_ENABLED."""
+    global _tenants
+    if _tenants is None and TENANTS_ENABLED:
+        with _tenants_lock:
+            if _tenants is None:
+                _tenants = build_tenants()
+    return _tenants
+
+
+def admit(request, params, message_data, user_text):
+    """Admit a message call for its tenant: the Ticket to finish, or None without TENANTS_ENABLED.
+
+    Raises QuotaExceeded when the tenant is over quota.
+    """
+    tenants = get_tenants()
+    if tenants is None:
+        return None
+    return tenants.admit(tenant_of(request, params, message_data), user_text)
+
+
+def charge(tokens):
+    """Charge the tenant of the current call `tokens` ahead of Gemini calls beyond the one admitted.
+
+    Raises QuotaExceeded when they do not fit its quota. Does nothing
+    outside a tenant's call (or without TENANTS_ENABLED).
+    """
+    ticket = _ticket.get()
+    if ticket is not None and not ticket.finished:
+        ticket.tenants.charge(ticket, tokens)
+
+
+@contextmanager
+def tracked(ticket, meta=None):
+    """Finish `ticket` (if any) when the block ends, with the error it raised.
+
+    A block cut short by the client going away counts as a call, not an error.
+    """
+    if ticket is None:
+        yield
+        return
+    try:
+        yield
+    except Exception as e:
+        ticket.finish(meta, e)
+        raise
+    except BaseException:
+        ticket.finish(meta)
+        raise
+    ticket.finish(meta)
+
+
+def _reset_tenants():
+    global _tenants, _tenants_lock
+    _tenants = None
+    _tenants_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_tenants)
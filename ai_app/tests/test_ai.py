@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ai_app import clients, inputs, tenants
+from bench.fake_gemini import DEFAULT_TEXT, FakeGeminiServer
+
+
+class AgentTestCase(SimpleTestCase):
+    """A real Ai_Agent, pointed at bench/fake_gemini.py; every test gets a fresh one."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from ai_app import ai
+
+        cls.gemini = FakeGeminiServer(latency=0.0).start()
+        cls.addClassCleanup(cls.gemini.shutdown)
+        for patcher in (
+            mock.patch.object(clients, "BASE_URL", cls.gemini.base_url),
+            mock.patch.object(clients, "api_key", "fake-key"),
+            mock.patch.object(ai, "api_key", "fake-key"),
+        ):
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+        clients.reset_client()
+        cls.addClassCleanup(clients.reset_client)
+
+    def setUp(self):
+        from ai_app import ai
+
+        self.agent = ai.Ai_Agent()
+        self.gemini.requests = 0
+
+
+class LongInputTests(AgentTestCase):
+    def setUp(self):
+        for name, value in (("A2A_CHUNK_THRESHOLD", 500), ("A2A_CHUNK_SIZE", 200)):
+            patcher = mock.patch.object(inputs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        super().setUp()
+        lines = "".join(f"line {i}: some log output that goes on for a while\n" for i in range(30))
+        self.text = "Why does this job fail?\n```\n" + lines + "```"
+
+    def test_long_input_is_condensed_then_answered_from_the_cache(self):
+        meta = {}
+        self.assertEqual(self.agent.gemini_response(self.text, meta=meta), DEFAULT_TEXT)
+        chunks = meta["chunks"]
+        self.assertGreater(chunks, 1)
+        self.assertEqual(self.gemini.requests, chunks + 1)
+
+        again = {}
+        self.assertEqual(self.agent.gemini_response(self.text, meta=again), DEFAULT_TEXT)
+        # Keyed on the message, not on the notes Gemini wrote: no new map calls.
+        self.assertEqual(self.gemini.requests, chunks + 1)
+        self.assertNotIn("chunks", again)
+
+    def test_conversation_keeps_the_condensed_prompt(self):
+        if self.agent.memory is None:
+            self.skipTest("conversation memory is off")
+        with mock.patch.object(self.agent.memory, "record") as record:
+            self.agent.gemini_response(self.text, context_id="ctx-long")
+        remembered = record.call_args.args[1]
+        self.assertNotEqual(remembered, self.text)
+        self.assertIn("Why does this job fail?", remembered)
+
+    def test_usage_of_the_map_calls_is_counted(self):
+        meta = {}
+        self.agent.gemini_response(self.text, meta=meta)
+        single = {}
+        self.agent.gemini_response("What is a tuple?", meta=single)
+        # The fake reports the same output for every call.
+        self.assertEqual(meta["usage"]["output_tokens"], single["usage"]["output_tokens"] * (meta["chunks"] + 1))
+
+    def test_map_calls_are_charged_to_the_tenant_before_they_run(self):
+        pool = tenants.Tenants(0, 1000, {}, {}, False, 3600.0, 100)
+        self.addCleanup(pool.close)
+        ticket = pool.admit("org-1", self.text)
+        with self.assertRaises(tenants.QuotaExceeded):
+            with tenants.tracked(ticket):
+                self.agent.gemini_response(self.text)
+        self.assertEqual(self.gemini.requests, 0)
+
+    def test_chunks_are_capped(self):
+        chunks = inputs.split_chunks(self.text, max_chunks=3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual("".join(chunks), self.text)
@@ -0,0 +1,32 @@
+import contextvars
+
+from django.test import RequestFactory, SimpleTestCase
+
+from ai_app import deadline
+
+
+class BudgetTests(SimpleTestCase):
+    def budget(self, method, asked):
+        request = RequestFactory().post("/ai/work", SERVER_NAME="localhost", HTTP_X_REQUEST_TIMEOUT=asked)
+        return deadline.budget_of(request, method)
+
+    def test_client_may_only_shorten_the_deadline(self):
+        self.assertEqual(self.budget("message/send", "5"), 5.0)
+        self.assertEqual(self.budget("message/send", "100000"), deadline.A2A_SEND_DEADLINE)
+
+    def test_unusable_header_values_are_ignored(self):
+        for asked in ("soon", "-3", "0", "nan"):
+            with self.subTest(asked=asked):
+                self.assertEqual(self.budget("message/send", asked), deadline.A2A_SEND_DEADLINE)
+
+    def test_huge_header_values_stay_finite_without_a_method_deadline(self):
+        for asked in ("inf", "1e400", "1e30"):
+            with self.subTest(asked=asked):
+                budget = self.budget("tasks/get", asked)
+                self.assertEqual(budget, deadline.A2A_MAX_DEADLINE)
+
+                def timeout():
+                    deadline.start_deadline(budget)
+                    return deadline.timeout_ms()
+
+                self.assertLessEqual(contextvars.Context().run(timeout), deadline.A2A_MAX_DEADLINE * 1000)
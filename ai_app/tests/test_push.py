@@ -0,0 +1,225 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ai_app import push
+from ai_app.jsonrpc import JsonRpcError, INVALID_PARAMS
+
+
+class WebhookStub:
+    """Local webhook receiver; answers with `statuses` in turn, then 200."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        self.received = threading.Condition()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                with stub.received:
+                    stub.requests.append({"headers": dict(self.headers), "body": body, "status": status})
+                    stub.received.notify_all()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, count, timeout=5.0):
+        with self.received:
+            self.received.wait_for(lambda: len(self.requests) >= count, timeout)
+        return self.requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def task(task_id, state="completed"):
+    return {"id": task_id, "contextId": "ctx", "kind": "task", "status": {"state": state}}
+
+
+def resolving(name, address):
+    """getaddrinfo that resolves `name` to `address` and everything else as usual."""
+    real = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host == name:
+            return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, port))]
+        return real(host, port, *args, **kwargs)
+
+    return mock.patch("ai_app.push.socket.getaddrinfo", getaddrinfo)
+
+
+class PushDispatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.dispatchers = []
+        # The stubs listen on loopback, which webhooks may not use otherwise.
+        patcher = mock.patch.object(push, "PUSH_ALLOWED_HOSTS", ["127.0.0.1"])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.close()
+
+    def dispatcher(self, batch_max=1, batch_window=0.01, max_retries=3):
+        dispatcher = push.PushDispatcher(4, max_retries, 0.01, 0.05, batch_window, batch_max, 5.0)
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def webhook(self, statuses=()):
+        stub = WebhookStub(statuses)
+        self.addCleanup(stub.close)
+        return stub
+
+    def wait_for_stats(self, dispatcher, name, value, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while dispatcher.stats.snapshot()[name] < value and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return dispatcher.stats.snapshot()
+
+    def test_single_task_is_posted_as_the_task_object(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher()
+        dispatcher.notify({"url": stub.url}, task("t1"))
+        dispatcher.notify({"url": stub.url}, task("t2"))
+        requests = stub.wait_for(2)
+        self.assertEqual(sorted(r["body"]["id"] for r in requests), ["t1", "t2"])
+        self.assertEqual(self.wait_for_stats(dispatcher, "delivered", 2)["posts"], 2)
+
+    def test_tasks_finishing_together_are_batched_when_enabled(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher(batch_max=10, batch_window=0.2)
+        for task_id in ("t1", "t2", "t3"):
+            dispatcher.notify({"url": stub.url}, task(task_id))
+        requests = stub.wait_for(1)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual([t["id"] for t in requests[0]["body"]], ["t1", "t2", "t3"])
+        stats = self.wait_for_stats(dispatcher, "delivered", 3)
+        self.assertEqual((stats["posts"], stats["delivered"]), (1, 3))
+
+    def test_full_batch_is_sent_without_waiting_for_the_window(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher(batch_max=2, batch_window=30.0)
+        dispatcher.notify({"url": stub.url}, task("t1"))
+        dispatcher.notify({"url": stub.url}, task("t2"))
+        requests = stub.wait_for(1, timeout=2.0)
+        self.assertEqual([t["id"] for t in requests[0]["body"]], ["t1", "t2"])
+
+    def test_token_and_bearer_credentials_are_sent_as_headers(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher()
+        push_config = {
+            "url": stub.url,
+            "token": "secret-token",
+            "authentication": {"schemes": ["Bearer"], "credentials": "abc123"},
+        }
+        dispatcher.notify(push_config, task("t1"))
+        headers = stub.wait_for(1)[0]["headers"]
+        self.assertEqual(headers["X-A2A-Notification-Token"], "secret-token")
+        self.assertEqual(headers["Authorization"], "Bearer abc123")
+        self.assertEqual(headers["Content-Type"], "application/json")
+
+    def test_retryable_failures_are_retried_with_backoff(self):
+        stub = self.webhook(statuses=[503, 429])
+        dispatcher = self.dispatcher()
+        with mock.patch("ai_app.push.random.uniform", side_effect=lambda low, high: high) as uniform:
+            dispatcher.notify({"url": stub.url}, task("t1"))
+            requests = stub.wait_for(3)
+            stats = self.wait_for_stats(dispatcher, "delivered", 1)
+        self.assertEqual([r["status"] for r in requests], [503, 429, 200])
+        self.assertEqual((stats["retries"], stats["delivered"], stats["failed"]), (2, 1, 0))
+        # Full jitter over an exponentially growing cap.
+        self.assertEqual([call.args for call in uniform.call_args_list], [(0, 0.01), (0, 0.02)])
+
+    def test_gives_up_after_max_retries(self):
+        stub = self.webhook(statuses=[500] * 10)
+        dispatcher = self.dispatcher(max_retries=2)
+        dispatcher.notify({"url": stub.url}, task("t1"))
+        stats = self.wait_for_stats(dispatcher, "failed", 1)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual((stats["retries"], stats["failed"], stats["delivered"]), (2, 1, 0))
+
+    def test_client_errors_are_not_retried(self):
+        stub = self.webhook(statuses=[400])
+        dispatcher = self.dispatcher()
+        dispatcher.notify({"url": stub.url}, task("t1"))
+        stats = self.wait_for_stats(dispatcher, "failed", 1)
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(stats["retries"], 0)
+
+
+    def test_host_is_checked_again_when_posting(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher()
+        url = stub.url.replace("127.0.0.1", "hooks.example.com")
+        with resolving("hooks.example.com", "93.184.216.34"):
+            push_config = push.parse_push_config({"url": url})
+        # The name now points at the loopback stub (DNS rebinding).
+        with resolving("hooks.example.com", "127.0.0.1"):
+            dispatcher.notify(push_config, task("t1"))
+            stats = self.wait_for_stats(dispatcher, "failed", 1)
+        self.assertEqual(stats["posts"], 0)
+        self.assertEqual(stub.requests, [])
+
+    def test_post_goes_to_the_checked_address_under_the_webhook_name(self):
+        stub = self.webhook()
+        dispatcher = self.dispatcher()
+        url = stub.url.replace("127.0.0.1", "hooks.example.com")
+        with resolving("hooks.example.com", "127.0.0.1"), mock.patch.object(push, "_internal", return_value=False):
+            dispatcher.notify({"url": url}, task("t1"))
+            requests = stub.wait_for(1)
+        self.assertEqual(requests[0]["headers"]["Host"], f"hooks.example.com:{stub.server.server_port}")
+
+
+class ParsePushConfigTests(SimpleTestCase):
+    def assertRefused(self, url):
+        with self.assertRaises(JsonRpcError) as raised:
+            push.parse_push_config({"url": url})
+        self.assertEqual(raised.exception.code, INVALID_PARAMS)
+
+    def test_internal_hosts_are_refused(self):
+        for url in (
+            "http://127.0.0.1:8000/hook",
+            "http://localhost/hook",
+            "http://[::1]/hook",
+            "http://[::ffff:127.0.0.1]/hook",
+            "http://0.0.0.0/hook",
+            "http://169.254.169.254/latest/meta-data/",
+            "http://metadata.google.internal/computeMetadata/v1/",
+            "http://10.0.0.5/hook",
+            "http://192.168.1.10/hook",
+        ):
+            with self.subTest(url=url):
+                self.assertRefused(url)
+
+    def test_hostnames_are_checked_by_what_they_resolve_to(self):
+        infos = [(2, 1, 6, "", ("10.1.2.3", 443))]
+        with mock.patch("ai_app.push.socket.getaddrinfo", return_value=infos):
+            self.assertRefused("https://hooks.example.com/a2a")
+        infos = [(2, 1, 6, "", ("93.184.216.34", 443))]
+        with mock.patch("ai_app.push.socket.getaddrinfo", return_value=infos):
+            self.assertEqual(push.parse_push_config({"url": "https://hooks.example.com/a2a"}), {"url": "https://hooks.example.com/a2a"})
+
+    def test_allowed_hosts_let_internal_webhooks_through(self):
+        with mock.patch.object(push, "PUSH_ALLOWED_HOSTS", ["127.0.0.1"]):
+            self.assertEqual(push.parse_push_config({"url": "http://127.0.0.1:8000/hook"}), {"url": "http://127.0.0.1:8000/hook"})
+        self.assertRefused("http://127.0.0.1:8000/hook")
+
+    def test_only_http_urls_are_accepted(self):
+        self.assertRefused("file:///etc/passwd")
+        self.assertRefused("ftp://example.com/")
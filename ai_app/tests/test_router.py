@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from django.test import SimpleTestCase
+
+from ai_app.router import ModelRouter
+
+
+def queued_call(wait, upstream):
+    """A call that spends `wait` seconds queued locally and `upstream` seconds at Gemini."""
+    def call(model, retries, timing):
+        time.sleep(wait)
+        timing["seconds"] = upstream
+        return f"answer from {model}"
+    return call
+
+
+def slow(router, model):
+    stats = router.stats.get(model)
+    return stats.slow if stats is not None else 0
+
+
+class SlowModelTests(SimpleTestCase):
+    def router(self, hedge_after=0.0):
+        return ModelRouter("flash", "lite", "pro", ["fallback"], False, 0.05, 30.0, hedge_after)
+
+    def test_queue_wait_does_not_make_a_model_slow(self):
+        for hedge_after in (0.0, 5.0):
+            with self.subTest(hedged=bool(hedge_after)):
+                router = self.router(hedge_after)
+                self.assertEqual(router.run("flash", queued_call(0.1, 0.01)), ("answer from flash", "flash"))
+                self.assertEqual(slow(router, "flash"), 0)
+                self.assertEqual(router.candidates("flash")[0], "flash")
+
+    def test_slow_upstream_cools_the_model_down(self):
+        router = self.router()
+        router.run("flash", queued_call(0.0, 0.5))
+        self.assertEqual(slow(router, "flash"), 1)
+        self.assertEqual(router.candidates("flash"), ["fallback", "flash"])
+
+    def test_async_queue_wait_does_not_make_a_model_slow(self):
+        async def call(model, retries, timing):
+            await asyncio.sleep(0.1)
+            timing["seconds"] = 0.01
+            return "answer"
+
+        router = self.router()
+        self.assertEqual(asyncio.run(router.run_async("flash", call)), ("answer", "flash"))
+        self.assertEqual(slow(router, "flash"), 0)
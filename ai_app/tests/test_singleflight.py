@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from ai_app import singleflight
+from ai_app.deadline import DeadlineExceeded, start_deadline
+
+
+def in_thread(fn, *args):
+    """Run fn(*args) in a thread with a fresh context; returns (thread, outcome dict)."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn(*args)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=contextvars.Context().run, args=(run,))
+    thread.start()
+    return thread, outcome
+
+
+class InProcessTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = singleflight.SingleFlight()
+
+    def test_follower_retries_after_the_leaders_deadline(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def short_leader():
+            start_deadline(5.0)
+
+            def call():
+                started.set()
+                release.wait(5)
+                raise DeadlineExceeded()
+
+            return self.flight.do("k", call)
+
+        leader, led = in_thread(short_leader)
+        started.wait(5)
+        follower, followed = in_thread(self.flight.do, "k", lambda: "answer")
+        while self.flight.stats.coalesced == 0:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertIsInstance(led["error"], DeadlineExceeded)
+        self.assertEqual(followed["result"], ("answer", False))
+
+    def test_other_errors_are_shared(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def call():
+            started.set()
+            release.wait(5)
+            raise ValueError("upstream broke")
+
+        leader, _ = in_thread(self.flight.do, "k", call)
+        started.wait(5)
+        follower, followed = in_thread(self.flight.do, "k", lambda: "answer")
+        while self.flight.stats.coalesced == 0:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertIsInstance(followed["error"], ValueError)
+
+    def test_async_follower_retries_when_the_leader_is_cancelled(self):
+        async def scenario():
+            started = asyncio.Event()
+
+            async def hang():
+                started.set()
+                await asyncio.sleep(10)
+
+            async def answer():
+                return "answer"
+
+            leader = asyncio.create_task(self.flight.do_async("k", hang))
+            await started.wait()
+            follower = asyncio.create_task(self.flight.do_async("k", answer))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.wait_for(follower, 5)
+
+        self.assertEqual(asyncio.run(scenario()), ("answer", False))
+
+
+class CrossProcessTests(SimpleTestCase):
+    """Two SingleFlight objects on one lock dir stand in for two workers."""
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.workers = [singleflight.SingleFlight(lock_dir.name) for _ in range(2)]
+        self.cache = {}
+
+    def test_second_worker_waits_for_the_first_and_reads_the_cache(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            self.cache["k"] = "answer"
+            return "answer"
+
+        first, _ = in_thread(self.workers[0].do, "k", call, lambda: self.cache.get("k"))
+        started.wait(5)
+        second, waited = in_thread(self.workers[1].do, "k", call, lambda: self.cache.get("k"))
+        time.sleep(0.2)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(waited["result"], ("answer", False))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.workers[1].stats.cross_process_hits, 1)
+
+    def test_lock_is_not_held_during_the_call(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return "slow"
+
+        first, _ = in_thread(self.workers[0].do, "a", slow)
+        started.wait(5)
+        # Every key lands on some stripe; force a collision instead of searching for one.
+        self.addCleanup(setattr, singleflight, "LOCK_STRIPES", singleflight.LOCK_STRIPES)
+        singleflight.LOCK_STRIPES = 1
+        start = time.monotonic()
+        self.assertEqual(self.workers[1].do("b", lambda: "fast"), ("fast", False))
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        first.join(5)
+
+    def test_wait_for_another_worker_is_bounded_by_the_deadline(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def hang():
+            started.set()
+            release.wait(5)
+            return "late"
+
+        first, _ = in_thread(self.workers[0].do, "k", hang)
+        started.wait(5)
+
+        def impatient():
+            start_deadline(0.3)
+            return self.workers[1].do("k", lambda: "answer")
+
+        start = time.monotonic()
+        second, waited = in_thread(impatient)
+        second.join(5)
+        self.assertIsInstance(waited["error"], DeadlineExceeded)
+        self.assertLess(time.monotonic() - start, 2)
+        release.set()
+        first.join(5)
+
+    def test_failed_call_lets_the_next_worker_lead(self):
+        with self.assertRaises(ValueError):
+            self.workers[0].do("k", self._fail)
+        self.assertEqual(self.workers[1].do("k", lambda: "answer"), ("answer", False))
+
+    def test_stale_marker_is_ignored(self):
+        self.workers[1].stale = 0.1
+        digest = singleflight.hashlib.sha1(b"k").hexdigest()
+        with open(self.workers[0]._marker(digest), "w"):
+            pass
+        time.sleep(0.2)
+        self.assertEqual(self.workers[1].do("k", lambda: "answer"), ("answer", False))
+
+    @staticmethod
+    def _fail():
+        raise ValueError("upstream broke")
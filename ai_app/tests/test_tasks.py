@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from ai_app import tasks
+from ai_app.jsonrpc import JsonRpcError, TASK_NOT_CANCELABLE
+
+
+class QuickAgent:
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+
+    def gemini_response(self, user_text, meta=None, context_id=None, tier=None):
+        self.release.wait(5)
+        return "Use a for loop."
+
+
+def message():
+    return {"kind": "message", "role": "user", "messageId": "msg-1", "parts": [{"kind": "text", "text": "Loop?"}]}
+
+
+class TaskRunnerTests(SimpleTestCase):
+    store_class = staticmethod(lambda: tasks.InMemoryTaskStore(1000))
+
+    def setUp(self):
+        self.agent = QuickAgent()
+        self.addCleanup(self.agent.release.set)
+        self.runner = tasks.TaskRunner(self.store_class(), 4, 200)
+
+    def wait_until_idle(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while self.runner.queue_depth and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.runner.queue_depth, 0)
+
+    def submit(self):
+        return self.runner.submit(message(), "Loop?", "ctx", self.agent)
+
+    def state(self, task):
+        return self.runner.store.get(task["id"])["status"]["state"]
+
+    def test_finished_tasks_leave_no_futures_behind(self):
+        for _ in range(100):
+            self.submit()
+        self.wait_until_idle()
+        self.assertEqual(self.runner._futures, {})
+
+    def test_cancel_does_not_overwrite_a_finished_task(self):
+        task = self.submit()
+        self.wait_until_idle()
+        with self.assertRaises(JsonRpcError) as raised:
+            self.runner.cancel(task["id"])
+        self.assertEqual(raised.exception.code, TASK_NOT_CANCELABLE)
+        self.assertEqual(self.state(task), "completed")
+
+    def test_answer_of_a_canceled_task_is_dropped(self):
+        self.agent.release.clear()
+        task = self.submit()
+        while self.state(task) != "working":
+            time.sleep(0.01)
+        self.runner.cancel(task["id"])
+        self.agent.release.set()
+        self.wait_until_idle()
+        self.assertEqual(self.state(task), "canceled")
+
+    def test_updates_do_not_lose_each_other(self):
+        store = self.runner.store
+        store.save({"id": "t1", "count": 0})
+
+        def bump(task):
+            time.sleep(0.001)
+            return dict(task, count=task["count"] + 1)
+
+        threads = [threading.Thread(target=lambda: [store.update("t1", bump) for _ in range(20)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(store.get("t1")["count"], 80)
+
+
+class DjangoCacheTaskRunnerTests(TaskRunnerTests):
+    store_class = staticmethod(lambda: tasks.DjangoCacheTaskStore("default", 60))
@@ -0,0 +1,345 @@
+import json
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, SimpleTestCase
+
+from ai_app import clients, tasks, tenants
+from ai_app.breaker import CircuitOpen
+from ai_app.deadline import DeadlineExceeded
+from ai_app.governor import CapacityExceeded
+from ai_app.jsonrpc import (
+    DEADLINE_EXCEEDED, INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND, QUOTA_EXCEEDED, SERVER_BUSY,
+    TASK_NOT_CANCELABLE, TASK_NOT_FOUND, UNAUTHORIZED, UPSTREAM_UNAVAILABLE,
+)
+from ai_app.tenants import QuotaExceeded
+from ai_app.views import AsyncGetResponse, FastGetResponse, GetResponse
+from bench.fake_gemini import DEFAULT_TEXT, FakeGeminiServer
+
+
+class StubAgent:
+    """Stands in for Ai_Agent: answers `answer`, streams `chunks`, or raises `error`."""
+
+    def __init__(self, answer="Use a for loop.", chunks=("Use a ", "for loop."), error=None):
+        self.answer = answer
+        self.chunks = chunks
+        self.error = error
+        self.calls = []
+        # Non-blocking tasks wait for this before answering.
+        self.release = threading.Event()
+        self.release.set()
+
+    def _call(self, user_text, context_id):
+        self.calls.append((user_text, context_id))
+        if self.error is not None:
+            raise self.error
+
+    def gemini_response(self, user_text, meta=None, context_id=None, tier=None):
+        self.release.wait(5)
+        self._call(user_text, context_id)
+        return self.answer
+
+    async def gemini_response_async(self, user_text, meta=None, context_id=None, tier=None):
+        self._call(user_text, context_id)
+        return self.answer
+
+    def gemini_stream(self, user_text, meta=None, context_id=None, tier=None):
+        yield self.chunks[0]
+        self._call(user_text, context_id)
+        yield from self.chunks[1:]
+
+    async def gemini_stream_async(self, user_text, meta=None, context_id=None, tier=None):
+        yield self.chunks[0]
+        self._call(user_text, context_id)
+        for chunk in self.chunks[1:]:
+            yield chunk
+
+
+def message(text="How do I loop through a list in Python?", **fields):
+    return {"kind": "message", "role": "user", "messageId": "msg-1", "parts": [{"kind": "text", "text": text}], **fields}
+
+
+def call(method="message/send", request_id=1, **params):
+    params.setdefault("message", message())
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+
+
+def task_call(method, task_id, request_id=2):
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": {"id": task_id}}
+
+
+def streamed(response):
+    """Everything a streaming response sends, read the way the server would."""
+    if not response.is_async:
+        return b"".join(response)
+
+    async def read():
+        return b"".join([chunk async for chunk in response])
+
+    return async_to_sync(read)()
+
+
+def sse_payloads(content):
+    """The JSON-RPC payloads of an SSE body, checking every event's framing."""
+    events = content.decode().split("\n\n")
+    assert events.pop() == "", "the stream must end with a blank line"
+    payloads = []
+    for event in events:
+        assert event.startswith("data: ") and "\n" not in event, f"bad SSE event: {event!r}"
+        payloads.append(json.loads(event[len("data: "):]))
+    return payloads
+
+
+class A2AViewTests:
+    """JSON-RPC behaviour every /ai/work view must share; mixed into one TestCase per view."""
+
+    view_class = FastGetResponse
+
+    def setUp(self):
+        self.agent = StubAgent()
+        self.runner = tasks.TaskRunner(tasks.InMemoryTaskStore(100), 1, 2)
+        for patcher in (
+            mock.patch("ai_app.views.get_agent", lambda: self.agent),
+            mock.patch.object(tasks, "_runner", self.runner),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.agent.release.set)
+
+    def request(self, body, **headers):
+        request = RequestFactory().post(
+            "/ai/work", json.dumps(body), content_type="application/json", SERVER_NAME="localhost", **headers,
+        )
+        view = self.view_class.as_view()
+        if self.view_class.view_is_async:
+            return async_to_sync(view)(request)
+        return view(request)
+
+    def post(self, body, **headers):
+        response = self.request(body, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        return json.loads(response.content)
+
+    def assertError(self, payload, code, request_id=1):
+        self.assertEqual(payload["jsonrpc"], "2.0")
+        self.assertEqual(payload["id"], request_id)
+        self.assertNotIn("result", payload)
+        self.assertEqual(payload["error"]["code"], code)
+        return payload["error"]
+
+    def wait_until_idle(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while self.runner.queue_depth and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.runner.queue_depth, 0)
+
+    def test_send_answers_with_a_completed_task(self):
+        payload = self.post(call())
+        self.assertEqual((payload["jsonrpc"], payload["id"]), ("2.0", 1))
+        task = payload["result"]
+        self.assertEqual(task["kind"], "task")
+        self.assertEqual(task["status"]["state"], "completed")
+        self.assertEqual(task["status"]["message"]["parts"][0]["text"], "Use a for loop.")
+        self.assertEqual(self.agent.calls, [("How do I loop through a list in Python?", None)])
+
+    def test_send_uses_memory_only_for_a_client_context_id(self):
+        payload = self.post(call(message=message(contextId="ctx-1")))
+        self.assertEqual(payload["result"]["contextId"], "ctx-1")
+        self.assertIsNotNone(self.agent.calls[-1][1])
+
+    def test_memory_of_a_context_id_belongs_to_its_tenant(self):
+        send = call(message=message(contextId="ctx-1"))
+        self.post(send, HTTP_X_TENANT_ID="org-1")
+        self.post(send, HTTP_X_TENANT_ID="org-1")
+        self.post(send, HTTP_X_TENANT_ID="org-2")
+        self.post(dict(send, params=dict(send["params"], configuration={"blocking": False})), HTTP_X_TENANT_ID="org-2")
+        self.wait_until_idle()
+        response = self.request(call("message/stream", message=message(contextId="ctx-1")), HTTP_ACCEPT="text/event-stream", HTTP_X_TENANT_ID="org-2")
+        streamed(response)
+        response.close()
+        keys = [context_id for _, context_id in self.agent.calls]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[1], keys[2])
+        self.assertEqual(keys[2:], [keys[2]] * 3)
+
+    def test_upstream_errors_map_to_json_rpc_errors(self):
+        cases = [
+            (CapacityExceeded("no capacity", retry_after=3), SERVER_BUSY, {"retryAfter": 3}),
+            (CircuitOpen("Gemini is failing", retry_after=12), UPSTREAM_UNAVAILABLE, {"retryAfter": 12}),
+            (DeadlineExceeded(budget=5.0), DEADLINE_EXCEEDED, {"deadline": 5.0}),
+        ]
+        for error, code, data in cases:
+            with self.subTest(error=type(error).__name__):
+                self.agent.error = error
+                self.assertEqual(self.assertError(self.post(call()), code)["data"], data)
+
+    def test_tenant_over_quota_is_refused_before_calling_gemini(self):
+        refusal = QuotaExceeded("Quota of tenant 'org-1/general' used up, please retry later.", 7, "org-1/general")
+        with mock.patch("ai_app.views.admit", side_effect=refusal):
+            error = self.assertError(self.post(call()), QUOTA_EXCEEDED)
+        self.assertEqual(error["data"], {"retryAfter": 7, "tenant": "org-1/general"})
+        self.assertEqual(self.agent.calls, [])
+
+    def test_api_keys_are_required_once_configured(self):
+        with mock.patch.object(tenants, "API_KEYS", {"key-1": "org-1"}):
+            self.assertError(self.post(call()), UNAUTHORIZED)
+            self.assertError(self.post(call(), HTTP_X_TENANT_ID="org-1"), UNAUTHORIZED)
+            self.assertError(self.post(call(), HTTP_AUTHORIZATION="Bearer key-2"), UNAUTHORIZED)
+            self.assertError(self.post(call("message/stream")), UNAUTHORIZED)
+            self.assertEqual(self.agent.calls, [])
+            payload = self.post(call(), HTTP_AUTHORIZATION="Bearer key-1")
+            self.assertEqual(payload["result"]["status"]["state"], "completed")
+            self.assertEqual(self.post(call(), HTTP_X_API_KEY="key-1")["result"]["status"]["state"], "completed")
+
+    def test_unknown_method_and_malformed_calls(self):
+        self.assertError(self.post(call("message/shout")), METHOD_NOT_FOUND)
+        self.assertError(self.post(call(message={"role": "user"})), INVALID_REQUEST)
+        self.assertError(self.post(dict(call(), params=["not", "an", "object"])), INVALID_PARAMS)
+
+    def test_batch_answers_every_call_in_order(self):
+        payloads = self.post([
+            call(request_id="a"),
+            call("message/shout", request_id="b"),
+            call(request_id="c", message=message("What is a tuple?")),
+        ])
+        self.assertEqual([payload["id"] for payload in payloads], ["a", "b", "c"])
+        self.assertEqual(payloads[0]["result"]["status"]["state"], "completed")
+        self.assertEqual(payloads[1]["error"]["code"], METHOD_NOT_FOUND)
+        self.assertEqual(payloads[2]["result"]["status"]["state"], "completed")
+        self.assertEqual(len(self.agent.calls), 2)
+
+    def test_empty_batch_and_stream_in_batch_are_invalid(self):
+        self.assertError(self.post([]), INVALID_REQUEST, request_id=None)
+        payloads = self.post([call("message/stream")])
+        self.assertError(payloads[0], INVALID_REQUEST)
+
+    def test_stream_sends_sse_events_in_a2a_order(self):
+        response = self.request(call("message/stream"), HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        payloads = sse_payloads(streamed(response))
+        response.close()
+
+        self.assertTrue(all(payload["id"] == 1 for payload in payloads))
+        results = [payload["result"] for payload in payloads]
+        self.assertEqual([result["kind"] for result in results], ["task", "status-update", "artifact-update", "artifact-update", "status-update"])
+        self.assertEqual(results[0]["status"]["state"], "submitted")
+        self.assertEqual((results[1]["status"]["state"], results[1]["final"]), ("working", False))
+        self.assertEqual([r["artifact"]["parts"][0]["text"] for r in results[2:4]], ["Use a ", "for loop."])
+        self.assertEqual([r["append"] for r in results[2:4]], [False, True])
+        self.assertEqual((results[-1]["status"]["state"], results[-1]["final"]), ("completed", True))
+        self.assertEqual(results[-1]["status"]["message"]["parts"][0]["text"], "Use a for loop.")
+        self.assertEqual(len({result.get("taskId", result.get("id")) for result in results}), 1)
+
+    def test_stream_failure_ends_with_a_failed_status(self):
+        self.agent.error = CircuitOpen("Gemini is failing", retry_after=12)
+        response = self.request(call("message/stream"), HTTP_ACCEPT="text/event-stream")
+        results = [payload["result"] for payload in sse_payloads(streamed(response))]
+        response.close()
+        self.assertEqual(results[-2]["kind"], "artifact-update")
+        self.assertEqual((results[-1]["status"]["state"], results[-1]["final"]), ("failed", True))
+
+    def test_non_blocking_send_then_get_and_cancel(self):
+        self.agent.release.clear()
+        task = self.post(call(configuration={"blocking": False}))["result"]
+        self.assertEqual(task["status"]["state"], "submitted")
+
+        got = self.post(task_call("tasks/get", task["id"]))["result"]
+        self.assertEqual(got["id"], task["id"])
+        self.assertIn(got["status"]["state"], ("submitted", "working"))
+
+        canceled = self.post(task_call("tasks/cancel", task["id"]))["result"]
+        self.assertEqual(canceled["status"]["state"], "canceled")
+        self.agent.release.set()
+        self.wait_until_idle()
+        # The answer that arrived after the cancel is dropped.
+        self.assertEqual(self.post(task_call("tasks/get", task["id"]))["result"]["status"]["state"], "canceled")
+        self.assertError(self.post(task_call("tasks/cancel", task["id"])), TASK_NOT_CANCELABLE, request_id=2)
+        self.assertError(self.post(task_call("tasks/get", "no-such-task")), TASK_NOT_FOUND, request_id=2)
+
+    def test_non_blocking_task_completes_for_tasks_get(self):
+        task = self.post(call(configuration={"blocking": False}))["result"]
+        self.wait_until_idle()
+        done = self.post(task_call("tasks/get", task["id"]))["result"]
+        self.assertEqual(done["status"]["state"], "completed")
+        self.assertEqual(done["status"]["message"]["parts"][0]["text"], "Use a for loop.")
+
+    def test_cancel_while_queued_frees_its_queue_slot(self):
+        self.agent.release.clear()
+        running = self.post(call(configuration={"blocking": False}))["result"]
+        queued = self.post(call(configuration={"blocking": False}))["result"]
+        self.assertEqual(self.runner.queue_depth, 2)
+        self.assertError(self.post(call(configuration={"blocking": False})), SERVER_BUSY)
+
+        self.post(task_call("tasks/cancel", queued["id"]))
+        self.assertEqual(self.runner.queue_depth, 1)
+        self.assertNotIn(queued["id"], self.runner._futures)
+
+        self.agent.release.set()
+        self.wait_until_idle()
+        self.assertEqual(len(self.agent.calls), 1)
+        self.assertEqual(self.post(task_call("tasks/get", running["id"]))["result"]["status"]["state"], "completed")
+        self.assertEqual(self.post(task_call("tasks/get", queued["id"]))["result"]["status"]["state"], "canceled")
+
+
+class FastGetResponseTests(A2AViewTests, SimpleTestCase):
+    view_class = FastGetResponse
+
+
+class DRFGetResponseTests(A2AViewTests, SimpleTestCase):
+    view_class = GetResponse
+
+
+class AsyncGetResponseTests(A2AViewTests, SimpleTestCase):
+    view_class = AsyncGetResponse
+
+
+class FakeGeminiTests(SimpleTestCase):
+    """The real agent end to end, against bench/fake_gemini.py instead of Gemini."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from ai_app import ai
+
+        cls.gemini = FakeGeminiServer(latency=0.0).start()
+        cls.addClassCleanup(cls.gemini.shutdown)
+        for patcher in (
+            mock.patch.object(clients, "BASE_URL", cls.gemini.base_url),
+            mock.patch.object(clients, "api_key", "fake-key"),
+            mock.patch.object(ai, "api_key", "fake-key"),
+        ):
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+        clients.reset_client()
+        cls.addClassCleanup(clients.reset_client)
+        with mock.patch.object(ai, "build_response_cache", return_value=None):
+            cls.agent = ai.Ai_Agent()
+
+    def setUp(self):
+        patcher = mock.patch("ai_app.views.get_agent", lambda: self.agent)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, body, **headers):
+        request = RequestFactory().post(
+            "/ai/work", json.dumps(body), content_type="application/json", SERVER_NAME="localhost", **headers,
+        )
+        return FastGetResponse.as_view()(request)
+
+    def test_send(self):
+        task = json.loads(self.request(call()).content)["result"]
+        self.assertEqual(task["status"]["state"], "completed")
+        self.assertEqual(task["status"]["message"]["parts"][0]["text"], DEFAULT_TEXT)
+
+    def test_stream(self):
+        response = self.request(call("message/stream"), HTTP_ACCEPT="text/event-stream")
+        results = [payload["result"] for payload in sse_payloads(streamed(response))]
+        response.close()
+        self.assertEqual((results[-1]["status"]["state"], results[-1]["final"]), ("completed", True))
+        text = "".join(r["artifact"]["parts"][0]["text"] for r in results if r["kind"] == "artifact-update")
+        self.assertEqual(text, DEFAULT_TEXT)
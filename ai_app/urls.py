@@ -1,16 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from .views import GetResponse, get_agent_info, blog, doc
+from .views import GetResponse, FastGetResponse, AsyncGetResponse, get_agent_info, blog, doc, metrics
 
 
+if settings.A2A_ASYNC:
+    work_view = AsyncGetResponse.as_view()
+elif settings.A2A_FAST_PATH:
+    work_view = FastGetResponse.as_view()
+else:
+    work_view = GetResponse.as_view()
+
 
 urlpatterns = [
     path(".well-known/agent.json", get_agent_info, name="get_agent_info"),
-    path("work", GetResponse.as_view(), name="agent_work"),
-    path("work/", GetResponse.as_view(), name="agent_work_slash"),
+    path("work", work_view, name="agent_work"),
+    path("work/", work_view, name="agent_work_slash"),
     path("blog/", blog, name="agent_blog_slash"),
     path("blog", blog, name="agent_blog"),
     path("doc", doc, name="agent_doc"),
     path("doc/", doc, name="agent_doc_slash"),
+    path("metrics", metrics, name="agent_metrics"),
     
     
     ]
@@ -1,258 +1,437 @@
-from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import ParseError
-from .ai import Ai_Agent
-from django.http import JsonResponse
-from decouple import config
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from .ai import get_agent
+from .a2a import parse_message_send, build_task_result, conversation_id, resolve_context_id, sse_event, TaskStream, MESSAGE_METHODS
+from .tasks import get_task_runner, handle_task_method, is_non_blocking, push_config_of, TASK_METHODS
+from .assets import get_asset
+from .batch import check_batch, run_batch, run_batch_async
+from .inputs import check_content_length, has_file_uris, read_body
+from .postprocess import answer_parts_async
+from .breaker import CircuitOpen
+from .deadline import budget_of, start_deadline, use_deadline, DeadlineExceeded
+from .governor import CapacityExceeded
+from .tenants import admit, tenant_of, tracked, QuotaExceeded
+from .router import requested_tier
+from .log import SAMPLED
+from .metrics import current_trace, start_trace, timer, trace_id_of, with_trace, METRICS_TOKEN
+from . import metrics as metrics_registry
+from .jsonrpc import (
+    JsonRpcError, check_envelope, dumps, error_payload, parse_body, request_id_of, result_payload,
+    PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INTERNAL_ERROR, SERVER_BUSY, UPSTREAM_UNAVAILABLE, DEADLINE_EXCEEDED,
+    QUOTA_EXCEEDED,
+)
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 import logging
-from django.shortcuts import render
-import uuid
-from datetime import datetime
+from functools import partial
 
 logger = logging.getLogger("ai")
 
 
 def blog(request):
-    return render(request, "blog.html")
+    return get_asset("blog.html").response(request)
 
 def doc(request):
-    return render(request, "doc.html")
+    return get_asset("doc.html").response(request)
 
 def get_agent_info(request):
-    BASE_URL = config("BASE_URL", default=None)
-    agent_info = {
-        "name": "CodeHelperAgent",
-        "description": "An AI agent to help with coding questions in Python, Django, and JavaScript.",
-        "url": BASE_URL.rstrip('/') + "/ai" if BASE_URL else "https://your-deployed-app.up.railway.app/ai/",
-        "provider": {
-            "organization": "HNG Internship",
-            "url": "https://hng.tech/"
-        },
-        "version": "1.0.0",
-        "documentationUrl": BASE_URL.rstrip('/') + "/ai/docs" if BASE_URL else "https://your-deployed-app.up.railway.app/ai/docs",
-        "capabilities": {
-            "streaming": False,
-            "pushNotifications": False,
-            "stateTransitionHistory": False
-        },
-        "defaultInputModes": ["text/plain"],
-        "defaultOutputModes": ["text/plain", "application/json"],
-        "skills": [
-            {
-                "id": "coding_assistant",
-                "name": "Code Explanation & Snippets",
-                "description": "Explains programming concepts and provides code snippets for Python, Django, and JavaScript.",
-                "inputModes": ["text/plain"],
-                "outputModes": ["text/plain"],
-                "examples": [
-                    {
-                        "input": { "parts": [{"type": "text", "text": "How do I loop through a list in Python?"}] },
-                        "output": { "parts": [{"type": "text", "text": "You can loop through a list using a `for` loop:\n```python\nmy_list = ['item1', 'item2', 'item3']\nfor item in my_list:\n    print(item)\n```\nThis iterates over each element (`item`) in `my_list`."}] }
-                    },
-                    {
-                        "input": { "parts": [{"type": "text", "text": "How do I create a Django model?"}] },
-                        "output": { "parts": [{"type": "text", "text": "In Django, you create a model by subclassing `models.Model` in your `models.py`:\n```python\nfrom django.db import models\nclass MyModel(models.Model):\n    name = models.CharField(max_length=100)\n    description = models.TextField(blank=True)\n    created_at = models.DateTimeField(auto_now_add=True)\n    def __str__(self):\n        return self.name\n```\nRemember to create and run migrations after defining your model:\n```bash\npython manage.py makemigrations\npython manage.py migrate\n```"}] }
-                    }
-                ]
-            }
-        ]
-    }
-    logger.info("Serving Agent Card at /.well-known/agent.json")
-    return JsonResponse(agent_info, status=200)
-
-class GetResponse(APIView):
+    logger.info("Serving Agent Card at /.well-known/agent.json", extra=SAMPLED)
+    return get_asset("agent.json").response(request)
+
+def metrics(request):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require `Authorization: Bearer <token>`."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+    return HttpResponse(metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def json_response(payload):
+    return HttpResponse(dumps(payload), content_type="application/json")
+
+
+def wants_event_stream(request):
+    """True when the client accepts only server-sent events, not JSON."""
+    accept = request.headers.get("Accept", "")
+    return "text/event-stream" in accept and "application/json" not in accept and "*/*" not in accept
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """Finishes the stream's tenant ticket when the server closes the response.
+
+    The stream finishes it itself once it runs; this covers a stream that
+    never started, e.g. because the client went away first.
+    """
+
+    def __init__(self, events, ticket=None):
+        super().__init__(events, content_type="text/event-stream")
+        self.ticket = ticket
+
+    def close(self):
+        super().close()
+        if self.ticket is not None:
+            self.ticket.finish()
+
+
+def sse_response(events, ticket=None):
+    response = EventStreamResponse(events, ticket)
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream, which would undo
+    # the point of streaming (time to first byte).
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def stream_events(ai_agent, task_stream, deadline=None, ticket=None):
+    use_deadline(deadline)
+    if ticket is not None:
+        ticket.resume()
+    yield task_stream.start()
+    metadata = {}
+    try:
+        with tracked(ticket, metadata):
+            for text in ai_agent.gemini_stream(task_stream.user_text, meta=metadata, context_id=task_stream.conversation, tier=requested_tier(task_stream.message_data)):
+                event = task_stream.chunk(text)
+                if event:
+                    yield event
+    except Exception as e:
+        logger.error("Error while streaming from Gemini API: %s", e, exc_info=True)
+        yield task_stream.fail(f"Internal error: AI agent stream failed. Details: {str(e)}")
+        return
+    logger.info("Finished streaming A2A response to Telex IM.", extra=SAMPLED)
+    yield task_stream.complete(metadata)
+
+
+async def stream_events_async(ai_agent, task_stream, deadline=None, ticket=None):
+    use_deadline(deadline)
+    if ticket is not None:
+        ticket.resume()
+    yield task_stream.start()
+    metadata = {}
+    try:
+        with tracked(ticket, metadata):
+            async for text in ai_agent.gemini_stream_async(task_stream.user_text, meta=metadata, context_id=task_stream.conversation, tier=requested_tier(task_stream.message_data)):
+                event = task_stream.chunk(text)
+                if event:
+                    yield event
+    except Exception as e:
+        logger.error("Error while streaming from Gemini API: %s", e, exc_info=True)
+        yield task_stream.fail(f"Internal error: AI agent stream failed. Details: {str(e)}")
+        return
+    logger.info("Finished streaming A2A response to Telex IM.", extra=SAMPLED)
+    yield await task_stream.complete_async(metadata)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF accept `Accept: text/event-stream` for `message/stream`.
+
+    Streams bypass renderers (they are StreamingHttpResponse), so this only
+    renders JSON-RPC errors, as a single SSE event.
+    """
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event(data)
+
+
+class A2AHandlerMixin:
+    """JSON-RPC handling shared by the sync views.
+
+    Subclasses decide how the body is decoded (`read_body`) and how a
+    payload becomes an HTTP response (`json_response`). A JSON array is a
+    batch: its calls are handled concurrently (see batch.py) and answered
+    with an array of payloads.
+    """
+
     def post(self, request, *args, **kwargs):
-        error_response = {
-            "jsonrpc": "2.0",
-            "id": None,
-            "error": {
-                "code": -32600,
-                "message": "Invalid Request"
-            }
-        }
         try:
-            telex_request_data = request.data
-            jsonrpc_version = telex_request_data.get("jsonrpc")
-            request_id = telex_request_data.get("id")
-            request_method = telex_request_data.get("method")
-            params_data = telex_request_data.get("params", {})
-            
-            if jsonrpc_version != "2.0":
-                logger.warning(f"Invalid JSON-RPC version: {jsonrpc_version}")
-                error_resp = error_response.copy()
-                error_resp["id"] = request_id
-                error_resp["error"]["code"] = -32600
-                error_resp["error"]["message"] = f"Invalid Request: Unsupported JSON-RPC version '{jsonrpc_version}'"
-                return Response(error_resp, status=status.HTTP_200_OK)
+            with timer("parse"):
+                body = self.read_body(request)
+            if isinstance(body, list):
+                check_batch(body)
+                return self.json_response(run_batch(partial(self.handle, batched=True), body))
+        except JsonRpcError as e:
+            return self.json_response(self.error(None, e.code, e.message, e.data))
+        result = self.handle(body)
+        return self.json_response(result) if isinstance(result, dict) else result
+
+    def handle(self, body, batched=False):
+        """Answer one JSON-RPC call: a payload dict, or a streaming response."""
+        request_id = None
+        try:
+            request_id = request_id_of(body)
+            with timer("validate"):
+                request_id, request_method, params_data = check_envelope(body)
+                # Reset for every call: the context outlives the request on a reused thread.
+                deadline = start_deadline(budget_of(self.request, request_method))
+                if request_method in MESSAGE_METHODS:
+                    message_data, user_text = parse_message_send(params_data)
             
             if request_method == "message/send":
-                message_data = params_data.get("message", {})
-                
-                if not isinstance(message_data, dict):
-                    logger.error("Malformed message parameter in A2A request.")
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32600
-                    error_resp["error"]["message"] = "Invalid Request: 'params.message' is not an object."
-                    return Response(error_resp, status=status.HTTP_200_OK)
-                
-                message_id = message_data.get("messageId")
-                message_parts = message_data.get("parts", [])
-                
-                if not isinstance(message_parts, list) or len(message_parts) == 0:
-                    logger.error("Malformed message parts in A2A request.")
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32600
-                    error_resp["error"]["message"] = "Invalid Request: 'params.message.parts' is missing, not a list, or empty."
-                    return Response(error_resp, status=status.HTTP_200_OK)
-                
-                first_part_data = message_parts[0]
-                
-                if not isinstance(first_part_data, dict):
-                    logger.error("First message part is not an object in A2A request.")
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32600
-                    error_resp["error"]["message"] = "Invalid Request: First message part is not an object."
-                    return Response(error_resp, status=status.HTTP_200_OK)
-                
-                # Check for 'kind' first (A2A standard), then fall back to 'type'
-                part_kind = first_part_data.get("kind") or first_part_data.get("type")
-                
-                if part_kind != "text":
-                    logger.error(f"First message part kind is not 'text', got '{part_kind}'.")
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32600
-                    error_resp["error"]["message"] = f"Invalid Request: First message part kind is not 'text', got '{part_kind}'."
-                    return Response(error_resp, status=status.HTTP_200_OK)
+                logger.info("Processing A2A message (Request ID: %s, Message ID: %s): '%s...'", request_id, message_data.get('messageId'), user_text[:50], extra=SAMPLED)
                 
-                user_text = first_part_data.get("text", "").strip()
+                metadata = {}
+                context_id = resolve_context_id(message_data)
+                conversation = conversation_id(message_data, tenant_of(self.request, params_data, message_data))
+                if is_non_blocking(params_data):
+                    # Everything that can fail comes first; the runner owns the ticket from submit() on.
+                    push_config, runner, ai_agent = push_config_of(params_data), get_task_runner(), get_agent()
+                    ticket = admit(self.request, params_data, message_data, user_text)
+                    task = runner.submit(message_data, user_text, context_id, ai_agent, push_config, ticket, conversation)
+                    return result_payload(request_id, task)
                 
-                if not user_text:
-                    logger.warning("User message text is empty in A2A request.")
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32600
-                    error_resp["error"]["message"] = "Invalid Request: 'params.message.parts[0].text' is empty."
-                    return Response(error_resp, status=status.HTTP_200_OK)
-                
-                logger.info(f"Processing A2A message (Request ID: {request_id}, Message ID: {message_id}): '{user_text[:50]}...'")
+                ticket = admit(self.request, params_data, message_data, user_text)
                 
                 try:
-                    ai_agent = Ai_Agent()
-                    ai_agent_response = ai_agent.gemini_response(user_text)
-                    
-                    # Create response parts with proper A2A structure
-                    parts_response = [
-                        {
-                            "kind": "text",
-                            "text": ai_agent_response,
-                        }
-                    ]
+                    with tracked(ticket, metadata):
+                        ai_agent = get_agent()
+                        ai_agent_response = ai_agent.gemini_response(user_text, meta=metadata, context_id=conversation, tier=requested_tier(message_data))
+                except CapacityExceeded as e:
+                    return self.error(request_id, SERVER_BUSY, f"Server busy: {e}", {"retryAfter": e.retry_after})
+                except CircuitOpen as e:
+                    return self.error(request_id, UPSTREAM_UNAVAILABLE, f"Upstream unavailable: {e}", {"retryAfter": e.retry_after})
+                except DeadlineExceeded as e:
+                    return self.error(request_id, DEADLINE_EXCEEDED, f"Deadline exceeded: {e}", {"deadline": e.budget})
+                except QuotaExceeded as e:
+                    # A long message's map calls are charged once the call runs.
+                    return self.error(request_id, QUOTA_EXCEEDED, f"Quota exceeded: {e}", {"retryAfter": e.retry_after, "tenant": e.tenant})
                 except Exception as e:
-                    logger.error(f"Error calling AI agent: {e}", exc_info=True)
-                    error_resp = error_response.copy()
-                    error_resp["id"] = request_id
-                    error_resp["error"]["code"] = -32603
-                    error_resp["error"]["message"] = f"Internal error: AI agent is unreachable at the moment. Details: {str(e)}"
-                    return Response(error_resp, status=status.HTTP_200_OK)
-                
-                # Generate proper IDs
-                response_message_id = str(uuid.uuid4())
-                task_id = str(uuid.uuid4())
-                context_id = message_id or str(uuid.uuid4())
-                
-                # Build the response message in A2A format
-                response_message = {
-                    "kind": "message",
-                    "role": "agent",
-                    "parts": parts_response,
-                    "messageId": response_message_id,
-                    "taskId": task_id
-                }
+                    logger.error("Error calling AI agent: %s", e, exc_info=True)
+                    return self.error(request_id, INTERNAL_ERROR, f"Internal error: AI agent is unreachable at the moment. Details: {str(e)}")
                 
-                # Build artifacts
-                artifacts = [
-                    {
-                        "artifactId": str(uuid.uuid4()),
-                        "name": "agent_response",
-                        "parts": [{"kind": "text", "text": ai_agent_response}]
-                    },
-                    {
-                        "artifactId": str(uuid.uuid4()),
-                        "name": "original_query",
-                        "parts": [{"kind": "text", "text": user_text}]
-                    }
-                ]
+                result_data = build_task_result(message_data, user_text, ai_agent_response, metadata, context_id)
                 
-                # Build history
-                history = [
-                    {
-                        "kind": "message",
-                        "role": "user",
-                        "parts": [{"kind": "text", "text": user_text}],
-                        "messageId": message_id
-                    },
-                    response_message
-                ]
+                logger.info("Sending A2A response back to Telex IM.", extra=SAMPLED)
+                return result_payload(request_id, result_data)
+            
+            elif request_method == "message/stream":
+                if batched:
+                    return self.error(request_id, INVALID_REQUEST, "Invalid Request: 'message/stream' cannot be used in a batch.")
+                logger.info("Streaming A2A message (Request ID: %s, Message ID: %s): '%s...'", request_id, message_data.get('messageId'), user_text[:50], extra=SAMPLED)
                 
-                # Build the task result
-                result_data = {
-                    "id": task_id,
-                    "contextId": context_id,
-                    "kind": "task",
-                    "status": {
-                        "state": "completed",
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "message": response_message
-                    },
-                    "artifacts": artifacts,
-                    "history": history
-                }
+                try:
+                    ai_agent = get_agent()
+                except Exception as e:
+                    logger.error("Error calling AI agent: %s", e, exc_info=True)
+                    return self.error(request_id, INTERNAL_ERROR, f"Internal error: AI agent is unreachable at the moment. Details: {str(e)}")
                 
-                logger.info("Sending A2A response back to Telex IM.")
-                return Response({
-                    "jsonrpc": jsonrpc_version,
-                    "id": request_id,
-                    "result": result_data
-                }, status=status.HTTP_200_OK)
+                task_stream = TaskStream(request_id, message_data, user_text, conversation_id(message_data, tenant_of(self.request, params_data, message_data)))
+                ticket = admit(self.request, params_data, message_data, user_text)
+                return sse_response(stream_events(ai_agent, task_stream, deadline, ticket), ticket)
+            
+            elif request_method in TASK_METHODS:
+                return result_payload(request_id, handle_task_method(request_method, params_data))
             
             else:
-                logger.warning(f"Unknown method received in A2A request: {request_method}")
-                error_resp = error_response.copy()
-                error_resp["id"] = request_id
-                error_resp["error"]["code"] = -32601
-                error_resp["error"]["message"] = f"Method not found: {request_method}"
-                return Response(error_resp, status=status.HTTP_200_OK)
-                
-        except ParseError as e:
-            logger.error(f"Error parsing JSON in A2A request body: {e}")
-            error_resp = error_response.copy()
-            error_resp["id"] = None
-            error_resp["error"]["code"] = -32700
-            error_resp["error"]["message"] = f"Parse error: {str(e)}"
-            return Response(error_resp, status=status.HTTP_200_OK)
+                logger.warning("Unknown method received in A2A request: %s", request_method)
+                return self.error(request_id, METHOD_NOT_FOUND, f"Method not found: {request_method}")
+        
+        except JsonRpcError as e:
+            return self.error(request_id, e.code, e.message, e.data)
+
+        except QuotaExceeded as e:
+            return self.error(request_id, QUOTA_EXCEEDED, f"Quota exceeded: {e}", {"retryAfter": e.retry_after, "tenant": e.tenant})
             
         except Exception as e:
-            logger.critical(f"Unexpected error in GetResponse A2A view: {e}", exc_info=True)
-            error_resp = error_response.copy()
-            error_resp["id"] = request_id if 'request_id' in locals() else None
-            error_resp["error"]["code"] = -32603
-            error_resp["error"]["message"] = f"Internal server error during A2A processing: {str(e)}"
-            return Response(error_resp, status=status.HTTP_200_OK)
-
-    def error_response(self, request_id, code, message):
-        error_response_data = {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "error": {
-                "code": code,
-                "message": message
-            }
-        }
-        logger.debug(f"Sending JSON-RPC error response: ID={request_id}, Code={code}, Message={message}")
-        return Response(error_response_data, status=status.HTTP_200_OK)
\ No newline at end of file
+            logger.critical("Unexpected error in %s A2A view: %s", type(self).__name__, e, exc_info=True)
+            return self.error(request_id, INTERNAL_ERROR, f"Internal server error during A2A processing: {str(e)}")
+
+    def error(self, request_id, code, message, data=None):
+        logger.debug("Sending JSON-RPC error response: ID=%s, Code=%s, Message=%s", request_id, code, message)
+        return error_payload(request_id, code, message, data)
+
+
+class GetResponse(A2AHandlerMixin, APIView):
+    """/ai/work through DRF: content negotiation, parsers and renderers (A2A_FAST_PATH=False)."""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer]
+
+    def dispatch(self, request, *args, **kwargs):
+        start_trace(trace_id_of(request))
+        with timer("request"):
+            return super().dispatch(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            trace = current_trace()
+            if trace is not None and isinstance(response.data, (dict, list)):
+                response.data = with_trace(response.data, trace)
+            # Django would render it later anyway; doing it here lets us time it.
+            with timer("serialize"):
+                response.render()
+        return response
+
+    def read_body(self, request):
+        check_content_length(request)
+        try:
+            return request.data
+        except ParseError as e:
+            logger.error("Error parsing JSON in A2A request body: %s", e)
+            raise JsonRpcError(PARSE_ERROR, f"Parse error: {str(e)}")
+
+    def json_response(self, payload):
+        return Response(payload, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class FastGetResponse(A2AHandlerMixin, View):
+    """/ai/work on plain Django: the body is decoded once and the payload
+    encoded straight to bytes (with orjson when it is installed).
+
+    Same JSON-RPC behaviour as GetResponse without DRF's request wrapping,
+    content negotiation and renderer pipeline on every call.
+    """
+    http_method_names = ["post", "options"]
+
+    def dispatch(self, request, *args, **kwargs):
+        start_trace(trace_id_of(request))
+        with timer("request"):
+            return super().dispatch(request, *args, **kwargs)
+
+    def read_body(self, request):
+        return parse_body(read_body(request))
+
+    def json_response(self, payload):
+        trace = current_trace()
+        if trace is not None:
+            payload = with_trace(payload, trace)
+        with timer("serialize"):
+            if wants_event_stream(self.request):
+                # What GetResponse's EventStreamRenderer does for stream errors.
+                return HttpResponse(sse_event(payload), content_type="text/event-stream")
+            return json_response(payload)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncGetResponse(View):
+    """Async twin of GetResponse for ASGI deployments.
+
+    Gemini is called through the SDK's async client, so one worker can keep
+    many upstream requests in flight instead of parking a thread on each.
+    """
+    http_method_names = ["post", "options"]
+
+    async def dispatch(self, request, *args, **kwargs):
+        start_trace(trace_id_of(request))
+        with timer("request"):
+            return await super().dispatch(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            with timer("parse"):
+                body = parse_body(read_body(request))
+            if isinstance(body, list):
+                check_batch(body)
+                return self.json_response(await run_batch_async(partial(self.handle, batched=True), body))
+        except JsonRpcError as e:
+            return self.json_response(self.error(None, e.code, e.message, e.data))
+        result = await self.handle(body)
+        return self.json_response(result) if isinstance(result, dict) else result
+
+    async def handle(self, body, batched=False):
+        """Answer one JSON-RPC call: a payload dict, or a streaming response."""
+        request_id = None
+        try:
+            request_id = request_id_of(body)
+            with timer("validate"):
+                request_id, request_method, params_data = check_envelope(body)
+                deadline = start_deadline(budget_of(self.request, request_method))
+                if request_method in MESSAGE_METHODS:
+                    if has_file_uris(params_data):
+                        # Files are fetched over the network; not on the event loop, nor
+                        # one at a time on the shared thread-sensitive thread.
+                        message_data, user_text = await sync_to_async(parse_message_send, thread_sensitive=False)(params_data)
+                    else:
+                        message_data, user_text = parse_message_send(params_data)
+
+            if request_method == "message/send":
+                logger.info("Processing A2A message (Request ID: %s, Message ID: %s): '%s...'", request_id, message_data.get('messageId'), user_text[:50], extra=SAMPLED)
+
+                metadata = {}
+                context_id = resolve_context_id(message_data)
+                conversation = conversation_id(message_data, tenant_of(self.request, params_data, message_data))
+                if is_non_blocking(params_data):
+                    # Everything that can fail comes first; the runner owns the ticket from submit() on.
+                    # Checking the webhook host resolves it, which blocks.
+                    push_config = await sync_to_async(push_config_of, thread_sensitive=False)(params_data)
+                    runner, ai_agent = get_task_runner(), get_agent()
+                    ticket = admit(self.request, params_data, message_data, user_text)
+                    task = await sync_to_async(runner.submit, thread_sensitive=False)(message_data, user_text, context_id, ai_agent, push_config, ticket, conversation)
+                    return result_payload(request_id, task)
+
+                ticket = admit(self.request, params_data, message_data, user_text)
+
+                try:
+                    with tracked(ticket, metadata):
+                        ai_agent = get_agent()
+                        ai_agent_response = await ai_agent.gemini_response_async(user_text, meta=metadata, context_id=conversation, tier=requested_tier(message_data))
+                except CapacityExceeded as e:
+                    return self.error(request_id, SERVER_BUSY, f"Server busy: {e}", {"retryAfter": e.retry_after})
+                except CircuitOpen as e:
+                    return self.error(request_id, UPSTREAM_UNAVAILABLE, f"Upstream unavailable: {e}", {"retryAfter": e.retry_after})
+                except DeadlineExceeded as e:
+                    return self.error(request_id, DEADLINE_EXCEEDED, f"Deadline exceeded: {e}", {"deadline": e.budget})
+                except QuotaExceeded as e:
+                    # A long message's map calls are charged once the call runs.
+                    return self.error(request_id, QUOTA_EXCEEDED, f"Quota exceeded: {e}", {"retryAfter": e.retry_after, "tenant": e.tenant})
+                except Exception as e:
+                    logger.error("Error calling AI agent: %s", e, exc_info=True)
+                    return self.error(request_id, INTERNAL_ERROR, f"Internal error: AI agent is unreachable at the moment. Details: {str(e)}")
+
+                parts = await answer_parts_async(ai_agent_response)
+                result_data = build_task_result(message_data, user_text, ai_agent_response, metadata, context_id, parts=parts)
+
+                logger.info("Sending A2A response back to Telex IM.", extra=SAMPLED)
+                return result_payload(request_id, result_data)
+
+            elif request_method == "message/stream":
+                if batched:
+                    return self.error(request_id, INVALID_REQUEST, "Invalid Request: 'message/stream' cannot be used in a batch.")
+                logger.info("Streaming A2A message (Request ID: %s, Message ID: %s): '%s...'", request_id, message_data.get('messageId'), user_text[:50], extra=SAMPLED)
+
+                try:
+                    ai_agent = get_agent()
+                except Exception as e:
+                    logger.error("Error calling AI agent: %s", e, exc_info=True)
+                    return self.error(request_id, INTERNAL_ERROR, f"Internal error: AI agent is unreachable at the moment. Details: {str(e)}")
+
+                task_stream = TaskStream(request_id, message_data, user_text, conversation_id(message_data, tenant_of(self.request, params_data, message_data)))
+                ticket = admit(self.request, params_data, message_data, user_text)
+                return sse_response(stream_events_async(ai_agent, task_stream, deadline, ticket), ticket)
+
+            elif request_method in TASK_METHODS:
+                task = await sync_to_async(handle_task_method)(request_method, params_data)
+                return result_payload(request_id, task)
+
+            else:
+                logger.warning("Unknown method received in A2A request: %s", request_method)
+                return self.error(request_id, METHOD_NOT_FOUND, f"Method not found: {request_method}")
+
+        except JsonRpcError as e:
+            return self.error(request_id, e.code, e.message, e.data)
+
+        except QuotaExceeded as e:
+            return self.error(request_id, QUOTA_EXCEEDED, f"Quota exceeded: {e}", {"retryAfter": e.retry_after, "tenant": e.tenant})
+
+        except Exception as e:
+            logger.critical("Unexpected error in AsyncGetResponse A2A view: %s", e, exc_info=True)
+            return self.error(request_id, INTERNAL_ERROR, f"Internal server error during A2A processing: {str(e)}")
+
+    def json_response(self, payload):
+        trace = current_trace()
+        if trace is not None:
+            payload = with_trace(payload, trace)
+        with timer("serialize"):
+            return json_response(payload)
+
+    def error(self, request_id, code, message, data=None):
+        logger.debug("Sending JSON-RPC error response: ID=%s, Code=%s, Message=%s", request_id, code, message)
+        return error_payload(request_id, code, message, data)
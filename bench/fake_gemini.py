@@ -0,0 +1,296 @@
+"""A tiny stand-in for the Gemini REST API, for load tests that must not spend quota.
+
+Run it, then point the agent at it with GEMINI_BASE_URL=http://127.0.0.1:<port>/
+(any GEMINI_API_KEY value works):
+
+    python -m bench.fake_gemini --port 8090 --latency 0.5 --token-delay 0.02
+
+It is a single asyncio loop speaking just enough HTTP/1.1 (keep-alive,
+Content-Length bodies, chunked SSE for `:streamGenerateContent`) for the
+SDK, so it never becomes the bottleneck.
+
+To look like the real service under load it can also:
+
+- draw the time to first token from a distribution (`--distribution`
+  fixed, uniform, exponential or lognormal, spread set by `--jitter`),
+  seeded so runs are reproducible
+- answer a fraction of generate calls with 429 RESOURCE_EXHAUSTED (with a
+  RetryInfo delay, as Gemini does) or with 500/503 errors
+- refuse calls above `--rpm` requests per minute with 429
+- rate limit or slow down particular models (`--rate-limit-models`,
+  `--model-latency`), to exercise the agent's model fallback
+- report usageMetadata with a prompt token count estimated from the request
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+DEFAULT_TEXT = "You can loop through a list in Python using a `for` loop:\n```python\nfor item in my_list:\n    print(item)\n```"
+
+
+class FakeGeminiServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, text=DEFAULT_TEXT, token_delay=0.0,
+                 distribution="fixed", jitter=0.0, rate_limit_rate=0.0, error_rate=0.0, rpm=0,
+                 retry_after=1.0, seed=None, rate_limit_models=(), model_latency=None):
+        self.host = host
+        self.port = port
+        # `latency` is the (mean) time to the first token, `token_delay` the
+        # gap between tokens; a non-streaming answer waits for all of them.
+        self.latency = latency
+        self.token_delay = token_delay
+        self.distribution = distribution
+        self.jitter = jitter
+        self.text = text
+        # Fractions of generate calls answered with 429 / a 5xx error.
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.rate_limit_models = set(rate_limit_models)
+        # Mean time to first token per model name, instead of `latency`.
+        self.model_latency = dict(model_latency or {})
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.statuses = Counter()
+        self._recent = deque()
+        self._loop = None
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def tokens(self):
+        return re.findall(r"\S+\s*|\s+", self.text)
+
+    def sample_latency(self, model=None):
+        """Seconds to the first token for one call, drawn from the configured distribution."""
+        latency = self.model_latency.get(model, self.latency)
+        if self.distribution == "uniform":
+            return max(0.0, self.random.uniform(latency - self.jitter, latency + self.jitter))
+        if self.distribution == "exponential":
+            return self.random.expovariate(1 / latency) if latency > 0 else 0.0
+        if self.distribution == "lognormal" and latency > 0:
+            # `jitter` is sigma; mu is chosen so the mean stays `latency`.
+            sigma = self.jitter
+            return self.random.lognormvariate(math.log(latency) - sigma * sigma / 2, sigma)
+        return latency
+
+    @staticmethod
+    def model_of(path):
+        match = re.search(r"/models/([^/:?]+)", path)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def prompt_tokens(request_body):
+        # About four characters per token, like the agent's own estimate.
+        try:
+            contents = json.loads(request_body).get("contents", [])
+        except ValueError:
+            return 0
+        text = "".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+        return max(1, len(text) // 4)
+
+    def chunk_body(self, text, finished, request_body=b""):
+        chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+        if finished:
+            chunk["candidates"][0]["finishReason"] = "STOP"
+            prompt = self.prompt_tokens(request_body) if request_body else 10
+            usage = {"promptTokenCount": prompt, "candidatesTokenCount": len(self.tokens()), "totalTokenCount": prompt + len(self.tokens())}
+            if b'"cachedContent"' in request_body:
+                # Report the cached prefix the way Gemini does.
+                usage["cachedContentTokenCount"] = 8
+            chunk["usageMetadata"] = usage
+        return json.dumps(chunk).encode()
+
+    def response_body(self, path, request_body):
+        if ":batchEmbedContents" in path:
+            return self.embedding_body(request_body)
+        if "/cachedContents" in path:
+            return self.cached_content_body(path)
+        return self.chunk_body(self.text, True, request_body)
+
+    def injected_error(self, model=None):
+        """(status, body) to fail a generate call with, or None to answer it."""
+        if model in self.rate_limit_models:
+            return 429, self.error_body(429, "RESOURCE_EXHAUSTED", f"Quota exceeded for model {model}.", self.retry_after)
+        now = time.monotonic()
+        if self.rpm:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.rpm:
+                return 429, self.error_body(429, "RESOURCE_EXHAUSTED", "Quota exceeded for requests per minute.", 60 - (now - self._recent[0]))
+            self._recent.append(now)
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429, self.error_body(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).", self.retry_after)
+        if roll < self.rate_limit_rate + self.error_rate:
+            status = self.random.choice((500, 503))
+            return status, self.error_body(status, "INTERNAL" if status == 500 else "UNAVAILABLE", "The service is currently unavailable.")
+        return None
+
+    @staticmethod
+    def error_body(code, status, message, retry_after=None):
+        error = {"code": code, "message": message, "status": status}
+        if retry_after is not None:
+            error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{max(retry_after, 0):.3f}s"}]
+        return json.dumps({"error": error}).encode()
+
+    @staticmethod
+    def cached_content_body(path):
+        name = path.split("/cachedContents", 1)[1].strip("/").split("?", 1)[0] or "fake-system"
+        return json.dumps({"name": f"cachedContents/{name}", "model": "models/gemini-2.5-flash"}).encode()
+
+    @staticmethod
+    def embedding_body(request_body):
+        # Bag-of-words hashing: same words -> same vector, so semantic cache
+        # lookups behave plausibly without a real embedding model.
+        embeddings = []
+        for item in json.loads(request_body).get("requests", []):
+            text = " ".join(part.get("text", "") for part in item.get("content", {}).get("parts", []))
+            values = [0.0] * 64
+            for word in re.findall(r"\w+", text.lower()):
+                values[hash(word) % 64] += 1.0
+            embeddings.append({"values": values})
+        return json.dumps({"embeddings": embeddings}).encode()
+
+    async def write_response(self, writer, path, body):
+        generate = ":generateContent" in path or ":streamGenerateContent" in path
+        model = self.model_of(path)
+        failure = self.injected_error(model) if generate else None
+        if failure is not None:
+            status, payload = failure
+            self.statuses[status] += 1
+            reason = {429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}[status]
+            headers = f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+            if status == 429:
+                headers += f"Retry-After: {max(1, math.ceil(self.retry_after))}\r\n"
+            writer.write(headers.encode() + b"\r\n" + payload)
+            await writer.drain()
+            return
+        self.statuses[200] += 1
+        latency = self.sample_latency(model)
+
+        if ":streamGenerateContent" not in path:
+            await asyncio.sleep(latency + self.token_delay * len(self.tokens()))
+            payload = self.response_body(path, body)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                + payload
+            )
+            await writer.drain()
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await asyncio.sleep(latency)
+        tokens = self.tokens()
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            last = index == len(tokens) - 1
+            event = b"data: " + self.chunk_body(token, last, body if last else b"") + b"\r\n\r\n"
+            writer.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                await self.write_response(writer, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        """Serve from a background thread and return once the port is bound."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def serve_forever(self):
+        asyncio.run(self._serve_forever())
+
+    async def _serve_forever(self):
+        await self._serve()
+        async with self._server:
+            await self._server.serve_forever()
+
+
+def add_arguments(parser):
+    """Fake Gemini options, shared with the benchmark scripts."""
+    parser.add_argument("--latency", type=float, default=0.5, help="(mean) seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform: +/- seconds; lognormal: sigma")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500/503")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 above this many calls per minute")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry delay advertised on injected 429s")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--rate-limit-models", default="", help="comma-separated models that always answer 429")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="mean time to first token for one model (repeatable)")
+
+
+def server_from_args(args, host="127.0.0.1", port=0):
+    return FakeGeminiServer(
+        host, port, args.latency, token_delay=args.token_delay, distribution=args.distribution, jitter=args.jitter,
+        rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate, rpm=args.rpm,
+        retry_after=args.retry_after, seed=args.seed,
+        rate_limit_models=[model for model in args.rate_limit_models.split(",") if model],
+        model_latency={name: float(value) for name, _, value in (item.partition("=") for item in args.model_latency)},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args, args.host, args.port)
+    print(f"Fake Gemini listening on {server.base_url} (latency {args.latency}s, {args.distribution})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
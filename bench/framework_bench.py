@@ -0,0 +1,92 @@
+"""Requests/sec of the /ai/work framework layer alone, with Gemini stubbed out.
+
+Each variant calls the view in-process with a RequestFactory request, so
+the numbers cover body parsing, validation, task building and serialization
+(no sockets, no server, no upstream):
+
+    python -m bench.framework_bench --requests 20000
+
+Variants: `drf` (GetResponse), `fast` (FastGetResponse) and `fast-compact`
+(FastGetResponse with A2A_COMPACT_RESULTS). `--stdlib-json` runs the fast
+views without orjson to show what the library itself is worth.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ANSWER = (
+    "You can loop through a list using a `for` loop:\n```python\nmy_list = ['item1', 'item2', 'item3']\n"
+    "for item in my_list:\n    print(item)\n```\nThis iterates over each element (`item`) in `my_list`."
+)
+
+PAYLOAD = (
+    b'{"jsonrpc":"2.0","id":1,"method":"message/send","params":{"message":{"kind":"message","role":"user",'
+    b'"messageId":"bench","parts":[{"kind":"text","text":"How do I loop through a list in Python?"}]}}}'
+)
+
+
+class StubAgent:
+    """Answers instantly, so only the framework layer is measured."""
+
+    def gemini_response(self, user_text, meta=None, context_id=None, tier=None):
+        return ANSWER
+
+
+def setup():
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ai_agent.settings")
+    # Request logging is not what is being measured here.
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import django
+
+    django.setup()
+    from ai_app import ai
+
+    ai._agent = StubAgent()
+
+
+def run(view, total):
+    from django.test import RequestFactory
+
+    factory = RequestFactory()
+    size = 0
+    for _ in range(200):  # warm up
+        view(factory.post("/ai/work", PAYLOAD, content_type="application/json"))
+    started = time.perf_counter()
+    for _ in range(total):
+        response = view(factory.post("/ai/work", PAYLOAD, content_type="application/json"))
+        size = len(response.content)
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_s": round(total / elapsed),
+        "us_per_request": round(elapsed / total * 1e6, 1),
+        "response_bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--variants", default="drf,fast,fast-compact")
+    parser.add_argument("--stdlib-json", action="store_true", help="encode/decode with the json module, not orjson")
+    args = parser.parse_args()
+
+    setup()
+    from ai_app import a2a, jsonrpc
+    from ai_app.views import FastGetResponse, GetResponse
+
+    if args.stdlib_json:
+        jsonrpc.orjson = None
+    print(f"json: {'orjson' if jsonrpc.orjson is not None else 'stdlib'}, {args.requests} requests per variant")
+    views = {"drf": GetResponse.as_view(), "fast": FastGetResponse.as_view(), "fast-compact": FastGetResponse.as_view()}
+    for variant in args.variants.split(","):
+        a2a.A2A_COMPACT_RESULTS = variant.endswith("-compact")
+        print(variant, run(views[variant], args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Compare sync (gunicorn threads, WSGI) and async (uvicorn, ASGI) throughput of /ai/work.
+
+Both servers talk to a local fake Gemini (see bench/fake_gemini.py), so the
+run costs no quota and the upstream latency is fixed:
+
+    python -m bench.load_test --requests 400 --concurrency 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from .fake_gemini import FakeGeminiServer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PAYLOAD = {
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "message/send",
+    "params": {"message": {"messageId": "bench", "parts": [{"kind": "text", "text": "How do I loop through a list in Python?"}]}},
+}
+
+# Every request sends the same PAYLOAD: without these the server would answer
+# all but the first from its response cache (or coalesce them into one call)
+# and the run would measure cache hits instead of the request path.
+SERVER_ENV = {"RESPONSE_CACHE_BACKEND": "none", "SINGLEFLIGHT_ENABLED": "False"}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(mode, port, workers, threads):
+    if mode == "sync":
+        return [sys.executable, "-m", "gunicorn", "ai_agent.wsgi:application", "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", "ai_agent.asgi:application", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning"]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def drive(url, total, concurrency, payload=PAYLOAD):
+    """Send `total` requests from `concurrency` workers and summarise latency.
+
+    Each worker owns a one-connection client: a single shared httpx pool with
+    hundreds of busy connections spends most of its CPU in pool bookkeeping
+    and would become the bottleneck instead of the server under test.
+    A response counts as an error unless it is HTTP 200 without a JSON-RPC
+    error or a failed task in it.
+    """
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal errors, remaining
+        async with httpx.AsyncClient(timeout=120) as client:
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=payload)
+                    body = response.content
+                    if response.status_code != 200 or b'"error":{' in body or b'"state":"failed"' in body:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+def run_mode(mode, args, gemini_url):
+    port = free_port()
+    env = dict(os.environ, GEMINI_BASE_URL=gemini_url, GEMINI_API_KEY="fake-key", A2A_ASYNC=str(mode == "async"), **SERVER_ENV)
+    process = subprocess.Popen(server_command(mode, port, args.workers, args.threads), cwd=ROOT, env=env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/ai/.well-known/agent.json")
+        return asyncio.run(drive(f"http://127.0.0.1:{port}/ai/work", args.requests, args.concurrency))
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini latency in seconds")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (sync mode)")
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    gemini = FakeGeminiServer(latency=args.latency).start()
+    print(f"fake Gemini at {gemini.base_url}, latency={args.latency}s, {args.requests} requests @ concurrency {args.concurrency}")
+    for mode in args.modes.split(","):
+        print(mode, run_mode(mode, args, gemini.base_url))
+    gemini.shutdown()
+
+
+if __name__ == "__main__":
+    main()
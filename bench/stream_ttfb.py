@@ -0,0 +1,64 @@
+"""Measure time-to-first-byte of `message/send` versus `message/stream`.
+
+The fake Gemini waits --latency seconds for the first token and then emits
+one token every --token-delay seconds, so a blocking answer only arrives
+after the whole completion while the stream starts with the first token:
+
+    python -m bench.stream_ttfb --latency 0.3 --token-delay 0.02 --mode async
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import time
+
+import httpx
+
+from .fake_gemini import FakeGeminiServer
+from .load_test import PAYLOAD, ROOT, free_port, server_command, wait_until_up
+
+
+def measure(client, url, method):
+    """Return (seconds to the first body byte, seconds to the last) for one call."""
+    payload = dict(PAYLOAD, method=method)
+    started = time.perf_counter()
+    first_byte = None
+    first_token = None
+    with client.stream("POST", url, json=payload, headers={"Accept": "text/event-stream, application/json"}) as response:
+        for chunk in response.iter_bytes():
+            now = time.perf_counter()
+            if first_byte is None:
+                first_byte = now - started
+            if first_token is None and (b"artifact-update" in chunk or (method == "message/send" and b'"result"' in chunk)):
+                first_token = now - started
+    return first_byte, first_token, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--mode", choices=["sync", "async"], default="async")
+    args = parser.parse_args()
+
+    gemini = FakeGeminiServer(latency=args.latency, token_delay=args.token_delay).start()
+    port = free_port()
+    env = dict(os.environ, GEMINI_BASE_URL=gemini.base_url, GEMINI_API_KEY="fake-key", A2A_ASYNC=str(args.mode == "async"))
+    process = subprocess.Popen(server_command(args.mode, port, 1, 4), cwd=ROOT, env=env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/ai/.well-known/agent.json")
+        url = f"http://127.0.0.1:{port}/ai/work"
+        with httpx.Client(timeout=60) as client:
+            for method in ("message/send", "message/stream"):
+                samples = [measure(client, url, method) for _ in range(args.requests)]
+                ttfb, first_token, total = (statistics.median(column) * 1000 for column in zip(*samples))
+                print(f"{method:15} median TTFB {ttfb:7.1f} ms  first token {first_token:7.1f} ms  complete {total:7.1f} ms")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        gemini.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Benchmark /ai/work at fixed concurrency levels against the fake Gemini.
+
+Starts the fake Gemini (bench/fake_gemini.py) and one server (gunicorn for
+`sync`, uvicorn for `async`), then for every concurrency level sends
+--requests calls and records p50/p95/p99 latency, throughput, errors and
+the resident memory of each worker process. Every level is appended as one
+JSON line to --output, together with the git commit and the settings used,
+so runs can be compared over time:
+
+    python -m bench.suite --mode sync --levels 1,16,64 --requests 400 \\
+        --latency 0.3 --distribution lognormal --jitter 0.5 --rate-limit-rate 0.02
+
+Extra server settings can be passed as NAME=VALUE with --env (repeatable),
+e.g. --env A2A_COMPACT_RESULTS=True. The response cache and single flight
+are off unless turned on that way (see load_test.SERVER_ENV); the settings
+in force are stored with the results.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .fake_gemini import add_arguments, server_from_args
+from .load_test import PAYLOAD, ROOT, SERVER_ENV, drive, free_port, server_command, wait_until_up
+
+DEFAULT_OUTPUT = ROOT / "bench" / "results" / "benchmarks.jsonl"
+
+
+def worker_pids(server_pid):
+    """The server's worker processes: its children, or itself when it has none."""
+    children = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces; the parent pid follows the ")".
+        if int(stat.rsplit(")", 1)[1].split()[1]) == server_pid:
+            children.append(int(entry.name))
+    return sorted(children) or [server_pid]
+
+
+def rss_mb(pid):
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        env[name] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--levels", default="1,8,32,64", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per level")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (sync mode)")
+    parser.add_argument("--method", choices=["message/send", "message/stream"], default="message/send")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra server setting")
+    parser.add_argument("--label", default="", help="free text stored with the results")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    gemini = server_from_args(args).start()
+    port = free_port()
+    extra_env = dict(SERVER_ENV, **parse_env(args.env))
+    env = dict(os.environ, GEMINI_BASE_URL=gemini.base_url, GEMINI_API_KEY="fake-key",
+               A2A_ASYNC=str(args.mode == "async"), **extra_env)
+    process = subprocess.Popen(server_command(args.mode, port, args.workers, args.threads), cwd=ROOT, env=env)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "mode": args.mode,
+        "workers": args.workers,
+        "threads": args.threads if args.mode == "sync" else None,
+        "method": args.method,
+        "env": extra_env,
+        "response_cache": extra_env["RESPONSE_CACHE_BACKEND"],
+        "gemini": {
+            "latency": args.latency, "distribution": args.distribution, "jitter": args.jitter,
+            "token_delay": args.token_delay, "rate_limit_rate": args.rate_limit_rate,
+            "error_rate": args.error_rate, "rpm": args.rpm, "seed": args.seed,
+            "rate_limit_models": args.rate_limit_models, "model_latency": args.model_latency,
+        },
+    }
+    payload = dict(PAYLOAD, method=args.method)
+    url = f"http://127.0.0.1:{port}/ai/work"
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    print(f"{args.mode} server, fake Gemini {args.distribution} latency {args.latency}s, {args.requests} requests per level")
+    print(f"{'conc':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  rss MB per worker")
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/ai/.well-known/agent.json")
+        # Every worker pays its import and agent set-up on its first call;
+        # keep that out of the first level.
+        asyncio.run(drive(url, 4 * args.workers, 2 * args.workers, payload))
+        for level in [int(level) for level in args.levels.split(",")]:
+            upstream_before = dict(gemini.statuses)
+            result = asyncio.run(drive(url, args.requests, level, payload))
+            result["concurrency"] = level
+            result["rss_mb"] = [rss_mb(pid) for pid in worker_pids(process.pid)]
+            result["upstream_statuses"] = {
+                str(status): count - upstream_before.get(status, 0) for status, count in gemini.statuses.items()
+                if count - upstream_before.get(status, 0)
+            }
+            with args.output.open("a") as handle:
+                handle.write(json.dumps(dict(run, **result)) + "\n")
+            print(f"{level:>5} {result['throughput_rps']:>8} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+                  f"{result['p99_ms']:>9} {result['errors']:>7}  {result['rss_mb']}")
+            time.sleep(0.5)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        gemini.shutdown()
+    print(f"results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Cost and effect of per-tenant quotas and fair queueing (tenants.py).
+
+Three measurements, all in-process with Gemini stubbed out:
+
+- ``overhead``: microseconds per call of working out the tenant, admitting
+  the call against its quotas and counting its usage, and of a governor
+  acquire/release with and without a fair-queueing share
+- ``view``: requests/sec of FastGetResponse with TENANTS_ENABLED off and on
+  (the end-to-end price on the request path)
+- ``fairness``: one noisy tenant queues a burst of calls, then quiet tenants
+  send a few each; shows how long the quiet ones wait in the governor
+  queue in arrival order and with fair queueing
+
+    python -m bench.tenant_bench --calls 100000 --noisy 200 --quiet 10
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from bench.framework_bench import PAYLOAD, run, setup
+
+
+def per_call(fn, calls):
+    for _ in range(min(calls, 1000)):  # warm up
+        fn()
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+
+def overhead(calls):
+    from django.test import RequestFactory
+    from ai_app import governor, tenants
+
+    request = RequestFactory().post("/ai/work", PAYLOAD, content_type="application/json", HTTP_X_TENANT_ID="org-1/general")
+    params = {"message": {"metadata": {"org_id": "org-1", "channel_id": "general"}}}
+    pool = tenants.Tenants(600000, 100000000, {}, {}, True, 3600.0, 10000)
+    usage = {"usage": {"prompt_tokens": 20, "cached_tokens": 0, "output_tokens": 120, "total_tokens": 140}}
+
+    def admit_finish():
+        pool.admit("org-1/general", "How do I loop through a list in Python?").finish(usage)
+
+    gov = governor.Governor(0, 0, 32, 256, 30.0, 0, 1.0)
+
+    def acquire_release():
+        gov.acquire(510)
+        gov.release(510, 140)
+
+    results = {
+        "tenant_of_header_us": per_call(lambda: tenants.tenant_of(request, params), calls),
+        "tenant_of_metadata_us": per_call(lambda: tenants.tenant_of(None, params, params["message"]), calls),
+        "admit_finish_us": per_call(admit_finish, calls),
+        "governor_arrival_order_us": per_call(acquire_release, calls),
+    }
+    governor.use_share(("org-1/general", 1.0))
+    results["governor_fair_us"] = per_call(acquire_release, calls)
+    governor.use_share(None)
+    return results
+
+
+def view(total):
+    from ai_app import tenants
+    from ai_app.views import FastGetResponse
+
+    fast = FastGetResponse.as_view()
+    off = run(fast, total)
+    tenants.TENANTS_ENABLED = True
+    tenants._tenants = tenants.Tenants(0, 0, {}, {}, True, 3600.0, 10000)
+    on = run(fast, total)
+    tenants.TENANTS_ENABLED = False
+    tenants._tenants = None
+    return {"tenants_off": off, "tenants_on": on}
+
+
+def fairness(fair, noisy, quiet, per_quiet, concurrency, service):
+    """Queue waits (ms) of the noisy tenant's calls and of the quiet tenants' calls."""
+    from ai_app import governor
+
+    gov = governor.Governor(0, 0, concurrency, 100000, 600.0, 0, 1.0)
+    waits = {"noisy": [], "quiet": []}
+    lock = threading.Lock()
+
+    def call(kind, tenant):
+        governor.use_share((tenant, 1.0) if fair else None)
+        started = time.perf_counter()
+        gov.acquire(510)
+        waited = time.perf_counter() - started
+        time.sleep(service)
+        gov.release(510, 510)
+        with lock:
+            waits[kind].append(waited * 1000)
+
+    threads = [threading.Thread(target=call, args=("noisy", "noisy")) for _ in range(noisy)]
+    for thread in threads:
+        thread.start()
+    time.sleep(service * 2)
+    quiet_threads = [
+        threading.Thread(target=call, args=("quiet", f"quiet-{i}")) for i in range(quiet) for _ in range(per_quiet)
+    ]
+    for thread in quiet_threads:
+        thread.start()
+    for thread in threads + quiet_threads:
+        thread.join()
+    return {
+        kind: {
+            "p50_ms": round(statistics.median(values), 1),
+            "max_ms": round(max(values), 1),
+        }
+        for kind, values in waits.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100000, help="calls per overhead measurement")
+    parser.add_argument("--requests", type=int, default=20000, help="requests per view variant")
+    parser.add_argument("--noisy", type=int, default=200, help="calls the noisy tenant queues at once")
+    parser.add_argument("--quiet", type=int, default=10, help="quiet tenants")
+    parser.add_argument("--per-quiet", type=int, default=2, help="calls per quiet tenant")
+    parser.add_argument("--concurrency", type=int, default=4, help="governor concurrency in the fairness run")
+    parser.add_argument("--service", type=float, default=0.01, help="seconds a stubbed Gemini call holds its slot")
+    parser.add_argument("--only", default="overhead,view,fairness")
+    args = parser.parse_args()
+
+    setup()
+    only = args.only.split(",")
+    if "overhead" in only:
+        print("overhead", overhead(args.calls))
+    if "view" in only:
+        print("view", view(args.requests))
+    if "fairness" in only:
+        for fair in (False, True):
+            waits = fairness(fair, args.noisy, args.quiet, args.per_quiet, args.concurrency, args.service)
+            print("fairness", "fair queueing" if fair else "arrival order", waits)
+
+
+if __name__ == "__main__":
+    main()